@@ -27,12 +27,16 @@ st.set_page_config(
 # ── GLOBAL CSS ──
 st.markdown(GLOBAL_CSS, unsafe_allow_html=True)
 
-# ── INIT DB ──
-db.init_db()
+# ── INIT DB (solo la primera vez por proceso) ──
+db.bootstrap()
+db.start_dispatcher()  # hilo del outbox: idempotente, uno por proceso
+db.start_scheduler()   # recordatorios y mantenimiento: un hilo por proceso, uno activo entre procesos
 
 # --- LÓGICA DE LOGIN Y SEGURIDAD ---
-if "authenticated" not in st.session_state:
-    st.session_state.authenticated = False
+# La clave se verifica una sola vez al entrar; en cada rerun el token firmado
+# se resuelve en memoria (db.sesion_activa) sin volver a leer credenciales.
+sesion = db.sesion_activa(st.session_state.get("sesion_token"))
+st.session_state.authenticated = sesion is not None
 
 if not st.session_state.authenticated:
     st.markdown(f"## {APP_ICON} Bienvenido a {APP_NAME}")
@@ -40,19 +44,21 @@ if not st.session_state.authenticated:
         email_input = st.text_input("Correo electrónico").lower().strip()
         pass_input = st.text_input("Contraseña", type="password")
         if st.form_submit_button("Entrar a la Odisea", type="primary"):
-            user = db.get_user(email_input)
-            if user and pass_input == user["password"]:
-                st.session_state.authenticated = True
+            token, sesion = db.iniciar_sesion(email_input, pass_input)
+            if token:
+                st.session_state.sesion_token = token
                 st.session_state.current_user = email_input
-                st.session_state.user_rol = user["rol"]
+                st.session_state.user_rol = sesion["rol"]
                 st.rerun()
             else:
                 st.error("Credenciales incorrectas.")
     st.stop()
 
+# ── CONTEXTO DEL RERUN: una sola carga compartida por sidebar y páginas ──
+st.session_state.ctx = db.load_user_context(st.session_state.current_user)
+
 # --- MODAL DE CAMBIO DE CONTRASEÑA OBLIGATORIO ---
-user_data = db.get_user(st.session_state.current_user)
-if user_data["password"] == "Itaca2026!":
+if sesion["must_change"]:
     st.warning("⚠️ **Seguridad requerida:** Debes cambiar tu contraseña inicial antes de continuar.")
     with st.form("change_password_form"):
         new_pass = st.text_input("Nueva contraseña", type="password", help="Elige algo seguro que solo tú sepas.")
@@ -62,10 +68,11 @@ if user_data["password"] == "Itaca2026!":
                 st.error("La contraseña debe tener al menos 6 caracteres.")
             elif new_pass != confirm_pass:
                 st.error("Las contraseñas no coinciden.")
-            elif new_pass == "Itaca2026!":
+            elif new_pass == db.PASSWORD_INICIAL:
                 st.error("No puedes usar la contraseña inicial.")
             else:
-                db.update_password(st.session_state.current_user, new_pass)
+                # El cambio invalida el token anterior: update_password abre una sesión nueva
+                st.session_state.sesion_token, _ = db.update_password(sesion["email"], new_pass)
                 st.success("¡Contraseña actualizada! Bienvenido a bordo.")
                 st.balloons()
                 st.rerun()
@@ -88,6 +95,7 @@ PAGE_MAP = {
     "Mi Brújula": "pages.brujula",
     "Mis Logros": "pages.logros",
     "Notificaciones": "pages.notificaciones",
+    "Buscar": "pages.buscar",
     "Admin Dashboard": "pages.admin",
 }
 
@@ -0,0 +1,36 @@
+"""Listas con "Cargar más" sobre las APIs de paginación keyset de database.py"""
+import streamlit as st
+
+PREFIX = "pag_"
+
+def paged_rows(key, fetch, page_size=20):
+    """Filas de la lista `key`: la primera página, pedida de nuevo en cada
+    rerun (es una consulta por índice con LIMIT), más las páginas que el
+    usuario fue cargando con "Cargar más".
+
+    `fetch(limit, cursor)` debe devolver (filas, siguiente_cursor).
+    En session_state solo quedan los cursores y las páginas extra; si la
+    primera página cambió de corte (llegaron o se borraron filas), las
+    extras ya no empalman y se descartan.
+    """
+    skey = PREFIX + key
+    rows, cursor = fetch(page_size, None)
+    state = st.session_state.get(skey)
+    if state is None or state["primero"] != cursor:
+        state = st.session_state[skey] = {"primero": cursor, "cursor": cursor, "mas": []}
+    return rows + state["mas"]
+
+def load_more_button(key, fetch, page_size=20, label="⬇️ Cargar más"):
+    state = st.session_state.get(PREFIX + key)
+    if state and state["cursor"] and st.button(label, key=f"more_{key}", use_container_width=True):
+        rows, cursor = fetch(page_size, state["cursor"])
+        state["mas"].extend(rows)
+        state["cursor"] = cursor
+        st.rerun()
+
+def reset(*keys):
+    """Olvidar las páginas cargadas (tras una escritura o al cambiar de página).
+    Sin argumentos borra todas las listas paginadas."""
+    for k in list(st.session_state.keys()):
+        if k.startswith(PREFIX) and (not keys or k[len(PREFIX):] in keys):
+            del st.session_state[k]
@@ -2,6 +2,12 @@
 import streamlit as st
 from config import APP_NAME, APP_ICON, TURQ, TURQ_DARK
 import database as db
+from components import paging
+
+def _ir_a_busqueda():
+    if st.session_state.get("busqueda_q", "").strip():
+        st.session_state.current_page = "Buscar"
+        paging.reset()
 
 def render_sidebar():
     with st.sidebar:
@@ -9,20 +15,31 @@ def render_sidebar():
         st.caption("Plataforma de Gestión y Desarrollo Humano")
         st.divider()
 
-        # User selector (en producción sería auth real)
-        users = db.get_all_users()
-        emails = [u["email"] for u in users]
-        names = [f"{u['nombre']} ({u['rol']})" for u in users]
-        
-        if "current_user" not in st.session_state:
-            st.session_state.current_user = emails[0] if emails else ""
-        
-        idx = emails.index(st.session_state.current_user) if st.session_state.current_user in emails else 0
-        selected = st.selectbox("👤 Sesión como:", names, index=idx, key="user_select")
-        st.session_state.current_user = emails[names.index(selected)]
+        # Con login real el selector "Sesión como" deja de ser para todos: solo una
+        # sesión Admin puede navegar como otro usuario; el resto ve su propia cuenta
+        sesion = db.sesion_activa(st.session_state.get("sesion_token"))
+        ctx = st.session_state.get("ctx") or db.load_user_context(st.session_state.get("current_user", ""))
+        if sesion and sesion["rol"] == "Admin":
+            users = ctx["usuarios"]
+            emails = [u["email"] for u in users]
+            names = [f"{u['nombre']} ({u['rol']})" for u in users]
+
+            if "current_user" not in st.session_state:
+                st.session_state.current_user = emails[0] if emails else ""
+
+            idx = emails.index(st.session_state.current_user) if st.session_state.current_user in emails else 0
+            selected = st.selectbox("👤 Sesión como:", names, index=idx, key="user_select")
+            st.session_state.current_user = emails[names.index(selected)]
+        elif sesion:
+            st.session_state.current_user = sesion["email"]
         
-        user = db.get_user(st.session_state.current_user)
-        identidad = db.get_identidad(st.session_state.current_user)
+        # Solo se recarga el contexto si el selector cambió de usuario
+        if ctx["email"] != st.session_state.current_user:
+            ctx = db.load_user_context(st.session_state.current_user)
+            paging.reset()
+        st.session_state.ctx = ctx
+        user = ctx["user"]
+        identidad = ctx["identidad"]
         rol = user["rol"] if user else "Colaborador"
         st.session_state.user_rol = rol
         st.session_state.user_name = user["nombre"] if user else ""
@@ -34,12 +51,15 @@ def render_sidebar():
             d = DISC_TYPES.get(disc, {})
             st.markdown(f"**DISC:** {d.get('emoji','')} {disc}")
         
-        puntos = db.get_total_puntos(st.session_state.current_user)
-        unread = db.count_unread(st.session_state.current_user)
+        puntos = ctx["puntos"]
+        unread = ctx["unread"]
         st.markdown(f"**⭐ Puntos:** {puntos}")
         if unread:
             st.markdown(f"**🔔 Notificaciones:** {unread} nueva{'s' if unread>1 else ''}")
         
+        st.text_input("🔎 Buscar", key="busqueda_q", placeholder="Personas, faros, tu journal…",
+                      on_change=_ir_a_busqueda)
+        
         st.divider()
         
         # Navigation
@@ -66,7 +86,13 @@ def render_sidebar():
                 if st.button(label, key=f"nav_{name}", use_container_width=True,
                            type="primary" if st.session_state.current_page == name else "secondary"):
                     st.session_state.current_page = name
+                    paging.reset()
                     st.rerun()
         
         st.divider()
+        if st.button("🚪 Cerrar sesión", key="logout", use_container_width=True):
+            db.cerrar_sesion(st.session_state.pop("sesion_token", None))
+            for k in ("current_user", "ctx", "user_rol"):
+                st.session_state.pop(k, None)
+            st.rerun()
         st.caption(f"v2.0 · Odisea 2026")
@@ -129,6 +129,31 @@ COMPETENCIAS_IE = [
 # ── ESCALA DE EVALUACIÓN ──
 ESCALA = {1: "Crítico", 2: "En riesgo", 3: "En desarrollo", 4: "Sólido", 5: "Ejemplar"}
 
+# ── BADGES ──
+# Reglas declarativas: el badge se otorga cuando `contador` llega a `umbral`.
+# Los contadores terminados en _mes se llevan por mes calendario y
+# racha_checkins cuenta semanas ISO consecutivas con check-in.
+BADGES = [
+    {"id": "FIRST_FARO", "icono": "🔦", "nombre": "Primer Faro", "desc": "Envía tu primer faro",
+     "puntos": 10, "categoria": "Cultura", "contador": "faros_enviados", "umbral": 1},
+    {"id": "ILUMINADOR", "icono": "🔦", "nombre": "Iluminador", "desc": "5 faros en un mes",
+     "puntos": 25, "categoria": "Cultura", "contador": "faros_enviados_mes", "umbral": 5},
+    {"id": "BIENESTAR_CONSTANTE", "icono": "💙", "nombre": "Bienestar Constante", "desc": "4 check-ins consecutivos",
+     "puntos": 15, "categoria": "Cultura", "contador": "racha_checkins", "umbral": 4},
+    {"id": "FIRST_JOURNAL", "icono": "📝", "nombre": "Primer Journal", "desc": "1 entrada de journal",
+     "puntos": 10, "categoria": "IE", "contador": "journal", "umbral": 1},
+    {"id": "ESCRITOR_EMOCIONAL", "icono": "📝", "nombre": "Escritor Emocional", "desc": "10 entradas de journal",
+     "puntos": 25, "categoria": "IE", "contador": "journal", "umbral": 10},
+    {"id": "PRIMERA_RESPIRACION", "icono": "🎯", "nombre": "Primera Respiración", "desc": "1 ejercicio completado",
+     "puntos": 10, "categoria": "IE", "contador": "ejercicios", "umbral": 1},
+    {"id": "BRUJULA_CALIBRADA", "icono": "🧠", "nombre": "Brújula Calibrada", "desc": "Primera autoevaluación IE",
+     "puntos": 15, "categoria": "IE", "contador": "brujula", "umbral": 1},
+    {"id": "HEXAGONO_ACTIVO", "icono": "🧭", "nombre": "Hexágono Activo", "desc": "Primera evaluación de liderazgo",
+     "puntos": 15, "categoria": "Liderazgo", "contador": "hexagono", "umbral": 1},
+    {"id": "ESTRELLA_RECONOCIDA", "icono": "⭐", "nombre": "Estrella Reconocida", "desc": "5 faros recibidos en un mes",
+     "puntos": 30, "categoria": "Cultura", "contador": "faros_recibidos_mes", "umbral": 5},
+]
+
 # ── CSS GLOBAL ──
 GLOBAL_CSS = """
 <style>
@@ -2,23 +2,1070 @@
 Ítaca OS 2.0 - Base de Datos SQLite
 Todas las tablas, seed data, y operaciones CRUD
 """
-import sqlite3, json, os
+import sqlite3
+import json
+import os
+import atexit
+import base64
+import builtins
+import csv
+import functools
+import hashlib
+import hmac
+import io
+import itertools
+import queue
+import random
+import re
+import secrets
+import socket
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 from contextlib import contextmanager
 
 # Robust path that works in Streamlit Cloud, local, and any CWD
 _THIS_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(_THIS_DIR, "data", "itaca.db")
+DB_PATH = os.environ.get("ITACA_DB_PATH") or os.path.join(_THIS_DIR, "data", "itaca.db")
+
+# ═══════════════════════════════════════════
+# CONFIGURACIÓN DE ALMACENAMIENTO
+# ═══════════════════════════════════════════
+# WAL permite que los lectores no bloqueen al escritor (muchas sesiones de
+# Streamlit sobre el mismo itaca.db). Cada valor se puede sobrescribir con
+# la variable de entorno ITACA_DB_<NOMBRE>, p.ej. ITACA_DB_BUSY_TIMEOUT=10000.
+STORAGE_CONFIG = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",     # seguro con WAL; solo fsync en checkpoint
+    "busy_timeout": 5000,        # ms que SQLite espera un lock antes de SQLITE_BUSY
+    "cache_size": -16000,        # negativo = KiB → 16 MB de page cache por conexión
+    "mmap_size": 134217728,      # 128 MB de lecturas por memory-map
+    "temp_store": "MEMORY",
+}
+for _k in STORAGE_CONFIG:
+    _v = os.environ.get(f"ITACA_DB_{_k.upper()}")
+    if _v:
+        STORAGE_CONFIG[_k] = int(_v) if _v.lstrip("-").isdigit() else _v
+
+# Reintentos ante SQLITE_BUSY en las escrituras (backoff exponencial + jitter)
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05  # segundos, se duplica en cada intento
+
+# ═══════════════════════════════════════════
+# POOL DE CONEXIONES
+# ═══════════════════════════════════════════
+# Streamlit ejecuta cada rerun en su propio hilo. En vez de abrir y cerrar
+# una conexión por cada consulta, reutilizamos conexiones ya configuradas
+# (una cola por archivo de BD). Cada conexión la usa un solo hilo a la vez.
+POOL_SIZE = int(os.environ.get("ITACA_DB_POOL_SIZE", "8"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+def _configure_connection(conn):
+    """PRAGMAs por conexión: se aplican una sola vez, al abrirla."""
+    for name, value in STORAGE_CONFIG.items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+def _open_connection(path):
+    timeout = STORAGE_CONFIG["busy_timeout"] / 1000
+    conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    _configure_connection(conn)
+    return conn
+
+def _get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = queue.LifoQueue(maxsize=POOL_SIZE)
+        return pool
+
+_traza = {"callback": None}
+
+def _acquire():
+    path = DB_PATH
+    try:
+        conn = _get_pool(path).get_nowait()
+    except queue.Empty:
+        conn = _open_connection(path)
+    conn.set_trace_callback(_traza["callback"])
+    return path, conn
+
+def _release(path, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _get_pool(path).put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+def close_pool():
+    """Cerrar todas las conexiones en reposo (tests, benchmarks, cambio de DB_PATH)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+@contextmanager
+def trace_sql(callback):
+    """Llamar callback(sql) con cada sentencia (parámetros ya expandidos) que
+    ejecuten las conexiones entregadas dentro del bloque. Para verificar
+    planes de consulta; no pensado para producción."""
+    _traza["callback"] = callback
+    try:
+        yield
+    finally:
+        _traza["callback"] = None
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Conexión del pool. Dentro de transaction() reutiliza la conexión activa
+    y deja el commit a la transacción externa."""
+    active = getattr(_local, "conn", None)
+    if active is not None:
+        yield active
+        return
+    path, conn = _acquire()
     try:
         yield conn
         conn.commit()
+        _avisar_outbox()
     finally:
-        conn.close()
+        _release(path, conn)
+
+@contextmanager
+def transaction(immediate=False):
+    """Agrupa varias operaciones en una sola conexión y un solo commit.
+
+    Todas las llamadas a get_db() (y por tanto a las funciones CRUD) hechas
+    dentro del bloque usan la misma conexión. Con immediate=True se toma el
+    lock de escritura al inicio (BEGIN IMMEDIATE), útil para leer-y-escribir.
+    Si el bloque lanza una excepción se hace rollback de todo.
+    """
+    if getattr(_local, "conn", None) is not None:
+        yield _local.conn
+        return
+    path, conn = _acquire()
+    _local.conn = conn
+    _local.pending_tags = set()
+    try:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+        _avisar_outbox()
+    finally:
+        _local.conn = None
+        _release(path, conn)
+        invalidate(*_local.pending_tags)
+
+def _is_busy(exc):
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    msg = str(exc)
+    return "locked" in msg or "busy" in msg
+
+def retry_on_busy(fn):
+    """Reintenta la escritura si la BD está bloqueada por otro escritor.
+
+    Dentro de transaction() no se reintenta: la transacción externa ya se
+    perdió y debe decidir quien la abrió.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        delay = BUSY_BACKOFF
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if (not _is_busy(e) or attempt == BUSY_RETRIES
+                        or getattr(_local, "conn", None) is not None):
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+    return wrapper
+
+# ═══════════════════════════════════════════
+# CACHÉ DE CONSULTAS COMPARTIDAS
+# ═══════════════════════════════════════════
+# Lecturas que devuelven lo mismo a todas las sesiones (muro de faros,
+# usuarios, unidades, analytics) se guardan en memoria del proceso con TTL.
+# Cada función cacheada declara tags; las escrituras con @invalidates(tag)
+# borran esas entradas al terminar (o al commit de transaction()). El TTL
+# cubre escrituras hechas por otros procesos.
+CACHE_TTL = float(os.environ.get("ITACA_CACHE_TTL", "30"))
+CACHE_MAX_ENTRIES = int(os.environ.get("ITACA_CACHE_MAX_ENTRIES", "256"))
+
+_cache = OrderedDict()          # key -> (expira, tags, valor), en orden LRU
+_cache_lock = threading.Lock()
+_tag_versions = {}              # tag -> contador de invalidaciones
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_cache_fn_stats = {}            # función -> [hits, misses]
+
+def _copy_result(value):
+    # Copia superficial para que quien llama no mute la entrada cacheada
+    if isinstance(value, list):
+        return [dict(v) if isinstance(v, dict) else v for v in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+def cached(*tags, ttl=None):
+    """Read-through cache por proceso para una función de lectura."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "conn", None) is not None:
+                return fn(*args, **kwargs)  # dentro de una transacción: leer lo propio
+            key = (DB_PATH, fn.__name__, args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            with _cache_lock:
+                fn_stats = _cache_fn_stats.setdefault(fn.__name__, [0, 0])
+                entry = _cache.get(key)
+                if entry is not None and entry[0] > now:
+                    _cache.move_to_end(key)
+                    _cache_stats["hits"] += 1
+                    fn_stats[0] += 1
+                    return _copy_result(entry[2])
+                _cache_stats["misses"] += 1
+                fn_stats[1] += 1
+                versions = [_tag_versions.get(t, 0) for t in tags]
+            value = fn(*args, **kwargs)
+            with _cache_lock:
+                # Si hubo una escritura mientras leíamos, no guardar un valor viejo
+                if versions == [_tag_versions.get(t, 0) for t in tags]:
+                    _cache[key] = (now + (CACHE_TTL if ttl is None else ttl), tags, value)
+                    _cache.move_to_end(key)
+                    while len(_cache) > CACHE_MAX_ENTRIES:
+                        _cache.popitem(last=False)
+                        _cache_stats["evictions"] += 1
+            return _copy_result(value)
+        wrapper.cache_tags = tags
+        return wrapper
+    return decorator
+
+def invalidate(*tags):
+    """Borrar las entradas cacheadas con cualquiera de estos tags."""
+    if not tags:
+        return
+    if getattr(_local, "conn", None) is not None:
+        _local.pending_tags.update(tags)  # se aplica al cerrar transaction()
+        return
+    tags = set(tags)
+    with _cache_lock:
+        for t in tags:
+            _tag_versions[t] = _tag_versions.get(t, 0) + 1
+        stale = [k for k, (_, entry_tags, _) in _cache.items() if tags.intersection(entry_tags)]
+        for k in stale:
+            del _cache[k]
+        _cache_stats["invalidations"] += len(stale)
+
+def invalidates(*tags):
+    """Decorador para escrituras: invalida `tags` cuando la función termina."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                invalidate(*tags)
+        return wrapper
+    return decorator
+
+def cache_clear():
+    with _cache_lock:
+        _cache.clear()
+        for t in list(_tag_versions):
+            _tag_versions[t] += 1
+
+def cache_stats():
+    """Contadores globales y por función para el panel admin."""
+    with _cache_lock:
+        total = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats, "entries": len(_cache), "max_entries": CACHE_MAX_ENTRIES,
+            "ttl": CACHE_TTL, "hit_rate": round(100 * _cache_stats["hits"] / total, 1) if total else 0.0,
+            "por_funcion": {name: {"hits": h, "misses": m} for name, (h, m) in sorted(_cache_fn_stats.items())},
+        }
+
+# ═══════════════════════════════════════════
+# OUTBOX Y EVENTOS DE DOMINIO
+# ═══════════════════════════════════════════
+# Cada escritura de negocio agrega con _emitir() un evento a `outbox` en su
+# misma transacción: si la escritura hace rollback, el evento tampoco
+# existe. Los consumidores se registran con @consumer(nombre, *tipos) y
+# dispatch() les entrega, en lotes de OUTBOX_BATCH y en orden de
+# evento_id, lo posterior a su offset en outbox_offsets. El consumidor y el
+# avance de su offset corren en una transacción: si falla no se mueve el
+# offset y el lote se reintenta (al menos una vez), así que un consumidor
+# debe ser idempotente. start_dispatcher() deja un hilo por proceso que
+# despacha al confirmarse cada evento (y cada OUTBOX_INTERVALO segundos).
+OUTBOX_BATCH = 500
+OUTBOX_INTERVALO = 1.0
+OUTBOX_RETENCION_DIAS = 30
+
+_consumidores = {}              # nombre -> (fn(db, eventos), tipos)
+_despertar = threading.Event()  # lo marca el commit de una transacción con eventos
+_dispatcher_lock = threading.Lock()
+_dispatcher = {"thread": None}
+
+def _crear_outbox(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+        evento_id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, email TEXT,
+        ref TEXT, datos TEXT, fecha TEXT NOT NULL)""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_tipo ON outbox(tipo, evento_id)")
+    db.execute("""CREATE TABLE IF NOT EXISTS outbox_offsets (
+        consumidor TEXT PRIMARY KEY, ultimo_evento INTEGER NOT NULL DEFAULT 0,
+        entregados INTEGER NOT NULL DEFAULT 0, errores INTEGER NOT NULL DEFAULT 0,
+        ultimo_error TEXT, fecha TEXT)""")
+
+def _emitir(db, tipo, email, ref=None, **datos):
+    """Agregar un evento al outbox con la conexión (y transacción) de quien escribe."""
+    db.execute("INSERT INTO outbox (tipo, email, ref, datos, fecha) VALUES (?,?,?,?,?)",
+               (tipo, email, ref, json.dumps(datos, ensure_ascii=False, default=str),
+                datetime.now().isoformat()))
+    _local.outbox = True
+
+def _emitir_varios(db, tipo, eventos):
+    """Igual que _emitir para muchos eventos: [(email, ref, datos)]."""
+    if not eventos:
+        return
+    now = datetime.now().isoformat()
+    db.executemany("INSERT INTO outbox (tipo, email, ref, datos, fecha) VALUES (?,?,?,?,?)",
+                   [(tipo, email, ref, json.dumps(datos, ensure_ascii=False, default=str), now)
+                    for email, ref, datos in eventos])
+    _local.outbox = True
+
+def _avisar_outbox():
+    """Tras un commit: si la transacción emitió eventos, despertar al despachador."""
+    if getattr(_local, "outbox", False):
+        _local.outbox = False
+        _despertar.set()
+
+def consumer(nombre, *tipos):
+    """Registrar fn(db, eventos) como consumidor de los eventos `tipos` (todos
+    si no se indica ninguno). Cada evento es un dict con evento_id, tipo,
+    email, ref, datos (ya decodificado) y fecha."""
+    def decorator(fn):
+        _consumidores[nombre] = (fn, tipos)
+        return fn
+    return decorator
+
+def _leer_eventos(db, desde, tipos, limit):
+    filtro = f" AND tipo IN ({','.join('?' * len(tipos))})" if tipos else ""
+    filas = db.execute(f"SELECT * FROM outbox WHERE evento_id > ?{filtro} ORDER BY evento_id LIMIT ?",
+                       (desde, *tipos, limit)).fetchall()
+    return [{**dict(r), "datos": json.loads(r["datos"] or "{}")} for r in filas]
+
+def dispatch(nombres=None, batch=OUTBOX_BATCH):
+    """Entregar a cada consumidor (o solo a `nombres`) los eventos pendientes,
+    lote por lote hasta ponerse al día. Devuelve {consumidor: eventos entregados}.
+    Si la BD está ocupada el consumidor se deja para la próxima vuelta sin
+    contar un error; cualquier otra excepción queda en errores/ultimo_error."""
+    entregados = {}
+    for nombre in nombres or list(_consumidores):
+        fn, tipos = _consumidores[nombre]
+        entregados[nombre] = 0
+        while True:
+            try:
+                with transaction(immediate=True) as db:
+                    fila = db.execute("SELECT ultimo_evento FROM outbox_offsets WHERE consumidor=?",
+                                      (nombre,)).fetchone()
+                    eventos = _leer_eventos(db, fila[0] if fila else 0, tipos, batch)
+                    if eventos:
+                        fn(db, eventos)
+                        db.execute("""INSERT INTO outbox_offsets (consumidor, ultimo_evento, entregados, fecha)
+                            VALUES (?,?,?,?) ON CONFLICT(consumidor) DO UPDATE SET
+                            ultimo_evento = excluded.ultimo_evento, fecha = excluded.fecha,
+                            entregados = entregados + excluded.entregados""",
+                            (nombre, eventos[-1]["evento_id"], len(eventos), datetime.now().isoformat()))
+            except Exception as e:
+                if isinstance(e, sqlite3.OperationalError) and _is_busy(e):
+                    break   # BD ocupada por otro escritor: no es falla del consumidor, reintenta la próxima vuelta
+                with get_db() as db:
+                    db.execute("""INSERT INTO outbox_offsets (consumidor, errores, ultimo_error, fecha)
+                        VALUES (?, 1, ?, ?) ON CONFLICT(consumidor) DO UPDATE SET errores = errores + 1,
+                        ultimo_error = excluded.ultimo_error, fecha = excluded.fecha""",
+                        (nombre, f"{type(e).__name__}: {e}", datetime.now().isoformat()))
+                break
+            entregados[nombre] += len(eventos)
+            if len(eventos) < batch:
+                break
+    return entregados
+
+def _loop_dispatcher(intervalo):
+    while True:
+        _despertar.wait(intervalo)
+        _despertar.clear()
+        try:
+            dispatch()
+        except Exception:
+            time.sleep(intervalo)  # BD ocupada o cerrándose: reintentar en la próxima vuelta
+
+def start_dispatcher(intervalo=OUTBOX_INTERVALO):
+    """Arrancar el hilo despachador si aún no corre en este proceso (idempotente)."""
+    with _dispatcher_lock:
+        t = _dispatcher["thread"]
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_loop_dispatcher, args=(intervalo,), name="itaca-outbox", daemon=True)
+            t.start()
+            _dispatcher["thread"] = t
+        return t
+
+def outbox_status():
+    """Por consumidor registrado: offset, eventos pendientes, entregados y último error."""
+    with get_db() as db:
+        offsets = {r["consumidor"]: dict(r) for r in db.execute("SELECT * FROM outbox_offsets")}
+        out = []
+        for nombre, (_, tipos) in _consumidores.items():
+            o = offsets.get(nombre, {})
+            filtro = f" AND tipo IN ({','.join('?' * len(tipos))})" if tipos else ""
+            pendientes = db.execute(f"SELECT COUNT(*) FROM outbox WHERE evento_id > ?{filtro}",
+                                    (o.get("ultimo_evento", 0), *tipos)).fetchone()[0]
+            out.append({"consumidor": nombre, "tipos": ", ".join(tipos) or "todos",
+                        "ultimo_evento": o.get("ultimo_evento", 0), "pendientes": pendientes,
+                        "entregados": o.get("entregados", 0), "errores": o.get("errores", 0),
+                        "ultimo_error": o.get("ultimo_error"), "fecha": o.get("fecha")})
+    return out
+
+def purge_outbox(dias=OUTBOX_RETENCION_DIAS):
+    """Borrar eventos de más de `dias` que ya entregaron todos los consumidores registrados."""
+    limite = (datetime.now() - timedelta(days=dias)).isoformat()
+    with get_db() as db:
+        offsets = dict(db.execute("SELECT consumidor, ultimo_evento FROM outbox_offsets").fetchall())
+        minimo = min((offsets.get(n, 0) for n in _consumidores), default=0)
+        return db.execute("DELETE FROM outbox WHERE evento_id <= ? AND fecha < ?", (minimo, limite)).rowcount
+
+# ── CONSUMIDOR: activity_log ──
+_MODULO_EVENTO = {"checkin": "Cultura", "faro": "Cultura", "journal": "Brújula", "brujula": "Brújula",
+                  "ejercicio": "Brújula", "hexagono": "Hexágono"}
+
+@consumer("actividad")
+def _registrar_actividad(db, eventos):
+    """Bitácora por usuario en activity_log; log_id = evento, así reintentar no duplica."""
+    db.executemany("""INSERT OR IGNORE INTO activity_log (log_id, email, accion, detalle, fecha, modulo)
+        VALUES (?,?,?,?,?,?)""",
+        [(f"EV_{e['evento_id']}", e["email"], e["tipo"], json.dumps(e["datos"], ensure_ascii=False),
+          e["fecha"], _MODULO_EVENTO.get(e["tipo"], "Admin")) for e in eventos])
+
+# ── CONSUMIDOR: alertas de estrés ──
+# save_checkin marca alerta_enviada=1 con estrés ≥ 4 y emite el evento
+# "checkin"; este consumidor lo convierte en notificaciones para la cadena
+# de mando (todos los ancestros de la persona en jerarquia, hasta la
+# raíz) y para los Admin activos. Un lote de eventos es una sola
+# consulta y un solo executemany dentro de la transacción de dispatch().
+# notif_id = ALERTA_<semana>_<persona>_<destinatario>: una alerta por
+# persona y semana para cada destinatario, y reintentar no duplica.
+# El estado "procesado" es el offset del consumidor; los check-ins de la
+# semana anteriores al outbox se notifican una vez en la migración 13.
+
+_ALERTAS_SQL = """
+    SELECT c.checkin_id, c.email, c.semana, c.nivel_estres, c.fecha, i.nombre, j.ancestro AS dest
+    FROM checkins c JOIN identidad i ON i.email = c.email
+    JOIN jerarquia j ON j.descendiente = c.email AND j.profundidad >= 1
+    JOIN usuarios u ON u.email = j.ancestro AND u.estado = 'Activo'
+    WHERE {filtro} AND c.alerta_enviada = 1
+    UNION
+    SELECT c.checkin_id, c.email, c.semana, c.nivel_estres, c.fecha, i.nombre, u.email
+    FROM checkins c JOIN identidad i ON i.email = c.email
+    JOIN usuarios u ON u.rol = 'Admin' AND u.estado = 'Activo' AND u.email != c.email
+    WHERE {filtro} AND c.alerta_enviada = 1"""
+
+def _crear_alertas(db):
+    db.execute("CREATE INDEX IF NOT EXISTS idx_notif_dest_tipo ON notificaciones(email_dest, tipo, fecha)")
+    _notificar_alertas(db, "c.semana = ?", (semana_key(datetime.now()),))
+
+def _notificar_alertas(db, filtro, params):
+    filas = db.execute(_ALERTAS_SQL.format(filtro=filtro), (*params, *params)).fetchall()
+    return db.executemany("""INSERT OR IGNORE INTO notificaciones
+        (notif_id, email_dest, tipo, titulo, mensaje, fecha, prioridad) VALUES (?,?,?,?,?,?,?)""",
+        [(f"ALERTA_{r['semana']}_{r['email']}_{r['dest']}", r["dest"], "Alerta", "🚨 Alerta de bienestar",
+          f"{r['nombre']} reportó estrés {r['nivel_estres']}/5 en su check-in ({r['semana']}).",
+          r["fecha"], "Alta") for r in filas]).rowcount
+
+@consumer("alertas", "checkin")
+def _alertas_estres(db, eventos):
+    ids = [e["ref"] for e in eventos if e["datos"].get("alerta")]
+    if ids:
+        _notificar_alertas(db, f"c.checkin_id IN ({','.join('?' * len(ids))})", ids)
+
+def notificar_alertas(semana=None):
+    """Emitir (sin duplicar) las alertas de los check-ins con alerta_enviada=1
+    de `semana` (la actual por defecto), p.ej. los anteriores al outbox.
+    Devuelve cuántas notificaciones nuevas se crearon."""
+    with get_db() as db:
+        return _notificar_alertas(db, "c.semana = ?", (semana or semana_key(datetime.now()),))
+
+def get_alertas(email, limit=10):
+    """Últimas notificaciones de alerta de bienestar recibidas por email."""
+    with get_db() as db:
+        return dict_rows(db.execute("""SELECT * FROM notificaciones WHERE email_dest=? AND tipo='Alerta'
+            ORDER BY fecha DESC LIMIT ?""", (email, limit)).fetchall())
+
+# ═══════════════════════════════════════════
+# PLANIFICADOR DE TAREAS
+# ═══════════════════════════════════════════
+# Trabajo periódico fuera de los reruns: recordatorios y mantenimiento.
+# Cada tarea se registra con @tarea(nombre, cuando), donde cuando(t)
+# devuelve la próxima ejecución posterior a t (cada, diario, semanal,
+# fin_de_mes). start_scheduler() deja un hilo por proceso; entre procesos
+# solo trabaja el dueño de la fila de planificador_lock, un arriendo que
+# renueva en cada vuelta y que otro proceso puede tomar cuando expira.
+# Además cada ejecución se reclama moviendo `proxima` con un UPDATE
+# condicional, así que una tarea vencida corre una sola vez aunque dos
+# procesos coincidan. Si el servidor estuvo caído, una tarea atrasada
+# corre una vez y se reprograma desde ahora. Cada corrida queda en
+# tareas_log (duración y filas) y el resumen en `tareas`.
+PLANIFICADOR_INTERVALO = 30
+TAREAS_RETENCION_DIAS = 90
+
+_tareas = {}                    # nombre -> (fn(db, ahora) -> filas, cuando(t) -> datetime)
+_planificador_lock = threading.Lock()
+_planificador = {"thread": None}
+
+def _crear_tareas(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS tareas (
+        nombre TEXT PRIMARY KEY, proxima TEXT, ultima TEXT, duracion_ms REAL, filas INTEGER,
+        ejecuciones INTEGER NOT NULL DEFAULT 0, errores INTEGER NOT NULL DEFAULT 0, ultimo_error TEXT)""")
+    db.execute("""CREATE TABLE IF NOT EXISTS tareas_log (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT, tarea TEXT NOT NULL, inicio TEXT NOT NULL,
+        duracion_ms REAL, filas INTEGER, error TEXT)""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_tareas_log_tarea ON tareas_log(tarea, run_id)")
+    db.execute("""CREATE TABLE IF NOT EXISTS planificador_lock (
+        id INTEGER PRIMARY KEY CHECK (id = 1), dueno TEXT NOT NULL, expira TEXT NOT NULL)""")
+
+# ── Cuándo corre cada tarea ──
+def cada(minutos):
+    return lambda t: t + timedelta(minutes=minutos)
+
+def diario(hora):
+    """Todos los días a las `hora`:00."""
+    def proxima(t):
+        base = t.replace(hour=hora, minute=0, second=0, microsecond=0)
+        return base if base > t else base + timedelta(days=1)
+    return proxima
+
+def semanal(dia, hora):
+    """Cada semana el `dia` (0 = lunes) a las `hora`:00."""
+    def proxima(t):
+        base = t.replace(hour=hora, minute=0, second=0, microsecond=0) + timedelta(days=(dia - t.weekday()) % 7)
+        return base if base > t else base + timedelta(days=7)
+    return proxima
+
+def fin_de_mes(dias_antes, hora):
+    """Cada mes, `dias_antes` días antes del último día, a las `hora`:00."""
+    def proxima(t):
+        inicio = t.replace(day=1, hour=hora, minute=0, second=0, microsecond=0)
+        for _ in range(2):
+            siguiente = (inicio + timedelta(days=32)).replace(day=1)
+            base = siguiente - timedelta(days=1 + dias_antes)
+            if base > t:
+                return base
+            inicio = siguiente
+    return proxima
+
+def tarea(nombre, cuando):
+    """Registrar fn(db, ahora) como tarea periódica; devuelve cuántas filas tocó.
+    Corre dentro de una transacción: si falla no deja nada a medias."""
+    def decorator(fn):
+        _tareas[nombre] = (fn, cuando)
+        return fn
+    return decorator
+
+# ── Ejecución ──
+def run_job(nombre, ahora=None):
+    """Correr ya la tarea `nombre` y reprogramarla. Devuelve el registro de la corrida."""
+    fn, cuando = _tareas[nombre]
+    ahora = ahora or datetime.now()
+    t0, filas, error = time.perf_counter(), 0, None
+    try:
+        with transaction(immediate=True) as db:
+            filas = fn(db, ahora) or 0
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    ms = round((time.perf_counter() - t0) * 1000, 2)
+    with get_db() as db:
+        db.execute("INSERT INTO tareas_log (tarea, inicio, duracion_ms, filas, error) VALUES (?,?,?,?,?)",
+                   (nombre, ahora.isoformat(), ms, filas, error))
+        db.execute("""INSERT INTO tareas (nombre, proxima, ultima, duracion_ms, filas, ejecuciones, errores, ultimo_error)
+            VALUES (?,?,?,?,?,1,?,?) ON CONFLICT(nombre) DO UPDATE SET
+            proxima = MAX(COALESCE(proxima, ''), excluded.proxima), ultima = excluded.ultima,
+            duracion_ms = excluded.duracion_ms, filas = excluded.filas, ejecuciones = ejecuciones + 1,
+            errores = errores + excluded.errores, ultimo_error = COALESCE(excluded.ultimo_error, ultimo_error)""",
+            (nombre, cuando(ahora).isoformat(), ahora.isoformat(), ms, filas, 1 if error else 0, error))
+    return {"tarea": nombre, "inicio": ahora.isoformat(), "duracion_ms": ms, "filas": filas, "error": error}
+
+def run_due_jobs(ahora=None):
+    """Correr las tareas vencidas. Una tarea nueva no corre al registrarse:
+    solo se agenda para su próxima hora."""
+    ahora = ahora or datetime.now()
+    with get_db() as db:
+        proximas = dict(db.execute("SELECT nombre, proxima FROM tareas").fetchall())
+        db.executemany("INSERT OR IGNORE INTO tareas (nombre, proxima) VALUES (?,?)",
+                       [(n, cuando(ahora).isoformat()) for n, (_, cuando) in _tareas.items() if n not in proximas])
+    corridas = []
+    for nombre, (_, cuando) in _tareas.items():
+        vence = proximas.get(nombre)
+        if not vence or vence > ahora.isoformat():
+            continue
+        with get_db() as db:
+            reclamada = db.execute("UPDATE tareas SET proxima=? WHERE nombre=? AND proxima=?",
+                                   (cuando(ahora).isoformat(), nombre, vence)).rowcount
+        if reclamada:
+            corridas.append(run_job(nombre, ahora))
+    return corridas
+
+def _tomar_lock(dueno, ahora, ttl):
+    """Tomar o renovar el arriendo del planificador. True si `dueno` lo tiene."""
+    with get_db() as db:
+        db.execute("""INSERT INTO planificador_lock (id, dueno, expira) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET dueno = excluded.dueno, expira = excluded.expira
+            WHERE planificador_lock.dueno = excluded.dueno OR planificador_lock.expira < ?""",
+            (dueno, (ahora + ttl).isoformat(), ahora.isoformat()))
+        return db.execute("SELECT dueno FROM planificador_lock WHERE id=1").fetchone()[0] == dueno
+
+def _loop_planificador(intervalo):
+    dueno = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        try:
+            flush_celebraciones()  # buffer de este proceso: en todos, no solo en el dueño del arriendo
+        except Exception:
+            pass  # volvió al buffer con su timer
+        try:
+            if _tomar_lock(dueno, datetime.now(), timedelta(seconds=intervalo * 3)):
+                run_due_jobs()
+        except Exception:
+            pass  # BD ocupada o cerrándose: reintentar en la próxima vuelta
+        time.sleep(intervalo)
+
+def start_scheduler(intervalo=PLANIFICADOR_INTERVALO):
+    """Arrancar el hilo planificador si aún no corre en este proceso (idempotente)."""
+    with _planificador_lock:
+        t = _planificador["thread"]
+        if t is None or not t.is_alive():
+            t = threading.Thread(target=_loop_planificador, args=(intervalo,), name="itaca-scheduler", daemon=True)
+            t.start()
+            _planificador["thread"] = t
+        return t
+
+def scheduler_status():
+    """Por tarea registrada: próxima y última ejecución, duración, filas y errores;
+    más el dueño actual del arriendo."""
+    with get_db() as db:
+        filas = {r["tarea"]: dict(r) for r in db.execute("SELECT nombre AS tarea, proxima, ultima, duracion_ms, "
+                                                         "filas, ejecuciones, errores, ultimo_error FROM tareas")}
+        lock = dict_row(db.execute("SELECT dueno, expira FROM planificador_lock WHERE id=1").fetchone()) or {}
+    return [{"tarea": n, "proxima": None, "ultima": None, "duracion_ms": None, "filas": None,
+             "ejecuciones": 0, "errores": 0, "ultimo_error": None, **filas.get(n, {}),
+             "dueno": lock.get("dueno"), "lock_expira": lock.get("expira")}
+            for n in _tareas]
+
+def get_job_runs(nombre, limit=20):
+    """Últimas corridas de una tarea (tareas_log), de la más reciente hacia atrás."""
+    with get_db() as db:
+        return dict_rows(db.execute("SELECT * FROM tareas_log WHERE tarea=? ORDER BY run_id DESC LIMIT ?",
+                                    (nombre, limit)).fetchall())
+
+# ── Tareas ──
+# Los recordatorios son un INSERT … SELECT: los destinatarios salen de una
+# sola consulta (activos sin la fila de este periodo) y notif_id incluye el
+# periodo, así que repetir la tarea no duplica.
+_RECORDATORIO_SQL = """INSERT OR IGNORE INTO notificaciones
+    (notif_id, email_dest, tipo, titulo, mensaje, fecha, prioridad)
+    SELECT ? || u.email, u.email, 'Recordatorio', ?, ?, ?, 'Media'
+    FROM usuarios u WHERE u.estado = 'Activo' {roles}
+      AND NOT EXISTS (SELECT 1 FROM {tabla} x WHERE x.email = u.email AND x.{columna} = ?)"""
+
+def _recordar(db, ahora, tabla, columna, valor, titulo, mensaje, roles=()):
+    filtro = f"AND u.rol IN ({','.join('?' * len(roles))})" if roles else ""
+    return db.execute(_RECORDATORIO_SQL.format(roles=filtro, tabla=tabla, columna=columna),
+                      (f"RECORDATORIO_{tabla}_{valor}_", titulo, mensaje, ahora.isoformat(),
+                       *roles, valor)).rowcount
+
+@tarea("recordatorio_checkin", semanal(3, 10))
+def _recordatorio_checkin(db, ahora):
+    return _recordar(db, ahora, "checkins", "semana", semana_key(ahora), "💙 Tu check-in semanal",
+                     "Aún no registras tu check-in de esta semana. ¡Toma 1 minuto para contarnos cómo estás!")
+
+@tarea("recordatorio_hexagono", fin_de_mes(2, 10))
+def _recordatorio_hexagono(db, ahora):
+    return _recordar(db, ahora, "hexagono", "periodo", ahora.strftime("%Y-%m"), "🧭 Autoevaluación del Hexágono",
+                     "El mes está por cerrar y aún no completas tu Hexágono de Liderazgo.",
+                     roles=("Admin", "Líder", "Coordinador"))
+
+@tarea("recordatorio_brujula", fin_de_mes(2, 10))
+def _recordatorio_brujula(db, ahora):
+    return _recordar(db, ahora, "brujula_eval", "periodo", ahora.strftime("%Y-%m"), "🧠 Autoevaluación IE del mes",
+                     "El mes está por cerrar y aún no completas tu evaluación de Brújula Emocional.")
+
+@tarea("mantenimiento", diario(3))
+def _mantenimiento(db, ahora):
+    """Purgar el outbox entregado, el historial viejo de tareas y los ids de
+    pedidos del escritor, extender el calendario para cubrir la historia y
+    refrescar estadísticas."""
+    filas = purge_outbox()
+    # pedido_id ordena por fecha: el corte es un rango de la PK
+    filas += db.execute("DELETE FROM escritor_pedidos WHERE pedido_id < ?",
+                        (nuevo_id(ahora - timedelta(hours=WRITER_PEDIDOS_RETENCION_HORAS)),)).rowcount
+    filas += db.execute("DELETE FROM tareas_log WHERE inicio < ?",
+                        ((ahora - timedelta(days=TAREAS_RETENCION_DIAS)).isoformat(),)).rowcount
+    ultimo = _fecha_o_none(db.execute("SELECT MAX(fecha) FROM checkins").fetchone()[0])
+    filas += _extender_calendario(db, max(_fin_calendario(ahora.date()), ultimo.date() if ultimo else date.min))
+    db.execute("PRAGMA optimize")
+    return filas
+
+# ═══════════════════════════════════════════
+# ESCRITOR ÚNICO (opcional)
+# ═══════════════════════════════════════════
+# Con varios procesos de Streamlit en un mismo host, cada save_* compite por
+# el lock de escritura de SQLite. Si ITACA_WRITER_SOCKET apunta al socket
+# de `python -m tools.writer`, las funciones marcadas con @via_writer se
+# envían a ese proceso, que las aplica en lotes de hasta WRITER_BATCH por
+# transacción (un solo commit; un SAVEPOINT por escritura para que un
+# error no tumbe al resto) y devuelve a cada cliente su resultado. Las
+# lecturas siguen directas. Sin socket configurado, o si el escritor no
+# acepta la conexión, la escritura se hace en el propio proceso como antes.
+# Un lote toma lo que ya está en cola y espera hasta WRITER_ESPERA por los
+# clientes conectados que aún no pidieron. Con synchronous=NORMAL un commit
+# no hace fsync: el escritor gana con transacciones largas o mucha
+# contención, no con pocas escrituras cortas (números en el README).
+# Protocolo: una línea JSON por pedido {"id", "fn", "args", "kwargs"} y una
+# por respuesta {"ok", "result"} o {"ok": false, "tipo", "error"}.
+#
+# Si el socket falla después de enviar, la escritura pudo o no confirmarse.
+# Por eso cada pedido lleva un id (nuevo_id()) que el escritor guarda en
+# escritor_pedidos en la misma transacción que la escritura: el cliente
+# reconecta y reenvía una vez el mismo pedido, y si ya estaba aplicado
+# recibe la respuesta guardada. Si tampoco así obtiene respuesta lanza
+# EscrituraIncierta, que no se debe reintentar a ciegas. Los ids se purgan
+# tras WRITER_PEDIDOS_RETENCION_HORAS en el mantenimiento diario.
+WRITER_SOCKET = os.environ.get("ITACA_WRITER_SOCKET")
+WRITER_BATCH = 64
+WRITER_ESPERA = 0.002           # segundos que un lote espera a los clientes que faltan
+WRITER_TIMEOUT = 30
+WRITER_PEDIDOS_RETENCION_HORAS = 24
+
+_escrituras = {}                # nombre -> función original (la que corre el escritor)
+_escritor = {"activo": False, "clientes": 0, "lotes": 0, "escrituras": 0, "errores": 0}
+
+class EscrituraIncierta(ConnectionError):
+    """El pedido llegó a enviarse al escritor pero no hubo respuesta: la
+    escritura pudo haberse confirmado o no. Verificar antes de repetirla."""
+
+def _crear_escritor_pedidos(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS escritor_pedidos (
+        pedido_id TEXT PRIMARY KEY, respuesta TEXT NOT NULL, fecha TEXT NOT NULL) WITHOUT ROWID""")
+
+def via_writer(fn):
+    """Enviar la escritura al proceso escritor si hay uno configurado.
+    Va debajo de @retry_on_busy/@invalidates: el caché se invalida aquí."""
+    _escrituras[fn.__name__] = fn
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not WRITER_SOCKET or _escritor["activo"] or getattr(_local, "conn", None) is not None:
+            return fn(*args, **kwargs)
+        pedido = json.dumps({"id": nuevo_id(), "fn": fn.__name__, "args": args, "kwargs": kwargs},
+                            ensure_ascii=False, default=str).encode() + b"\n"
+        linea = b""
+        for intento in range(2):
+            try:
+                sock, lector = _conexion_escritor()
+            except OSError:
+                if intento == 0:
+                    return fn(*args, **kwargs)  # escritor caído y nada enviado: escribir directo
+                break
+            try:
+                sock.sendall(pedido)
+                linea = lector.readline()
+            except OSError:
+                linea = b""
+            if linea:
+                break
+            _cerrar_escritor()  # se reenvía el mismo id: el escritor no lo aplica dos veces
+        if not linea:
+            raise EscrituraIncierta(f"sin respuesta del escritor para {fn.__name__}")
+        resp = json.loads(linea)
+        if not resp["ok"]:
+            tipo = sqlite3.OperationalError if resp["tipo"] == "OperationalError" else getattr(builtins, resp["tipo"], None)
+            if isinstance(tipo, type) and issubclass(tipo, Exception):
+                raise tipo(resp["error"])
+            raise RuntimeError(f"{resp['tipo']}: {resp['error']}")
+        return tuple(resp["result"]) if isinstance(resp["result"], list) else resp["result"]
+    return wrapper
+
+def _conexion_escritor():
+    """Socket al escritor de este hilo (uno por hilo, se reutiliza entre llamadas)."""
+    conexion = getattr(_local, "escritor", None)
+    if conexion is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(WRITER_TIMEOUT)
+        try:
+            sock.connect(WRITER_SOCKET)
+        except OSError:
+            sock.close()
+            raise
+        conexion = _local.escritor = (sock, sock.makefile("rb"))
+    return conexion
+
+def _cerrar_escritor():
+    conexion = getattr(_local, "escritor", None)
+    _local.escritor = None
+    if conexion:
+        conexion[1].close()
+        conexion[0].close()
+
+def _aplicar_lote(lote):
+    """Aplicar un lote de pedidos en una transacción, cada uno en su SAVEPOINT."""
+    for intento in range(BUSY_RETRIES + 1):
+        try:
+            with transaction(immediate=True) as db:
+                for p in lote:
+                    previa = p["id"] and db.execute("SELECT respuesta FROM escritor_pedidos WHERE pedido_id=?",
+                                                    (p["id"],)).fetchone()
+                    if previa:
+                        p["respuesta"] = json.loads(previa[0])  # reenvío de un pedido ya aplicado
+                        continue
+                    db.execute("SAVEPOINT escritura")
+                    try:
+                        p["respuesta"] = {"ok": True, "result": _escrituras[p["fn"]](*p["args"], **p["kwargs"])}
+                        if p["id"]:
+                            db.execute("INSERT INTO escritor_pedidos VALUES (?,?,?)",
+                                       (p["id"], json.dumps(p["respuesta"], ensure_ascii=False, default=str),
+                                        datetime.now().isoformat()))
+                        db.execute("RELEASE escritura")
+                    except Exception as e:
+                        db.execute("ROLLBACK TO escritura")
+                        db.execute("RELEASE escritura")
+                        p["respuesta"] = {"ok": False, "tipo": type(e).__name__,
+                                          "error": e.args[0] if len(e.args) == 1 else str(e)}
+            break
+        except sqlite3.OperationalError as e:
+            # Lock tomado por otro proceso (p.ej. el despachador) o commit fallido: reintentar el lote
+            if not _is_busy(e) or intento == BUSY_RETRIES:
+                for p in lote:
+                    p["respuesta"] = {"ok": False, "tipo": type(e).__name__, "error": str(e)}
+                break
+            time.sleep(BUSY_BACKOFF * (2 ** intento) * (1 + random.random()))
+    _escritor["lotes"] += 1
+    _escritor["escrituras"] += len(lote)
+    _escritor["errores"] += sum(not p["respuesta"]["ok"] for p in lote)
+    for p in lote:
+        p["listo"].set()
+
+def _loop_escritor(cola, batch, espera=WRITER_ESPERA):
+    """Armar lotes: lo que ya está en cola y, si hay clientes conectados que
+    aún no pidieron, hasta `espera` segundos más por sus pedidos."""
+    while True:
+        lote = [cola.get()]
+        limite = time.monotonic() + espera
+        while len(lote) < batch:
+            try:
+                lote.append(cola.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            falta = limite - time.monotonic()
+            if len(lote) >= _escritor["clientes"] or falta <= 0:
+                break
+            try:
+                lote.append(cola.get(timeout=falta))
+            except queue.Empty:
+                break
+        _aplicar_lote(lote)
+
+def _atender_cliente(conn, cola):
+    _escritor["clientes"] += 1
+    with conn, conn.makefile("rb") as lector:
+        try:
+            for linea in lector:
+                try:
+                    pedido = json.loads(linea)
+                    if pedido["fn"] not in _escrituras:
+                        raise ValueError(f"Escritura desconocida: {pedido['fn']}")
+                    p = {"id": pedido.get("id"), "fn": pedido["fn"], "args": pedido.get("args", []),
+                         "kwargs": pedido.get("kwargs", {}), "listo": threading.Event(), "respuesta": None}
+                    cola.put(p)
+                    p["listo"].wait()
+                    respuesta = p["respuesta"]
+                except (ValueError, KeyError) as e:
+                    respuesta = {"ok": False, "tipo": type(e).__name__, "error": str(e)}
+                conn.sendall(json.dumps(respuesta, ensure_ascii=False, default=str).encode() + b"\n")
+        except OSError:
+            pass  # el cliente cortó: si reenvía, el id del pedido evita aplicarlo dos veces
+        finally:
+            _escritor["clientes"] -= 1
+
+def serve_writer(path=None, batch=WRITER_BATCH):
+    """Correr el proceso escritor en `path` (por defecto ITACA_WRITER_SOCKET).
+    Bloquea: atiende a cada cliente en un hilo y aplica todo en uno solo."""
+    path = path or WRITER_SOCKET
+    if not path:
+        raise ValueError("Indica la ruta del socket (--socket o ITACA_WRITER_SOCKET).")
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("El escritor único necesita sockets Unix; en este sistema no están disponibles.")
+    _escritor["activo"] = True
+    if os.path.exists(path):
+        os.unlink(path)
+    cola = queue.Queue()
+    threading.Thread(target=_loop_escritor, args=(cola, batch), name="itaca-writer", daemon=True).start()
+    start_dispatcher()  # los commits del escritor despiertan al outbox aquí
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        srv.bind(path)
+        srv.listen(128)
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(target=_atender_cliente, args=(conn, cola), daemon=True).start()
+    finally:
+        srv.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+def writer_stats():
+    """Lotes, escrituras y errores aplicados por el escritor de este proceso."""
+    return {k: v for k, v in _escritor.items() if k not in ("activo", "clientes")}
+
+# ═══════════════════════════════════════════
+# IDENTIFICADORES
+# ═══════════════════════════════════════════
+# Estilo ULID: 48 bits de milisegundos + 80 de azar en 26 caracteres
+# Crockford base32, así que ordenar por id es ordenar por fecha de alta. Dentro
+# de un proceso son monótonos: en el mismo milisegundo (o si el reloj retrocede)
+# se reutiliza el último instante y se suma 1 al azar. Los INSERT caen siempre
+# en el borde derecho del B-tree de la PK y el id sirve solo como cursor keyset.
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_AZAR_BITS = 80
+
+def _base32(n, largo):
+    return "".join(_CROCKFORD[(n >> 5 * i) & 31] for i in range(largo - 1, -1, -1))
+
+def _generador_ids(rng=None):
+    """Función momento -> id monótona para este generador (momento None = ahora)."""
+    azar = (rng or random).getrandbits
+    estado = {"ms": -1, "azar": 0}
+    lock = threading.Lock()
+    def generar(momento=None):
+        ms = int((momento or datetime.now()).timestamp() * 1000)
+        with lock:
+            if ms <= estado["ms"]:
+                ms, n = estado["ms"], estado["azar"] + 1
+                if n >> _AZAR_BITS:
+                    ms, n = ms + 1, azar(_AZAR_BITS - 1)
+            else:
+                n = azar(_AZAR_BITS - 1)    # un bit de holgura para los incrementos
+            estado["ms"], estado["azar"] = ms, n
+        return _base32(ms, 10) + _base32(n, 16)
+    return generar
+
+_nuevo_id = _generador_ids()
+
+def nuevo_id(momento=None, rng=None):
+    """Id nuevo para una fila. Sin argumentos usa el generador monótono del
+    proceso; con momento (datetime) fecha el id en ese instante, y con rng
+    (random.Random) el azar sale de ahí (BD sintéticas deterministas)."""
+    if momento is None and rng is None:
+        return _nuevo_id()
+    return _generador_ids(rng)(momento)
+
+# Tablas con id generado: tabla -> (columna id, columna fecha). _migrar_ids
+# reescribe los ids viejos (email_fecha, FARO_<segundos>, …) en orden de fecha
+# y las referencias que los guardan: (tabla, columna, filtro).
+_TABLAS_ID = {
+    "checkins": ("checkin_id", "fecha"),
+    "faros": ("faro_id", "fecha_envio"),
+    "journal": ("journal_id", "fecha"),
+    "ejercicios_log": ("log_id", "fecha"),
+    "logros": ("logro_id", "fecha"),
+    "hexagono": ("eval_id", "fecha"),
+    "brujula_eval": ("brujula_id", "fecha"),
+}
+_REFERENCIAS_ID = {
+    "checkins": [("feed_equipo", "checkin_id", "1=1"), ("outbox", "ref", "tipo='checkin'")],
+    "faros": [("celebraciones", "faro_id", "1=1"), ("outbox", "ref", "tipo='faro'")],
+    "journal": [("outbox", "ref", "tipo='journal'")],
+    "ejercicios_log": [("outbox", "ref", "tipo='ejercicio'")],
+    "logros": [("puntos_ledger", "ref", "fuente='badge'")],
+    "hexagono": [("outbox", "ref", "tipo='hexagono'")],
+    "brujula_eval": [("outbox", "ref", "tipo='brujula'")],
+}
+
+# (tabla, id, columnas que pasan a ser únicas, contador que cuenta sus filas)
+_UNICOS_ID = [("hexagono", "eval_id", "email", "periodo", "hexagono"),
+              ("brujula_eval", "brujula_id", "email", "periodo", "brujula"),
+              ("logros", "logro_id", "email", "badge_id", None)]
+
+def _fecha_o_none(valor):
+    try:
+        return datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _migrar_ids(db):
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS _ids (viejo TEXT PRIMARY KEY, nuevo TEXT NOT NULL)")
+    for tabla, (col, fecha) in _TABLAS_ID.items():
+        generar = _generador_ids()
+        db.execute("DELETE FROM _ids")
+        db.executemany("INSERT INTO _ids VALUES (?, ?)", [
+            (viejo, generar(_fecha_o_none(f)))
+            for viejo, f in db.execute(f"SELECT {col}, {fecha} FROM {tabla} ORDER BY {fecha}, {col}").fetchall()])
+        db.execute(f"UPDATE {tabla} SET {col} = (SELECT nuevo FROM _ids WHERE viejo = {tabla}.{col})")
+        for ref_tabla, ref_col, filtro in _REFERENCIAS_ID[tabla]:
+            db.execute(f"""UPDATE {ref_tabla} SET {ref_col} = (SELECT nuevo FROM _ids WHERE viejo = {ref_tabla}.{ref_col})
+                WHERE {filtro} AND {ref_col} IN (SELECT viejo FROM _ids)""")
+    db.execute("DROP TABLE _ids")
+    # Duplicados que la unicidad de abajo no admitiría: queda la fila más
+    # reciente (el id mayor, que ya ordena por fecha). Los puntos de un logro
+    # repetido se revierten en el ledger y los contadores se recuentan.
+    for tabla, col, a, b, contador in _UNICOS_ID:
+        repetida = f"""EXISTS (SELECT 1 FROM {tabla} o WHERE o.{a} = {tabla}.{a}
+            AND o.{b} = {tabla}.{b} AND o.{col} > {tabla}.{col})"""
+        if tabla == "logros":
+            db.execute(f"""INSERT OR IGNORE INTO puntos_ledger (email, puntos, fuente, ref, fecha)
+                SELECT email, -COALESCE(puntos, 0), 'badge_duplicado', logro_id, ? FROM logros
+                WHERE {repetida} AND logro_id IN (SELECT ref FROM puntos_ledger WHERE fuente='badge')""",
+                (datetime.now().isoformat(),))
+        if db.execute(f"DELETE FROM {tabla} WHERE {repetida}").rowcount and contador:
+            db.execute(f"""UPDATE contadores SET valor = (SELECT COUNT(*) FROM {tabla} t
+                WHERE t.email = contadores.email) WHERE contador = ? AND periodo = ''""",
+                (contador,))
+    rebuild_points(db)
+    # Índices por id para el keyset y unicidad de lo que antes garantizaba el id
+    for stmt in _split_sql("""
+        CREATE INDEX IF NOT EXISTS idx_faros_visible_id ON faros(visible, faro_id);
+        DROP INDEX IF EXISTS idx_faros_visible_fecha_id;
+        CREATE INDEX IF NOT EXISTS idx_checkins_email_id ON checkins(email, checkin_id);
+        DROP INDEX IF EXISTS idx_checkins_email_fecha_id;
+        CREATE INDEX IF NOT EXISTS idx_journal_email_id ON journal(email, journal_id);
+        DROP INDEX IF EXISTS idx_journal_email_fecha_id;
+        DROP INDEX IF EXISTS idx_hexagono_email_periodo;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_hexagono_email_periodo ON hexagono(email, periodo);
+        DROP INDEX IF EXISTS idx_brujula_email_periodo;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_brujula_email_periodo ON brujula_eval(email, periodo);
+        DROP INDEX IF EXISTS idx_logros_email_badge;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_logros_email_badge ON logros(email, badge_id);
+    """):
+        db.execute(stmt)
+
+def semana_key(d):
+    """Clave de semana de check-in, p.ej. '2026-S07'. Usa el año ISO: el
+    lunes 29/12/2025 ya pertenece a '2026-S01'."""
+    anio, semana, _ = d.isocalendar()
+    return f"{anio}-S{semana:02d}"
+
+def dia_key(d):
+    """Día como entero AAAAMMDD, el mismo valor que las columnas `dia`."""
+    return d.year * 10000 + d.month * 100 + d.day
 
 def dict_row(row):
     return dict(row) if row else None
@@ -37,7 +1084,7 @@ def init_db():
             email TEXT PRIMARY KEY, nombre TEXT, rol TEXT DEFAULT 'Colaborador',
             estado TEXT DEFAULT 'Activo', unidad TEXT, email_lider TEXT,
             fecha_registro TEXT, ultimo_acceso TEXT,
-            password TEXT DEFAULT 'Itaca2026!'
+            password TEXT
         );
         CREATE TABLE IF NOT EXISTS identidad (
             email TEXT PRIMARY KEY, nombre TEXT, foto_url TEXT, puesto TEXT,
@@ -112,7 +1159,194 @@ def init_db():
             detalle TEXT, fecha TEXT, modulo TEXT
         );
         """)
+        migrate(db)
     seed_data()
+    cache_clear()
+
+# ═══════════════════════════════════════════
+# MIGRACIONES DE ESQUEMA
+# ═══════════════════════════════════════════
+# El DDL de init_db() es la versión 0. Cada cambio posterior se agrega al
+# final de MIGRATIONS con el siguiente número de versión; nunca se edita ni
+# se reordena un paso ya publicado. Un paso es un script SQL o una función
+# que recibe la conexión. Cada paso corre en su propia transacción junto con
+# su registro en schema_version (solo hacia adelante, sin downgrade).
+MIGRATIONS = [
+    (1, "Índices para consultas frecuentes por usuario", """
+        CREATE INDEX IF NOT EXISTS idx_checkins_email_semana ON checkins(email, semana);
+        CREATE INDEX IF NOT EXISTS idx_checkins_email_fecha ON checkins(email, fecha);
+        CREATE INDEX IF NOT EXISTS idx_faros_visible_fecha ON faros(visible, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_faros_receptor ON faros(email_receptor, visible, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_faros_emisor ON faros(email_emisor, fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_notif_dest_fecha ON notificaciones(email_dest, fecha);
+        CREATE INDEX IF NOT EXISTS idx_notif_dest_leida ON notificaciones(email_dest, leida);
+        CREATE INDEX IF NOT EXISTS idx_logros_email_fecha ON logros(email, fecha);
+        CREATE INDEX IF NOT EXISTS idx_journal_email_fecha ON journal(email, fecha);
+        CREATE INDEX IF NOT EXISTS idx_hexagono_email_periodo ON hexagono(email, periodo);
+        CREATE INDEX IF NOT EXISTS idx_brujula_email_periodo ON brujula_eval(email, periodo);
+        CREATE INDEX IF NOT EXISTS idx_ejlog_email_fecha ON ejercicios_log(email, fecha);
+        CREATE INDEX IF NOT EXISTS idx_metas_email_fecha ON metas(email, fecha_creacion);
+    """),
+    (2, "Índices para analytics y panel admin", """
+        CREATE INDEX IF NOT EXISTS idx_checkins_semana ON checkins(semana);
+        CREATE INDEX IF NOT EXISTS idx_checkins_fecha ON checkins(fecha, alerta_enviada, nivel_estres);
+        CREATE INDEX IF NOT EXISTS idx_faros_fecha ON faros(fecha_envio);
+        CREATE INDEX IF NOT EXISTS idx_faros_tipo ON faros(tipo_faro);
+        CREATE INDEX IF NOT EXISTS idx_usuarios_estado ON usuarios(estado, nombre);
+        CREATE INDEX IF NOT EXISTS idx_usuarios_unidad ON usuarios(unidad, estado, rol);
+        CREATE INDEX IF NOT EXISTS idx_usuarios_rol ON usuarios(rol, estado);
+        CREATE INDEX IF NOT EXISTS idx_identidad_unidad ON identidad(unidad, estado);
+    """),
+    (3, "Métricas materializadas para analytics", lambda db: _crear_metricas(db)),
+    (4, "Ledger de puntos y saldo por usuario", lambda db: _crear_puntos(db)),
+    (5, "Índices (fecha, id) para paginación keyset", """
+        CREATE INDEX IF NOT EXISTS idx_faros_visible_fecha_id ON faros(visible, fecha_envio, faro_id);
+        DROP INDEX IF EXISTS idx_faros_visible_fecha;
+        CREATE INDEX IF NOT EXISTS idx_checkins_email_fecha_id ON checkins(email, fecha, checkin_id);
+        DROP INDEX IF EXISTS idx_checkins_email_fecha;
+        CREATE INDEX IF NOT EXISTS idx_checkins_fecha_id ON checkins(fecha, checkin_id);
+        DROP INDEX IF EXISTS idx_checkins_fecha;
+        CREATE INDEX IF NOT EXISTS idx_journal_email_fecha_id ON journal(email, fecha, journal_id);
+        DROP INDEX IF EXISTS idx_journal_email_fecha;
+        CREATE INDEX IF NOT EXISTS idx_notif_dest_fecha_id ON notificaciones(email_dest, fecha, notif_id);
+        DROP INDEX IF EXISTS idx_notif_dest_fecha;
+    """),
+    (6, "Clausura de la jerarquía email_lider", lambda db: _crear_jerarquia(db)),
+    (7, "Feed de check-ins por líder (últimos N)", lambda db: _crear_feed_equipo(db)),
+    (8, "Cubo de bienestar unidad × rol × semana × líder", lambda db: _crear_cubo_bienestar(db)),
+    (9, "Columnas enteras de día, calendario y semana ISO corregida", lambda db: _crear_tiempo(db)),
+    (10, "Índices de búsqueda full-text (FTS5) con triggers", lambda db: _crear_busqueda(db)),
+    (11, "Contadores por persona para el motor de badges", lambda db: _crear_contadores(db)),
+    (12, "Outbox de eventos de dominio y offsets de consumidores", lambda db: _crear_outbox(db)),
+    (13, "Alertas de estrés: índice por tipo y las pendientes de la semana", lambda db: _crear_alertas(db)),
+    (14, "Planificador: estado y corridas de tareas, arriendo entre procesos", lambda db: _crear_tareas(db)),
+    (15, "Celebraciones de faros por persona", lambda db: _crear_celebraciones(db)),
+    (16, "Ids ordenables por tiempo (estilo ULID) e índices keyset por id", lambda db: _migrar_ids(db)),
+    (17, "Contraseñas con hash PBKDF2 y cambio obligatorio", lambda db: _hashear_passwords(db)),
+    (18, "Ids de pedidos del escritor único, para reenviar sin duplicar", lambda db: _crear_escritor_pedidos(db)),
+    (19, "Feed de equipo solo con check-ins de personas activas", lambda db: rebuild_team_feed(db)),
+    (20, "usuarios.password sin DEFAULT en texto plano", lambda db: _quitar_password_default(db)),
+    (21, "metricas_diarias con día entero AAAAMMDD", lambda db: _metricas_dia_entero(db)),
+    (22, "Índices para recordatorios, feed de activos, poda de tareas_log y cubo por semana", """
+        CREATE INDEX IF NOT EXISTS idx_usuarios_estado_rol ON usuarios(estado, rol, email);
+        CREATE INDEX IF NOT EXISTS idx_identidad_estado ON identidad(estado, email);
+        CREATE INDEX IF NOT EXISTS idx_tareas_log_inicio ON tareas_log(inicio);
+        DROP INDEX IF EXISTS idx_cubo_unidad;
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _split_sql(script):
+    """Separar un script en sentencias completas (respeta BEGIN...END de triggers)."""
+    stmts, buf = [], ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            if buf.strip():
+                stmts.append(buf.strip())
+            buf = ""
+    if buf.strip():
+        stmts.append(buf.strip())
+    return stmts
+
+def get_schema_version(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY, descripcion TEXT, fecha TEXT)""")
+    return db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(db):
+    """Aplicar en orden los pasos de MIGRATIONS pendientes. Devuelve la versión final."""
+    db.commit()
+    current = get_schema_version(db)
+    db.commit()
+    for version, descripcion, step in MIGRATIONS:
+        if version <= current:
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso pudo aplicarla mientras esperábamos el lock
+            if db.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone():
+                db.rollback()
+                continue
+            if callable(step):
+                step(db)
+            else:
+                for stmt in _split_sql(step):
+                    db.execute(stmt)
+            db.execute("INSERT INTO schema_version VALUES (?,?,?)",
+                (version, descripcion, datetime.now().isoformat()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        current = version
+    return current
+
+# ── TIEMPO: COLUMNAS `dia` Y CALENDARIO ──
+# Las fechas se guardan como texto ISO. Cada tabla con historia tiene además
+# una columna generada `dia` (entero AAAAMMDD, virtual: la calcula SQLite al
+# escribir, ningún INSERT tiene que llenarla) con índice, para filtrar
+# ventanas con rangos enteros en vez de LIKE o comparaciones de texto.
+# calendario es la dimensión de fechas: una fila por día con su mes, semana
+# ISO (año ISO incluido), lunes de la semana y epoch, para agrupar por
+# periodo con un join en vez de partir cadenas. Cubre desde CALENDARIO_DESDE
+# hasta el 31/12 de CALENDARIO_ANIOS_ADELANTE años después; save_checkin y la
+# tarea de mantenimiento lo extienden si la historia llega más allá.
+_COLUMNAS_FECHA = {"checkins": "fecha", "faros": "fecha_envio", "journal": "fecha", "ejercicios_log": "fecha"}
+CALENDARIO_DESDE = date(2020, 1, 1)
+CALENDARIO_ANIOS_ADELANTE = 10
+
+def _crear_tiempo(db):
+    for tabla, col in _COLUMNAS_FECHA.items():
+        cols = {r[1] for r in db.execute(f"PRAGMA table_xinfo({tabla})")}
+        if "dia" not in cols:
+            db.execute(f"""ALTER TABLE {tabla} ADD COLUMN dia INTEGER GENERATED ALWAYS AS
+                (CAST(substr({col},1,4) || substr({col},6,2) || substr({col},9,2) AS INTEGER)) VIRTUAL""")
+    # Cubre las ventanas por persona (JOIN con identidad) sin tocar la tabla
+    db.execute("CREATE INDEX IF NOT EXISTS idx_checkins_email_dia ON checkins(email, dia, nivel_estres)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_faros_dia ON faros(dia)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_journal_email_dia ON journal(email, dia)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ejlog_email_dia ON ejercicios_log(email, dia)")
+    db.execute("""CREATE TABLE IF NOT EXISTS calendario (
+        dia INTEGER PRIMARY KEY, fecha TEXT NOT NULL, anio INTEGER, mes INTEGER, trimestre INTEGER,
+        dia_semana INTEGER, anio_iso INTEGER, semana_iso INTEGER, semana TEXT,
+        lunes INTEGER, epoch INTEGER)""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_calendario_semana ON calendario(semana, dia)")
+    primero = db.execute("SELECT MIN(dia) FROM checkins WHERE dia > 0").fetchone()[0]
+    desde = min(CALENDARIO_DESDE, date(primero // 10000, primero // 100 % 100, primero % 100)) \
+        if primero else CALENDARIO_DESDE
+    _llenar_calendario(db, desde, _fin_calendario(date.today()))
+    # semana_key usaba el año calendario: en los bordes de año la semana quedaba mal
+    fixed = db.execute("""UPDATE checkins SET semana = (SELECT semana FROM calendario k WHERE k.dia = checkins.dia)
+        WHERE semana IS NOT (SELECT semana FROM calendario k WHERE k.dia = checkins.dia)
+          AND dia IN (SELECT dia FROM calendario)""").rowcount
+    if fixed:
+        rebuild_wellbeing_cube(db)
+
+def _fin_calendario(hoy):
+    # 31/12 y no hoy.replace(year=…): el 29/02 no existe en la mayoría de los años
+    return date(hoy.year + CALENDARIO_ANIOS_ADELANTE, 12, 31)
+
+def _extender_calendario(db, hasta):
+    """Agregar a calendario los días que falten hasta `hasta` (date). Devuelve cuántos."""
+    ultimo = db.execute("SELECT MAX(dia) FROM calendario").fetchone()[0]
+    if ultimo is None or ultimo >= dia_key(hasta):
+        return 0
+    desde = date(ultimo // 10000, ultimo // 100 % 100, ultimo % 100) + timedelta(days=1)
+    _llenar_calendario(db, desde, hasta)
+    return (hasta - desde).days + 1
+
+def _llenar_calendario(db, desde, hasta):
+    filas, d = [], desde
+    while d <= hasta:
+        anio_iso, semana_iso, dia_semana = d.isocalendar()
+        lunes = d - timedelta(days=dia_semana - 1)
+        filas.append((dia_key(d), d.isoformat(), d.year, d.month, (d.month - 1) // 3 + 1, dia_semana,
+                      anio_iso, semana_iso, semana_key(d), dia_key(lunes),
+                      int(datetime(d.year, d.month, d.day).timestamp())))
+        d += timedelta(days=1)
+    db.executemany("INSERT OR IGNORE INTO calendario VALUES (?,?,?,?,?,?,?,?,?,?,?)", filas)
 
 # ═══════════════════════════════════════════
 # SEED DATA
@@ -217,8 +1451,10 @@ def seed_data():
         ]
         for u in users:
             email, nombre, rol, estado, unidad, email_lider, cargo, cel, ingreso = u
-            db.execute("INSERT OR IGNORE INTO usuarios VALUES (?,?,?,?,?,?,?,?,?)",
-                (email, nombre, rol, estado, unidad, email_lider, now, now, 'Itaca2026!'))
+            db.execute("""INSERT OR IGNORE INTO usuarios
+                (email,nombre,rol,estado,unidad,email_lider,fecha_registro,ultimo_acceso,password,must_change_password)
+                VALUES (?,?,?,?,?,?,?,?,?,1)""",
+                (email, nombre, rol, estado, unidad, email_lider, now, now, _hash_inicial()))
             db.execute("""INSERT OR IGNORE INTO identidad
                 (email,nombre,puesto,rol,unidad,estado,email_lider,telefono,fecha_ingreso,fecha_actualizacion)
                 VALUES (?,?,?,?,?,?,?,?,?,?)""",
@@ -229,9 +1465,11 @@ def seed_data():
                 d = datetime.now() - timedelta(weeks=w)
                 estados = ["GENIAL","NORMAL","DIFICIL","NORMAL"]
                 estres = [2, 3, 4, 2]
-                cid = f"{email}_{d.strftime('%Y-%m-%d')}"
-                sem = f"{d.year}-S{d.isocalendar()[1]:02d}"
-                db.execute("INSERT OR IGNORE INTO checkins VALUES (?,?,?,?,?,?,?,?,?,?)",
+                cid = nuevo_id(d)
+                sem = semana_key(d)
+                db.execute("""INSERT OR IGNORE INTO checkins
+                    (checkin_id,email,estado_general,nivel_estres,area_preocupacion,etiquetas,
+                     comentario,fecha,semana,alerta_enviada) VALUES (?,?,?,?,?,?,?,?,?,?)""",
                     (cid, email, estados[w], estres[w], "Trabajo", "Concentrado,Determinado",
                      "", d.isoformat(), sem, 1 if estres[w]>=4 else 0))
         # Faros de ejemplo con colaboradores reales
@@ -241,15 +1479,27 @@ def seed_data():
             ("daniela.collantes@itaca.com","Daniela Fernanda Tocto Collantes","santiago.zambrano@itaca.com","Santiago Sánchez Zambrano","Faro de Guía","+1 Sí Importa","Castor","Gracias por enseñarme a usar las métricas de pauta. Siempre das la milla extra."),
         ]
         for i, f in enumerate(faros_data):
-            fid = f"FARO_{int(datetime.now().timestamp())}{i}"
             d = datetime.now() - timedelta(days=i*3)
-            db.execute("INSERT OR IGNORE INTO faros VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            fid = nuevo_id(d)
+            db.execute("""INSERT OR IGNORE INTO faros
+                (faro_id,email_emisor,nombre_emisor,email_receptor,nombre_receptor,tipo_faro,pilar,
+                 animal,mensaje,foto_url,fecha_envio,estado,email_aprobador,fecha_aprobacion,
+                 celebraciones,visible) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
                 (fid, f[0], f[1], f[2], f[3], f[4], f[5], f[6], f[7], "",
                  d.isoformat(), "Aprobado", "mirai@itaca.com", d.isoformat(), 0, 1))
         # Badge de ejemplo
-        db.execute("INSERT OR IGNORE INTO logros VALUES (?,?,?,?,?,?,?,?,?)",
-            ("LOGRO_pedro_firstfaro", "pedro@itaca.com", "FIRST_FARO", "🔦 Primer Faro",
+        db.execute("""INSERT OR IGNORE INTO logros
+            (logro_id,email,badge_id,nombre_badge,descripcion,puntos,categoria,fecha,icono)
+            VALUES (?,?,?,?,?,?,?,?,?)""",
+            (nuevo_id(), "pedro@itaca.com", "FIRST_FARO", "🔦 Primer Faro",
              "Encendiste tu primer faro", 10, "Cultura", now, "🔦"))
+        # Los inserts de arriba no pasan por las funciones CRUD
+        rebuild_metrics(db)
+        sync_points_from_logros(db)
+        rebuild_hierarchy(db)
+        rebuild_team_feed(db)
+        rebuild_wellbeing_cube(db)
+        rebuild_badges(db)
 
 # ═══════════════════════════════════════════
 # CRUD OPERATIONS
@@ -260,6 +1510,7 @@ def get_user(email):
     with get_db() as db:
         return dict_row(db.execute("SELECT * FROM usuarios WHERE email=?", (email,)).fetchone())
 
+@cached("usuarios")
 def get_all_users():
     with get_db() as db:
         return dict_rows(db.execute("SELECT * FROM usuarios WHERE estado='Activo' ORDER BY nombre").fetchall())
@@ -268,74 +1519,128 @@ def get_identidad(email):
     with get_db() as db:
         return dict_row(db.execute("SELECT * FROM identidad WHERE email=?", (email,)).fetchone())
 
+@invalidates("usuarios")
 def update_identidad(email, **kwargs):
     with get_db() as db:
         sets = ", ".join(f"{k}=?" for k in kwargs)
-        vals = list(kwargs.values()) + [email]
         db.execute(f"UPDATE identidad SET {sets}, fecha_actualizacion=? WHERE email=?",
                    (*kwargs.values(), datetime.now().isoformat(), email))
+        _emitir(db, "identidad.cambio", email, campos=sorted(kwargs))
 
 def get_team_members(email_lider):
+    """Toda la tripulación de un líder: su subárbol completo en la jerarquía."""
+    return get_subtree(email_lider)
+
+# ── METAS (OKR) ──
+def get_my_metas(email):
     with get_db() as db:
-        user = dict_row(db.execute("SELECT unidad FROM identidad WHERE email=?", (email_lider,)).fetchone())
-        if not user: return []
         return dict_rows(db.execute(
-            "SELECT * FROM identidad WHERE unidad=? AND email!=? AND estado='Activo'",
-            (user["unidad"], email_lider)).fetchall())
+            "SELECT * FROM metas WHERE email=? ORDER BY fecha_creacion DESC", (email,)).fetchall())
+
+def save_meta(email, tipo, periodo, objetivo, kr1, kr2, kr3, fecha_limite):
+    mid = nuevo_id()
+    with get_db() as db:
+        db.execute("""INSERT INTO metas (meta_id,email,tipo,periodo,objetivo,kr1,kr2,kr3,
+            progreso,estado,fecha_creacion,fecha_limite) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (mid, email, tipo, periodo, objetivo, kr1, kr2, kr3,
+             0, "Pendiente", datetime.now().isoformat(), fecha_limite))
+    return mid
+
+def update_meta(meta_id, progreso, estado):
+    with get_db() as db:
+        db.execute("UPDATE metas SET progreso=?, estado=? WHERE meta_id=?", (progreso, estado, meta_id))
 
 # ── CHECK-INS ──
+@retry_on_busy
+@invalidates("checkins")
+@via_writer
 def save_checkin(email, estado, estres, area, etiquetas, comentario):
     now = datetime.now()
-    cid = f"{email}_{now.strftime('%Y-%m-%d')}"
-    sem = f"{now.year}-S{now.isocalendar()[1]:02d}"
-    with get_db() as db:
+    cid = nuevo_id()
+    sem = semana_key(now)
+    # inmediata: revisar y escribir bajo el mismo lock para no duplicar la semana
+    with transaction(immediate=True) as db:
         existing = db.execute("SELECT 1 FROM checkins WHERE email=? AND semana=?", (email, sem)).fetchone()
         if existing:
             return False, "Ya hiciste tu check-in esta semana."
-        db.execute("INSERT INTO checkins VALUES (?,?,?,?,?,?,?,?,?,?)",
+        db.execute("""INSERT INTO checkins (checkin_id,email,estado_general,nivel_estres,
+            area_preocupacion,etiquetas,comentario,fecha,semana,alerta_enviada)
+            VALUES (?,?,?,?,?,?,?,?,?,?)""",
             (cid, email, estado, estres, area, ",".join(etiquetas) if etiquetas else "",
              comentario, now.isoformat(), sem, 1 if estres >= 4 else 0))
+        _extender_calendario(db, now.date())
+        _bump_day(db, dia_key(now), checkins=1, estres_sum=estres,
+                  alertas=1 if estres >= 4 else 0)
+        _push_team_feed(db, email, now.isoformat(), cid)
+        _bump_cubo(db, email, sem, estado, estres)
+        _contar_racha(db, email, sem, semana_key(now - timedelta(days=7)))
+        _emitir(db, "checkin", email, cid, estado=estado, estres=estres, semana=sem, alerta=estres >= 4)
     return True, "Check-in registrado. ¡Gracias por compartir!"
 
 def get_my_checkins(email, limit=20):
     with get_db() as db:
         return dict_rows(db.execute(
-            "SELECT * FROM checkins WHERE email=? ORDER BY fecha DESC LIMIT ?",
+            "SELECT * FROM checkins WHERE email=? ORDER BY checkin_id DESC LIMIT ?",
             (email, limit)).fetchall())
 
-def get_team_checkins(email_lider):
-    members = get_team_members(email_lider)
-    if not members: return []
-    emails = [m["email"] for m in members]
-    ph = ",".join("?" * len(emails))
+def get_team_checkins(email_lider, limit=50):
+    """Últimos check-ins del subárbol del líder, servidos desde feed_equipo
+    (como mucho FEED_EQUIPO_N)."""
+    with get_db() as db:
+        return dict_rows(db.execute("""
+            SELECT c.*, i.nombre FROM feed_equipo f
+            JOIN checkins c ON c.checkin_id = f.checkin_id
+            JOIN identidad i ON i.email = c.email
+            WHERE f.lider=? AND i.estado='Activo'
+            ORDER BY f.fecha DESC, f.checkin_id DESC LIMIT ?""", (email_lider, limit)).fetchall())
+
+def get_team_pulse(email_lider):
+    """Resumen de la semana actual para los widgets de líder: miembros activos
+    del subárbol, cuántos directos, cuántos hicieron check-in y su estrés promedio."""
     with get_db() as db:
-        return dict_rows(db.execute(f"""
-            SELECT c.*, i.nombre FROM checkins c
-            JOIN identidad i ON c.email = i.email
-            WHERE c.email IN ({ph})
-            ORDER BY c.fecha DESC LIMIT 50""", emails).fetchall())
+        return dict_row(db.execute("""
+            SELECT COUNT(*) AS miembros, COALESCE(SUM(j.profundidad = 1), 0) AS directos,
+                   COUNT(c.email) AS checkins_semana, AVG(c.nivel_estres) AS estres_semana
+            FROM jerarquia j
+            JOIN identidad i ON i.email = j.descendiente
+            LEFT JOIN checkins c ON c.email = j.descendiente AND c.semana = ?
+            WHERE j.ancestro=? AND j.profundidad > 0 AND i.estado='Activo'""",
+            (semana_key(datetime.now()), email_lider)).fetchone())
 
 def checkin_done_this_week(email):
     now = datetime.now()
-    sem = f"{now.year}-S{now.isocalendar()[1]:02d}"
+    sem = semana_key(now)
     with get_db() as db:
         return db.execute("SELECT 1 FROM checkins WHERE email=? AND semana=?", (email, sem)).fetchone() is not None
 
 # ── FAROS ──
+@retry_on_busy
+@invalidates("faros")
+@via_writer
 def save_faro(email_emisor, email_receptor, tipo_faro, mensaje):
     from config import TIPOS_FARO
     info = TIPOS_FARO[tipo_faro]
     now = datetime.now()
-    fid = f"FARO_{int(now.timestamp())}"
+    fid = nuevo_id()
     with get_db() as db:
         em = db.execute("SELECT nombre FROM identidad WHERE email=?", (email_emisor,)).fetchone()
         rc = db.execute("SELECT nombre FROM identidad WHERE email=?", (email_receptor,)).fetchone()
         nombre_e = em["nombre"] if em else email_emisor
         nombre_r = rc["nombre"] if rc else email_receptor
-        db.execute("INSERT INTO faros VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+        db.execute("""INSERT INTO faros (faro_id,email_emisor,nombre_emisor,email_receptor,
+            nombre_receptor,tipo_faro,pilar,animal,mensaje,foto_url,fecha_envio,estado,
+            email_aprobador,fecha_aprobacion,celebraciones,visible)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
             (fid, email_emisor, nombre_e, email_receptor, nombre_r, tipo_faro,
              info["pilar"], info["animal"], mensaje, "", now.isoformat(),
              "Aprobado", "", now.isoformat(), 0, 1))
+        _bump_day(db, dia_key(now), faros=1)
+        _bump_total(db, faros_total=1)
+        mes = now.strftime("%Y-%m")
+        _contar(db, email_emisor, "faros_enviados")
+        _contar(db, email_emisor, "faros_enviados_mes", mes)
+        _contar(db, email_receptor, "faros_recibidos_mes", mes)
+        _emitir(db, "faro", email_emisor, fid, receptor=email_receptor, tipo_faro=tipo_faro)
     return True, f"¡Faro enviado a {nombre_r}!"
 
 def get_faros_recibidos(email, limit=20):
@@ -350,32 +1655,135 @@ def get_faros_enviados(email, limit=20):
             "SELECT * FROM faros WHERE email_emisor=? ORDER BY fecha_envio DESC LIMIT ?",
             (email, limit)).fetchall())
 
+@cached("faros")
 def get_faros_publicos(limit=20):
     with get_db() as db:
         return dict_rows(db.execute(
-            "SELECT * FROM faros WHERE visible=1 ORDER BY fecha_envio DESC LIMIT ?",
+            "SELECT * FROM faros WHERE visible=1 ORDER BY faro_id DESC LIMIT ?",
             (limit,)).fetchall())
 
-def celebrar_faro(faro_id):
+# ── CELEBRACIONES ──
+# Un "👏 Celebrar" no escribe: queda en un buffer del proceso y un timer lo
+# vuelca cada CELEBRAR_INTERVALO segundos en una sola transacción, así que
+# una ráfaga de clics sobre un faro popular es un commit y no uno por clic.
+# `celebraciones` guarda quién celebró (una vez por persona y faro) y
+# faros.celebraciones suma solo las filas nuevas. get_celebraciones()
+# mezcla lo persistido con lo pendiente de este proceso para mostrarlo.
+# Además del timer vuelcan el planificador en cada vuelta y atexit al salir.
+# Lo pendiente vive solo en memoria: si el proceso muere sin pasar por
+# atexit (kill -9, caída del host, OOM) se pierden los clics de los últimos
+# CELEBRAR_INTERVALO segundos, más los que no pudieron escribirse mientras
+# la BD fallaba.
+CELEBRAR_INTERVALO = 2.0
+
+_celebraciones = {"pendientes": {}, "timer": None}  # faro_id -> {email: fecha}
+_celebraciones_lock = threading.Lock()
+
+def _crear_celebraciones(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS celebraciones (
+        faro_id TEXT NOT NULL, email TEXT NOT NULL, fecha TEXT NOT NULL,
+        PRIMARY KEY (faro_id, email)) WITHOUT ROWID""")
+
+def _programar_flush():
+    # Con _celebraciones_lock tomado
+    if _celebraciones["timer"] is None:
+        t = threading.Timer(CELEBRAR_INTERVALO, _flush_timer)
+        t.daemon = True
+        t.start()
+        _celebraciones["timer"] = t
+
+def _flush_timer():
+    try:
+        flush_celebraciones()
+    except Exception:
+        pass  # lo pendiente volvió al buffer y quedó reprogramado
+
+atexit.register(_flush_timer)  # no perder lo pendiente al cerrar el proceso
+
+def celebrar_faro(faro_id, email):
+    """Registrar que email celebra faro_id. Devuelve False si ya lo había celebrado.
+    Se persiste en el próximo volcado (≤ CELEBRAR_INTERVALO s): una caída
+    abrupta del proceso antes de eso pierde la celebración."""
+    with _celebraciones_lock:
+        if email in _celebraciones["pendientes"].get(faro_id, ()):
+            return False
     with get_db() as db:
-        db.execute("UPDATE faros SET celebraciones = celebraciones + 1 WHERE faro_id=?", (faro_id,))
+        if db.execute("SELECT 1 FROM celebraciones WHERE faro_id=? AND email=?", (faro_id, email)).fetchone():
+            return False
+    with _celebraciones_lock:
+        pendientes = _celebraciones["pendientes"].setdefault(faro_id, {})
+        if email in pendientes:
+            return False
+        pendientes[email] = datetime.now().isoformat()
+        _programar_flush()
+    return True
+
+def flush_celebraciones():
+    """Volcar ya las celebraciones pendientes de este proceso. Devuelve cuántas eran nuevas."""
+    with _celebraciones_lock:
+        pendientes, _celebraciones["pendientes"] = _celebraciones["pendientes"], {}
+        _celebraciones["timer"] = None
+    pares = [(f, e, fecha) for f, emails in pendientes.items() for e, fecha in emails.items()]
+    if not pares:
+        return 0
+    try:
+        return _guardar_celebraciones(pares)
+    except Exception:
+        with _celebraciones_lock:
+            for f, e, fecha in pares:
+                _celebraciones["pendientes"].setdefault(f, {}).setdefault(e, fecha)
+            _programar_flush()
+        raise
+
+@retry_on_busy
+@invalidates("faros")
+@via_writer
+def _guardar_celebraciones(pares):
+    nuevas = {}
+    with get_db() as db:
+        for faro_id, email, fecha in pares:
+            n = db.execute("INSERT OR IGNORE INTO celebraciones (faro_id, email, fecha) VALUES (?,?,?)",
+                           (faro_id, email, fecha)).rowcount
+            nuevas[faro_id] = nuevas.get(faro_id, 0) + n
+        db.executemany("UPDATE faros SET celebraciones = celebraciones + ? WHERE faro_id=?",
+                       [(n, f) for f, n in nuevas.items() if n])
+    return sum(nuevas.values())
+
+def get_celebraciones(faro_ids, email=None):
+    """{faro_id: {"total", "mia"}} con lo persistido más lo pendiente en este
+    proceso; "mia" indica si email ya celebró ese faro."""
+    if not faro_ids:
+        return {}
+    marcas = ",".join("?" * len(faro_ids))
+    with get_db() as db:
+        filas = db.execute(f"""SELECT f.faro_id, f.celebraciones,
+            EXISTS (SELECT 1 FROM celebraciones c WHERE c.faro_id = f.faro_id AND c.email = ?) AS mia
+            FROM faros f WHERE f.faro_id IN ({marcas})""", (email, *faro_ids)).fetchall()
+    with _celebraciones_lock:
+        pendientes = {f: dict(_celebraciones["pendientes"].get(f, {})) for f in faro_ids}
+    return {r["faro_id"]: {"total": (r["celebraciones"] or 0) + len(pendientes[r["faro_id"]]),
+                           "mia": bool(r["mia"]) or email in pendientes[r["faro_id"]]} for r in filas}
 
 # ── HEXÁGONO ──
+@retry_on_busy
+@via_writer
 def save_hexagono(email, puntajes, reflexion):
     now = datetime.now()
     periodo = now.strftime("%Y-%m")
-    eid = f"{email}_{periodo}"
+    eid = nuevo_id()
     vals = list(puntajes.values())
     prom = round(sum(vals) / 6, 2)
     nombres = ["Visión Corporativa","Planificación","Encaje de Talento","Entrenamiento","Evaluación y Mejora","Reconocimiento"]
     dim_baja = nombres[vals.index(min(vals))]
     dim_alta = nombres[vals.index(max(vals))]
-    with get_db() as db:
-        existing = db.execute("SELECT 1 FROM hexagono WHERE eval_id=?", (eid,)).fetchone()
+    with transaction(immediate=True) as db:
+        existing = db.execute("SELECT 1 FROM hexagono WHERE email=? AND periodo=?", (email, periodo)).fetchone()
         if existing:
             return False, "Ya evaluaste este mes."
         db.execute("INSERT INTO hexagono VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
             (eid, email, periodo, now.isoformat(), *vals, prom, reflexion, dim_baja, dim_alta))
+        _contar(db, email, "hexagono")
+        _emitir(db, "hexagono", email, eid, periodo=periodo, promedio=prom)
     return True, f"Evaluación guardada. Promedio: {prom}"
 
 def get_my_hexagono(email, limit=12):
@@ -385,46 +1793,57 @@ def get_my_hexagono(email, limit=12):
             (email, limit)).fetchall())
 
 # ── JOURNAL ──
+@retry_on_busy
+@via_writer
 def save_journal(email, emociones, intensidad, trigger, pensamiento, reflexion, estrategia, efectividad, contexto):
     now = datetime.now()
-    jid = f"{email}_{now.strftime('%Y-%m-%d_%H%M')}"
+    jid = nuevo_id()
     dias = ["Lunes","Martes","Miércoles","Jueves","Viernes","Sábado","Domingo"]
     dia = dias[now.weekday()]
     hora = "Mañana" if now.hour < 12 else "Tarde" if now.hour < 18 else "Noche"
     with get_db() as db:
-        db.execute("INSERT INTO journal VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+        db.execute("""INSERT INTO journal (journal_id,email,fecha,emociones,intensidad,
+            trigger_text,pensamiento,reflexion,estrategia,efectividad,contexto,dia_semana,hora_dia)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
             (jid, email, now.isoformat(), ",".join(emociones), intensidad,
              trigger, pensamiento, reflexion, estrategia or "", efectividad or 0,
              contexto, dia, hora))
+        _contar(db, email, "journal")
+        _emitir(db, "journal", email, jid, contexto=contexto, intensidad=intensidad)
     return True, "Entrada de journal guardada."
 
 def get_my_journal(email, limit=30):
     with get_db() as db:
         return dict_rows(db.execute(
-            "SELECT * FROM journal WHERE email=? ORDER BY fecha DESC LIMIT ?",
+            "SELECT * FROM journal WHERE email=? ORDER BY journal_id DESC LIMIT ?",
             (email, limit)).fetchall())
 
 # ── BRÚJULA IE ──
+@retry_on_busy
+@via_writer
 def save_brujula(email, puntajes, reflexion):
     now = datetime.now()
     periodo = now.strftime("%Y-%m")
-    bid = f"{email}_{periodo}"
+    bid = nuevo_id()
     vals = list(puntajes.values())
     prom = round(sum(vals) / 5, 2)
     nombres = ["Autoconocimiento","Autorregulación","Motivación","Empatía","Habilidades Sociales"]
     comp_baja = nombres[vals.index(min(vals))]
     comp_alta = nombres[vals.index(max(vals))]
-    with get_db() as db:
-        existing = db.execute("SELECT 1 FROM brujula_eval WHERE brujula_id=?", (bid,)).fetchone()
+    with transaction(immediate=True) as db:
+        existing = db.execute("SELECT 1 FROM brujula_eval WHERE email=? AND periodo=?", (email, periodo)).fetchone()
         if existing:
             return False, "Ya evaluaste este mes."
-        ej_count = db.execute("SELECT COUNT(*) FROM ejercicios_log WHERE email=? AND fecha LIKE ?",
-            (email, f"{periodo}%")).fetchone()[0]
-        j_count = db.execute("SELECT COUNT(*) FROM journal WHERE email=? AND fecha LIKE ?",
-            (email, f"{periodo}%")).fetchone()[0]
+        mes = (dia_key(now) // 100 * 100, dia_key(now) // 100 * 100 + 99)
+        ej_count = db.execute("SELECT COUNT(*) FROM ejercicios_log WHERE email=? AND dia BETWEEN ? AND ?",
+            (email, *mes)).fetchone()[0]
+        j_count = db.execute("SELECT COUNT(*) FROM journal WHERE email=? AND dia BETWEEN ? AND ?",
+            (email, *mes)).fetchone()[0]
         db.execute("INSERT INTO brujula_eval VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
             (bid, email, periodo, now.isoformat(), *vals, prom, comp_baja, comp_alta,
              reflexion, ej_count, j_count))
+        _contar(db, email, "brujula")
+        _emitir(db, "brujula", email, bid, periodo=periodo, promedio=prom)
     return True, f"Evaluación IE guardada. Promedio: {prom}"
 
 def get_my_brujula(email, limit=12):
@@ -433,6 +1852,21 @@ def get_my_brujula(email, limit=12):
             "SELECT * FROM brujula_eval WHERE email=? ORDER BY periodo DESC LIMIT ?",
             (email, limit)).fetchall())
 
+# ── EJERCICIOS ──
+@retry_on_busy
+@via_writer
+def save_ejercicio(email, ejercicio_id, duracion, competencia):
+    now = datetime.now()
+    lid = nuevo_id()
+    with get_db() as db:
+        db.execute("""INSERT INTO ejercicios_log (log_id,email,ejercicio_id,fecha,
+            duracion_real,efectividad,estado_antes,estado_despues,notas,competencia)
+            VALUES (?,?,?,?,?,?,?,?,?,?)""",
+            (lid, email, ejercicio_id, now.isoformat(), duracion, 0, "", "", "", competencia))
+        _contar(db, email, "ejercicios")
+        _emitir(db, "ejercicio", email, lid, ejercicio=ejercicio_id)
+    return True, "Ejercicio completado."
+
 # ── LOGROS ──
 def get_my_logros(email):
     with get_db() as db:
@@ -441,18 +1875,404 @@ def get_my_logros(email):
 
 def get_total_puntos(email):
     with get_db() as db:
-        r = db.execute("SELECT COALESCE(SUM(puntos),0) FROM logros WHERE email=?", (email,)).fetchone()
-        return r[0]
+        r = db.execute("SELECT saldo FROM puntos_saldo WHERE email=?", (email,)).fetchone()
+        return r[0] if r else 0
+
+def _otorgar_badge(db, email, badge_id, nombre, desc, puntos, categoria, icono):
+    if db.execute("SELECT 1 FROM logros WHERE email=? AND badge_id=?", (email, badge_id)).fetchone():
+        return False
+    lid = nuevo_id()
+    db.execute("""INSERT INTO logros (logro_id,email,badge_id,nombre_badge,descripcion,puntos,
+        categoria,fecha,icono) VALUES (?,?,?,?,?,?,?,?,?)""",
+        (lid, email, badge_id, nombre, desc, puntos, categoria, datetime.now().isoformat(), icono))
+    registrar_puntos(db, email, puntos, "badge", lid)
+    return True
 
 def otorgar_badge(email, badge_id, nombre, desc, puntos, categoria, icono):
-    lid = f"LOGRO_{email.split('@')[0]}_{badge_id}"
     with get_db() as db:
-        existing = db.execute("SELECT 1 FROM logros WHERE logro_id=?", (lid,)).fetchone()
-        if existing: return False
-        db.execute("INSERT INTO logros VALUES (?,?,?,?,?,?,?,?,?)",
-            (lid, email, badge_id, nombre, desc, puntos, categoria, datetime.now().isoformat(), icono))
+        return _otorgar_badge(db, email, badge_id, nombre, desc, puntos, categoria, icono)
+
+# ── MOTOR DE BADGES ──
+# Las reglas viven en config.BADGES (contador + umbral). contadores lleva
+# por persona los valores que usan esas reglas y lo actualizan las
+# funciones save_* en su misma transacción: cada evento suma 1 a su
+# contador y solo revisa los badges de ese contador cuyo umbral acaba de
+# alcanzar, sin volver a contar la historia. rebuild_badges() recalcula
+# todos los contadores desde las tablas y otorga lo que falte (backfill).
+_CONTADORES_SQL = """
+    SELECT email_emisor, 'faros_enviados', '', COUNT(*) FROM faros GROUP BY email_emisor
+    UNION ALL SELECT email_emisor, 'faros_enviados_mes', printf('%04d-%02d', dia / 10000, dia / 100 % 100), COUNT(*)
+        FROM faros GROUP BY email_emisor, dia / 100
+    UNION ALL SELECT email_receptor, 'faros_recibidos_mes', printf('%04d-%02d', dia / 10000, dia / 100 % 100), COUNT(*)
+        FROM faros GROUP BY email_receptor, dia / 100
+    UNION ALL SELECT email, 'journal', '', COUNT(*) FROM journal GROUP BY email
+    UNION ALL SELECT email, 'ejercicios', '', COUNT(*) FROM ejercicios_log GROUP BY email
+    UNION ALL SELECT email, 'brujula', '', COUNT(*) FROM brujula_eval GROUP BY email
+    UNION ALL SELECT email, 'hexagono', '', COUNT(*) FROM hexagono GROUP BY email"""
+
+def _crear_contadores(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS contadores (
+        email TEXT NOT NULL, contador TEXT NOT NULL, periodo TEXT NOT NULL DEFAULT '',
+        valor INTEGER NOT NULL DEFAULT 0, ultimo TEXT,
+        PRIMARY KEY (email, contador, periodo)) WITHOUT ROWID""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_logros_email_badge ON logros(email, badge_id)")
+    rebuild_badges(db)
+
+@functools.lru_cache(maxsize=None)
+def _reglas_badges():
+    """config.BADGES agrupadas por contador."""
+    from config import BADGES
+    reglas = {}
+    for b in BADGES:
+        reglas.setdefault(b["contador"], []).append(b)
+    return reglas
+
+def _evaluar_badges(db, email, contador, valor):
+    """Otorgar los badges de `contador` cuyo umbral es exactamente `valor`."""
+    for b in _reglas_badges().get(contador, ()):
+        if valor == b["umbral"]:
+            _otorgar_badge(db, email, b["id"], b["nombre"], b["desc"], b["puntos"], b["categoria"], b["icono"])
+
+def _contar(db, email, contador, periodo=""):
+    valor = db.execute("""INSERT INTO contadores (email, contador, periodo, valor) VALUES (?,?,?,1)
+        ON CONFLICT(email, contador, periodo) DO UPDATE SET valor = valor + 1
+        RETURNING valor""", (email, contador, periodo)).fetchall()[0][0]
+    _evaluar_badges(db, email, contador, valor)
+
+def _contar_racha(db, email, semana, semana_anterior):
+    """racha_checkins: +1 si la semana anterior tuvo check-in, si no vuelve a 1."""
+    fila = db.execute("SELECT valor, ultimo FROM contadores WHERE email=? AND contador='racha_checkins' "
+                      "AND periodo=''", (email,)).fetchone()
+    if fila and fila["ultimo"] == semana:
+        return
+    valor = fila["valor"] + 1 if fila and fila["ultimo"] == semana_anterior else 1
+    db.execute("""INSERT INTO contadores (email, contador, periodo, valor, ultimo)
+        VALUES (?, 'racha_checkins', '', ?, ?)
+        ON CONFLICT(email, contador, periodo) DO UPDATE SET valor = excluded.valor, ultimo = excluded.ultimo""",
+        (email, valor, semana))
+    _evaluar_badges(db, email, "racha_checkins", valor)
+
+def _rachas(db):
+    """Reproducir las rachas de check-in: {email: (racha actual, última semana, racha máxima)}."""
+    rachas, prev = {}, {}
+    for email, semana, lunes in db.execute("""SELECT c.email, c.semana, l.fecha
+            FROM checkins c JOIN calendario k ON k.dia = c.dia JOIN calendario l ON l.dia = k.lunes
+            ORDER BY c.email, l.fecha"""):
+        lunes = date.fromisoformat(lunes)
+        actual, _, maxima = rachas.get(email, (0, None, 0))
+        if prev.get(email) == lunes:
+            continue
+        actual = actual + 1 if prev.get(email) == lunes - timedelta(days=7) else 1
+        rachas[email] = (actual, semana, max(maxima, actual))
+        prev[email] = lunes
+    return rachas
+
+def rebuild_badges(db=None):
+    """Recalcular contadores desde la historia y otorgar los badges que falten.
+    Devuelve cuántos badges se otorgaron."""
+    def run(conn):
+        conn.execute("DELETE FROM contadores")
+        conn.execute(f"INSERT INTO contadores (email, contador, periodo, valor) {_CONTADORES_SQL}")
+        rachas = _rachas(conn)
+        conn.executemany("INSERT INTO contadores (email, contador, periodo, valor, ultimo) "
+                         "VALUES (?, 'racha_checkins', '', ?, ?)",
+                         [(e, actual, semana) for e, (actual, semana, _) in rachas.items()])
+        now, otorgados = datetime.now().isoformat(), 0
+        for contador, reglas in _reglas_badges().items():
+            for b in reglas:
+                if contador == "racha_checkins":
+                    emails = [(e,) for e, (_, _, maxima) in rachas.items() if maxima >= b["umbral"]]
+                else:
+                    emails = conn.execute("SELECT DISTINCT email FROM contadores WHERE contador=? AND valor >= ?",
+                                          (contador, b["umbral"])).fetchall()
+                otorgados += conn.executemany("""INSERT INTO logros (logro_id,email,badge_id,nombre_badge,
+                    descripcion,puntos,categoria,fecha,icono)
+                    SELECT ?9, ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8
+                    WHERE NOT EXISTS (SELECT 1 FROM logros WHERE email=?1 AND badge_id=?2)""",
+                    [(e, b["id"], b["nombre"], b["desc"], b["puntos"], b["categoria"], now, b["icono"], nuevo_id())
+                     for (e,) in emails]).rowcount
+        if otorgados:
+            sync_points_from_logros(conn)
+        return otorgados
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        return run(conn)
+
+def verify_badges():
+    """Diferencias entre contadores y un recálculo, más badges merecidos sin otorgar:
+    [(email, contador o badge, guardado, real)]."""
+    with get_db() as db:
+        stored = {(e, c, p): v for e, c, p, v in db.execute(
+            "SELECT email, contador, periodo, valor FROM contadores")}
+        real = {(e, c, p): v for e, c, p, v in db.execute(_CONTADORES_SQL)}
+        rachas = _rachas(db)
+        real.update({(e, "racha_checkins", ""): actual for e, (actual, _, _) in rachas.items()})
+        logros = {(e, b) for e, b in db.execute("SELECT email, badge_id FROM logros")}
+    diffs = [(e, c if not p else f"{c}[{p}]", stored.get((e, c, p)), real.get((e, c, p)))
+             for e, c, p in sorted(set(stored) | set(real)) if stored.get((e, c, p)) != real.get((e, c, p))]
+    for contador, reglas in _reglas_badges().items():
+        for b in reglas:
+            if contador == "racha_checkins":
+                merecen = {e for e, (_, _, maxima) in rachas.items() if maxima >= b["umbral"]}
+            else:
+                merecen = {e for (e, c, _), v in real.items() if c == contador and v >= b["umbral"]}
+            diffs += [(e, b["id"], "sin otorgar", "merecido") for e in sorted(merecen) if (e, b["id"]) not in logros]
+    return diffs
+
+def get_badge_progress(email):
+    """Avance hacia cada badge de config.BADGES: {badge_id: (valor, umbral)}.
+    Los contadores _mes se leen del mes en curso."""
+    mes = datetime.now().strftime("%Y-%m")
+    with get_db() as db:
+        valores = {c: v for c, v in db.execute("""SELECT contador, valor FROM contadores
+            WHERE email=? AND periodo IN ('', ?)""", (email, mes))}
+    return {b["id"]: (valores.get(b["contador"], 0), b["umbral"])
+            for reglas in _reglas_badges().values() for b in reglas}
+
+# ── PUNTOS ──
+# puntos_ledger es append-only: cada evento que da (o quita) puntos es una
+# fila con su fuente y una referencia única (fuente, ref) para no duplicar.
+# puntos_saldo guarda el saldo corriente y se actualiza en la misma
+# transacción que el evento, así leer los puntos es una búsqueda por PK.
+def _crear_puntos(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS puntos_ledger (
+        evento_id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT NOT NULL,
+        puntos INTEGER NOT NULL, fuente TEXT NOT NULL, ref TEXT NOT NULL,
+        fecha TEXT, UNIQUE (fuente, ref))""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_email ON puntos_ledger(email, evento_id)")
+    db.execute("""CREATE TABLE IF NOT EXISTS puntos_saldo (
+        email TEXT PRIMARY KEY, saldo INTEGER NOT NULL DEFAULT 0,
+        ultimo_evento INTEGER, fecha_actualizacion TEXT) WITHOUT ROWID""")
+    sync_points_from_logros(db)
+
+def registrar_puntos(db, email, puntos, fuente, ref):
+    """Agregar un evento al ledger y mover el saldo. Usa la conexión de quien llama
+    (misma transacción). Devuelve False si (fuente, ref) ya estaba registrado."""
+    now = datetime.now().isoformat()
+    cur = db.execute("INSERT OR IGNORE INTO puntos_ledger (email, puntos, fuente, ref, fecha) "
+        "VALUES (?,?,?,?,?)", (email, puntos or 0, fuente, ref, now))
+    if not cur.rowcount:
+        return False
+    db.execute("""INSERT INTO puntos_saldo (email, saldo, ultimo_evento, fecha_actualizacion)
+        VALUES (?,?,?,?) ON CONFLICT(email) DO UPDATE SET saldo = saldo + excluded.saldo,
+        ultimo_evento = excluded.ultimo_evento, fecha_actualizacion = excluded.fecha_actualizacion""",
+        (email, puntos or 0, cur.lastrowid, now))
     return True
 
+def get_points_history(email, limit=50):
+    with get_db() as db:
+        return dict_rows(db.execute(
+            "SELECT * FROM puntos_ledger WHERE email=? ORDER BY evento_id DESC LIMIT ?",
+            (email, limit)).fetchall())
+
+def sync_points_from_logros(db):
+    """Registrar en el ledger los logros insertados sin pasar por otorgar_badge
+    (seed, imports, datos previos al ledger) y rehacer los saldos."""
+    db.execute("""INSERT OR IGNORE INTO puntos_ledger (email, puntos, fuente, ref, fecha)
+        SELECT email, COALESCE(puntos, 0), 'badge', logro_id, fecha FROM logros
+        WHERE logro_id NOT IN (SELECT ref FROM puntos_ledger WHERE fuente='badge')
+        ORDER BY fecha""")
+    rebuild_points(db)
+
+def rebuild_points(db=None):
+    """Recalcular todos los saldos reproduciendo el ledger."""
+    def run(conn):
+        conn.execute("DELETE FROM puntos_saldo")
+        conn.execute("""INSERT INTO puntos_saldo (email, saldo, ultimo_evento, fecha_actualizacion)
+            SELECT email, SUM(puntos), MAX(evento_id), MAX(fecha) FROM puntos_ledger GROUP BY email""")
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+
+def verify_points():
+    """Reproducir el ledger y compararlo con los saldos y con logros.
+
+    Devuelve una lista de problemas [(email, detalle)]; vacía si todo cuadra.
+    """
+    with get_db() as db:
+        replay = dict(db.execute("SELECT email, SUM(puntos) FROM puntos_ledger GROUP BY email"))
+        saldos = dict(db.execute("SELECT email, saldo FROM puntos_saldo"))
+        huerfanos = db.execute("""SELECT email, logro_id FROM logros WHERE logro_id NOT IN
+            (SELECT ref FROM puntos_ledger WHERE fuente='badge')""").fetchall()
+    problems = [(e, f"saldo={saldos.get(e, 0)} ledger={replay.get(e, 0)}")
+                for e in sorted(set(replay) | set(saldos)) if saldos.get(e, 0) != replay.get(e, 0)]
+    problems += [(e, f"logro {lid} sin evento en el ledger") for e, lid in huerfanos]
+    return problems
+
+# ── JERARQUÍA ──
+# jerarquia es la clausura transitiva de usuarios.email_lider: una fila
+# (ancestro, descendiente, profundidad) por cada par jefe → persona a
+# cualquier nivel, más (email, email, 0) para cada persona. El subárbol de
+# alguien es un rango del PK y su cadena de mando un rango de
+# idx_jerarquia_desc. add_colaborador y update_colaborador la mantienen en
+# su misma transacción; rebuild_hierarchy() la recalcula desde usuarios.
+_MAX_PROFUNDIDAD = 32  # corta ciclos accidentales en email_lider
+
+_JERARQUIA_SQL = f"""
+    WITH RECURSIVE arbol(ancestro, descendiente, profundidad) AS (
+        SELECT email, email, 0 FROM usuarios
+        UNION SELECT email_lider, email_lider, 0 FROM usuarios
+            WHERE email_lider IS NOT NULL AND email_lider != ''
+        UNION
+        SELECT u.email_lider, a.descendiente, a.profundidad + 1
+        FROM arbol a JOIN usuarios u ON u.email = a.ancestro
+        WHERE u.email_lider IS NOT NULL AND u.email_lider != '' AND a.profundidad < {_MAX_PROFUNDIDAD}
+    )
+    SELECT ancestro, descendiente, MIN(profundidad) FROM arbol GROUP BY ancestro, descendiente"""
+_JERARQUIA_INSERT_SQL = f"INSERT INTO jerarquia (ancestro, descendiente, profundidad) {_JERARQUIA_SQL}"
+
+def _crear_jerarquia(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS jerarquia (
+        ancestro TEXT NOT NULL, descendiente TEXT NOT NULL, profundidad INTEGER NOT NULL,
+        PRIMARY KEY (ancestro, descendiente)) WITHOUT ROWID""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_jerarquia_desc ON jerarquia(descendiente, profundidad)")
+    rebuild_hierarchy(db)
+
+def _reporta_a(db, email, jefe):
+    """¿email está en el subárbol de jefe (o es jefe)?"""
+    return db.execute("SELECT 1 FROM jerarquia WHERE ancestro=? AND descendiente=?",
+                      (jefe, email)).fetchone() is not None
+
+def _set_lider(db, email, email_lider):
+    """Mover el subárbol de email para que cuelgue de email_lider (None = raíz).
+    Quien llama debe haber descartado ciclos con _reporta_a()."""
+    db.execute("INSERT OR IGNORE INTO jerarquia VALUES (?,?,0)", (email, email))
+    antes = _ancestros(db, email)
+    # Cortar los vínculos entre los ancestros actuales y todo el subárbol
+    db.execute("""DELETE FROM jerarquia
+        WHERE ancestro IN (SELECT ancestro FROM jerarquia WHERE descendiente=? AND profundidad > 0)
+          AND descendiente IN (SELECT descendiente FROM jerarquia WHERE ancestro=?)""", (email, email))
+    if email_lider:
+        db.execute("INSERT OR IGNORE INTO jerarquia VALUES (?,?,0)", (email_lider, email_lider))
+        db.execute("""INSERT INTO jerarquia (ancestro, descendiente, profundidad)
+            SELECT sup.ancestro, sub.descendiente, sup.profundidad + sub.profundidad + 1
+            FROM jerarquia sup, jerarquia sub WHERE sup.descendiente=? AND sub.ancestro=?""",
+            (email_lider, email))
+    # Los feeds de la cadena anterior pierden al subárbol: se recalculan.
+    # Los de la nueva solo ganan: basta mezclar los últimos N del subárbol.
+    _refill_team_feed(db, antes)
+    nuevos = [a for a in _ancestros(db, email) if a not in antes]
+    if nuevos:
+        db.executemany("""INSERT OR IGNORE INTO feed_equipo (lider, fecha, checkin_id)
+            SELECT ?, c.fecha, c.checkin_id FROM jerarquia j JOIN checkins c ON c.email = j.descendiente
+            JOIN identidad i ON i.email = c.email AND i.estado = 'Activo'
+            WHERE j.ancestro=? ORDER BY c.fecha DESC, c.checkin_id DESC LIMIT ?""",
+            [(a, email, FEED_EQUIPO_N) for a in nuevos])
+        _trim_team_feed(db, email)
+
+def _ancestros(db, email):
+    return [r[0] for r in db.execute(
+        "SELECT ancestro FROM jerarquia WHERE descendiente=? AND profundidad > 0", (email,))]
+
+def get_direct_reports(email):
+    with get_db() as db:
+        return dict_rows(db.execute("""
+            SELECT i.* FROM jerarquia j JOIN identidad i ON i.email = j.descendiente
+            WHERE j.ancestro=? AND j.profundidad = 1 AND i.estado='Activo'
+            ORDER BY i.nombre""", (email,)).fetchall())
+
+def get_subtree(email, max_depth=None):
+    """Personas activas bajo email a cualquier nivel (o hasta max_depth), con su profundidad."""
+    with get_db() as db:
+        return dict_rows(db.execute("""
+            SELECT i.*, j.profundidad FROM jerarquia j JOIN identidad i ON i.email = j.descendiente
+            WHERE j.ancestro=? AND j.profundidad BETWEEN 1 AND ? AND i.estado='Activo'
+            ORDER BY j.profundidad, i.nombre""", (email, max_depth or _MAX_PROFUNDIDAD)).fetchall())
+
+def get_chain_of_command(email):
+    """Cadena de mando de email, del líder directo hacia arriba."""
+    with get_db() as db:
+        return dict_rows(db.execute("""
+            SELECT i.*, j.profundidad FROM jerarquia j JOIN identidad i ON i.email = j.ancestro
+            WHERE j.descendiente=? AND j.profundidad > 0
+            ORDER BY j.profundidad""", (email,)).fetchall())
+
+def rebuild_hierarchy(db=None):
+    """Recalcular la clausura completa desde usuarios.email_lider."""
+    def run(conn):
+        conn.execute("DELETE FROM jerarquia")
+        conn.execute(_JERARQUIA_INSERT_SQL)
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+
+def verify_hierarchy():
+    """Diferencias entre jerarquia y un recálculo: [(ancestro, descendiente, guardado, real)]."""
+    with get_db() as db:
+        stored = {(a, d): p for a, d, p in db.execute("SELECT ancestro, descendiente, profundidad FROM jerarquia")}
+        real = {(a, d): p for a, d, p in db.execute(_JERARQUIA_SQL)}
+    return [(k[0], k[1], stored.get(k), real.get(k))
+            for k in sorted(set(stored) | set(real)) if stored.get(k) != real.get(k)]
+
+# ── FEED DE EQUIPO ──
+# feed_equipo guarda, por líder, las referencias a los FEED_EQUIPO_N
+# check-ins más recientes de su subárbol. save_checkin empuja cada check-in
+# al feed de toda su cadena de mando y recorta, así leer el feed es un rango
+# del PK sin importar el tamaño del equipo ni cuánta historia tenga.
+# Solo entran check-ins de personas activas: al desactivar o reactivar a
+# alguien se recalculan los feeds de su cadena, así los N del feed son N
+# filas que get_team_checkins sí devuelve.
+FEED_EQUIPO_N = 100
+
+_FEED_EQUIPO_SQL = f"""
+    SELECT lider, fecha, checkin_id FROM (
+        SELECT j.ancestro AS lider, c.fecha, c.checkin_id, ROW_NUMBER() OVER (
+            PARTITION BY j.ancestro ORDER BY c.fecha DESC, c.checkin_id DESC) AS n
+        FROM jerarquia j JOIN checkins c ON c.email = j.descendiente
+        JOIN identidad i ON i.email = c.email AND i.estado = 'Activo'
+        WHERE j.profundidad > 0
+    ) WHERE n <= {FEED_EQUIPO_N}"""
+
+def _crear_feed_equipo(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS feed_equipo (
+        lider TEXT NOT NULL, fecha TEXT NOT NULL, checkin_id TEXT NOT NULL,
+        PRIMARY KEY (lider, fecha, checkin_id)) WITHOUT ROWID""")
+    rebuild_team_feed(db)
+
+def _trim_team_feed(db, email):
+    """Dejar solo los últimos N en los feeds de la cadena de mando de email."""
+    db.execute("""DELETE FROM feed_equipo
+        WHERE lider IN (SELECT ancestro FROM jerarquia WHERE descendiente=? AND profundidad > 0)
+          AND (fecha, checkin_id) <= (SELECT f.fecha, f.checkin_id FROM feed_equipo f
+              WHERE f.lider = feed_equipo.lider ORDER BY f.fecha DESC, f.checkin_id DESC
+              LIMIT 1 OFFSET ?)""", (email, FEED_EQUIPO_N))
+
+def _push_team_feed(db, email, fecha, checkin_id):
+    db.execute("""INSERT OR IGNORE INTO feed_equipo (lider, fecha, checkin_id)
+        SELECT ancestro, ?, ? FROM jerarquia WHERE descendiente=? AND profundidad > 0""",
+        (fecha, checkin_id, email))
+    _trim_team_feed(db, email)
+
+def _refill_team_feed(db, lideres):
+    """Recalcular desde checkins el feed de unos líderes concretos."""
+    for lider in lideres:
+        db.execute("DELETE FROM feed_equipo WHERE lider=?", (lider,))
+        db.execute("""INSERT INTO feed_equipo (lider, fecha, checkin_id)
+            SELECT ?, c.fecha, c.checkin_id FROM jerarquia j JOIN checkins c ON c.email = j.descendiente
+            JOIN identidad i ON i.email = c.email AND i.estado = 'Activo'
+            WHERE j.ancestro=? AND j.profundidad > 0
+            ORDER BY c.fecha DESC, c.checkin_id DESC LIMIT ?""", (lider, lider, FEED_EQUIPO_N))
+
+def rebuild_team_feed(db=None):
+    """Recalcular todos los feeds de equipo desde checkins y jerarquia."""
+    def run(conn):
+        conn.execute("DELETE FROM feed_equipo")
+        conn.execute(f"INSERT INTO feed_equipo (lider, fecha, checkin_id) {_FEED_EQUIPO_SQL}")
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+
+def verify_team_feed():
+    """Diferencias entre feed_equipo y un recálculo: [(lider, checkin_id, 'sobra'|'falta')]."""
+    with get_db() as db:
+        stored = {(l, c) for l, _, c in db.execute("SELECT lider, fecha, checkin_id FROM feed_equipo")}
+        real = {(l, c) for l, _, c in db.execute(_FEED_EQUIPO_SQL)}
+    return sorted([(l, c, "sobra") for l, c in stored - real] + [(l, c, "falta") for l, c in real - stored])
+
 # ── NOTIFICACIONES ──
 def get_notificaciones(email, limit=20):
     with get_db() as db:
@@ -465,35 +2285,459 @@ def count_unread(email):
         return db.execute("SELECT COUNT(*) FROM notificaciones WHERE email_dest=? AND leida=0",
             (email,)).fetchone()[0]
 
+# ── PAGINACIÓN KEYSET ──
+# Cada página se pide con el cursor de la última fila vista y devuelve
+# (filas, siguiente_cursor); siguiente_cursor es None en la última.
+# A diferencia de OFFSET, el costo no crece con la profundidad: el índice
+# (…, id) o (…, fecha, id) salta directo al punto de corte. Con ids de
+# nuevo_id() el orden por id ya es el de alta y el cursor es solo el id;
+# fecha_col queda para tablas con ids que no ordenan (notificaciones).
+def _keyset_page(select, where, params, fecha_col, id_col, limit, cursor):
+    id_key = id_col.split(".")[-1]
+    if fecha_col is None:
+        orden = f"{id_col} DESC"
+        if cursor:
+            where += f" AND {id_col} < ?"
+            params = (*params, cursor)
+    else:
+        orden = f"{fecha_col} DESC, {id_col} DESC"
+        if cursor:
+            where += f" AND ({fecha_col}, {id_col}) < (?, ?)"
+            params = (*params, *cursor)
+    with get_db() as db:
+        rows = dict_rows(db.execute(
+            f"{select} WHERE {where} ORDER BY {orden} LIMIT ?",
+            (*params, limit + 1)).fetchall())
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if fecha_col is None:
+            return rows, rows[-1][id_key]
+        return rows, (rows[-1][fecha_col.split(".")[-1]], rows[-1][id_key])
+    return rows, None
+
+def page_faros_publicos(limit=20, cursor=None):
+    return _keyset_page("SELECT * FROM faros", "visible=1", (),
+                        None, "faro_id", limit, cursor)
+
+def page_my_checkins(email, limit=10, cursor=None):
+    return _keyset_page("SELECT * FROM checkins", "email=?", (email,),
+                        None, "checkin_id", limit, cursor)
+
+def page_my_journal(email, limit=10, cursor=None):
+    return _keyset_page("SELECT * FROM journal", "email=?", (email,),
+                        None, "journal_id", limit, cursor)
+
+def page_notificaciones(email, limit=20, cursor=None):
+    return _keyset_page("SELECT * FROM notificaciones", "email_dest=?", (email,),
+                        "fecha", "notif_id", limit, cursor)
+
+def page_checkins_recientes(limit=20, cursor=None):
+    return _keyset_page("SELECT c.*, i.nombre FROM checkins c JOIN identidad i ON c.email = i.email",
+                        "1=1", (), None, "c.checkin_id", limit, cursor)
+
+# ── CONTEXTO DE SESIÓN ──
+def load_user_context(email, checkins_limit=4):
+    """UserContext: todo lo que el sidebar y las páginas leen del usuario en un rerun.
+
+    Una sola conexión y una consulta por entidad: usuario (con puntos, no
+    leídas y check-in de la semana como subconsultas), identidad, logros,
+    últimos check-ins, más la lista de usuarios activos del selector (cacheada).
+    app.py lo carga una vez por rerun y lo deja en st.session_state.ctx.
+    """
+    with get_db() as db:
+        row = dict_row(db.execute("""
+            SELECT u.*,
+                (SELECT COALESCE(MAX(saldo),0) FROM puntos_saldo WHERE email=u.email) AS _puntos,
+                (SELECT COUNT(*) FROM notificaciones WHERE email_dest=u.email AND leida=0) AS _unread,
+                EXISTS(SELECT 1 FROM checkins WHERE email=u.email AND semana=?) AS _checkin
+            FROM usuarios u WHERE u.email=?""", (semana_key(datetime.now()), email)).fetchone())
+        extra = {k: row.pop(k) for k in ("_puntos", "_unread", "_checkin")} if row else {}
+        ctx = {
+            "email": email,
+            "user": row,
+            "identidad": dict_row(db.execute("SELECT * FROM identidad WHERE email=?", (email,)).fetchone()),
+            "puntos": extra.get("_puntos", 0),
+            "unread": extra.get("_unread", 0),
+            "checkin_semana": bool(extra.get("_checkin")),
+            "logros": dict_rows(db.execute(
+                "SELECT * FROM logros WHERE email=? ORDER BY fecha DESC", (email,)).fetchall()),
+            "checkins": dict_rows(db.execute(
+                "SELECT * FROM checkins WHERE email=? ORDER BY checkin_id DESC LIMIT ?",
+                (email, checkins_limit)).fetchall()),
+        }
+    ctx["usuarios"] = get_all_users()
+    return ctx
+
 # ── ANALYTICS (Admin) ──
+@cached("usuarios", "checkins", "faros")
 def get_analytics():
+    """KPIs del header admin leídos de las métricas materializadas.
+
+    Se leen como mucho ~31 filas diarias + los totales, sin importar cuánta
+    historia haya. Las ventanas se cuentan por día calendario (últimos 7 y
+    30 días incluyendo hoy) en vez de al segundo.
+    """
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday())
+    d7, d30 = today - timedelta(days=6), today - timedelta(days=29)
     with get_db() as db:
-        total_users = db.execute("SELECT COUNT(*) FROM usuarios WHERE estado='Activo'").fetchone()[0]
-        checkins_week = db.execute("SELECT COUNT(*) FROM checkins WHERE semana=?",
-            (f"{datetime.now().year}-S{datetime.now().isocalendar()[1]:02d}",)).fetchone()[0]
-        avg_estres = db.execute("SELECT AVG(nivel_estres) FROM checkins WHERE fecha > ?",
-            ((datetime.now() - timedelta(days=7)).isoformat(),)).fetchone()[0] or 0
-        alertas = db.execute("SELECT COUNT(*) FROM checkins WHERE alerta_enviada=1 AND fecha > ?",
-            ((datetime.now() - timedelta(days=7)).isoformat(),)).fetchone()[0]
-        faros_mes = db.execute("SELECT COUNT(*) FROM faros WHERE fecha_envio > ?",
-            ((datetime.now() - timedelta(days=30)).isoformat(),)).fetchone()[0]
-        total_faros = db.execute("SELECT COUNT(*) FROM faros").fetchone()[0]
-        return {
-            "total_users": total_users, "checkins_week": checkins_week,
-            "avg_estres": round(avg_estres, 1), "alertas": alertas,
-            "faros_mes": faros_mes, "total_faros": total_faros,
-            "tasa_checkin": round((checkins_week / max(total_users, 1)) * 100),
-        }
+        totals = dict(db.execute("SELECT metrica, valor FROM metricas "
+            "WHERE metrica IN ('usuarios_activos', 'faros_total')").fetchall())
+        days = db.execute("SELECT dia, metrica, valor FROM metricas_diarias WHERE dia >= ?",
+            (dia_key(min(week_start, d30)),)).fetchall()
+    week, last7, last30 = {}, {}, {}
+    for dia, metrica, valor in days:
+        for bucket, since in ((week, dia_key(week_start)), (last7, dia_key(d7)), (last30, dia_key(d30))):
+            if dia >= since:
+                bucket[metrica] = bucket.get(metrica, 0) + valor
+    total_users = int(totals.get("usuarios_activos", 0))
+    checkins_week = int(week.get("checkins", 0))
+    avg_estres = last7.get("estres_sum", 0) / last7["checkins"] if last7.get("checkins") else 0
+    return {
+        "total_users": total_users, "checkins_week": checkins_week,
+        "avg_estres": round(avg_estres, 1), "alertas": int(last7.get("alertas", 0)),
+        "faros_mes": int(last30.get("faros", 0)), "total_faros": int(totals.get("faros_total", 0)),
+        "tasa_checkin": round((checkins_week / max(total_users, 1)) * 100),
+    }
+
+# ── MÉTRICAS MATERIALIZADAS ──
+# metricas_diarias: contadores por día (checkins, estres_sum, alertas, faros)
+# metricas: totales globales (usuarios_activos, faros_total)
+# Las escrituras los actualizan en su misma transacción; rebuild_metrics()
+# los recalcula desde cero y verify_metrics() compara ambos.
+def _crear_metricas(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS metricas_diarias (
+        dia INTEGER, metrica TEXT, valor REAL DEFAULT 0,
+        PRIMARY KEY (dia, metrica)) WITHOUT ROWID""")
+    db.execute("""CREATE TABLE IF NOT EXISTS metricas (
+        metrica TEXT PRIMARY KEY, valor REAL DEFAULT 0) WITHOUT ROWID""")
+
+def _metricas_dia_entero(db):
+    """Pasar metricas_diarias de 'AAAA-MM-DD' a la clave entera de las columnas
+    `dia` (migración 9) y recalcularlas; la migración 3 solo crea las tablas."""
+    db.execute("DROP TABLE IF EXISTS metricas_diarias")
+    _crear_metricas(db)
+    rebuild_metrics(db)
+
+def _bump_day(db, dia, **deltas):
+    db.executemany("""INSERT INTO metricas_diarias (dia, metrica, valor) VALUES (?,?,?)
+        ON CONFLICT(dia, metrica) DO UPDATE SET valor = valor + excluded.valor""",
+        [(dia, k, v) for k, v in deltas.items() if v])
+
+def _bump_total(db, **deltas):
+    db.executemany("""INSERT INTO metricas (metrica, valor) VALUES (?,?)
+        ON CONFLICT(metrica) DO UPDATE SET valor = valor + excluded.valor""",
+        [(k, v) for k, v in deltas.items() if v])
+
+_METRICAS_DIARIAS_SQL = """
+    SELECT dia, metrica, valor FROM (
+        SELECT dia, 'checkins' AS metrica, COUNT(*) AS valor FROM checkins GROUP BY dia
+        UNION ALL SELECT dia, 'estres_sum', SUM(nivel_estres) FROM checkins GROUP BY dia
+        UNION ALL SELECT dia, 'alertas', SUM(alerta_enviada) FROM checkins GROUP BY dia
+        UNION ALL SELECT dia, 'faros', COUNT(*) FROM faros GROUP BY dia
+    ) WHERE dia > 0 AND valor != 0"""
+_METRICAS_TOTALES_SQL = """
+    SELECT 'usuarios_activos', COUNT(*) FROM usuarios WHERE estado='Activo'
+    UNION ALL SELECT 'faros_total', COUNT(*) FROM faros"""
+
+def rebuild_metrics(db=None):
+    """Recalcular todas las métricas materializadas desde las tablas base."""
+    def run(conn):
+        conn.execute("DELETE FROM metricas_diarias")
+        conn.execute("DELETE FROM metricas")
+        conn.execute(f"INSERT INTO metricas_diarias (dia, metrica, valor) {_METRICAS_DIARIAS_SQL}")
+        conn.execute(f"INSERT INTO metricas (metrica, valor) {_METRICAS_TOTALES_SQL}")
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+    invalidate("checkins", "faros", "usuarios")
+
+def verify_metrics():
+    """Diferencias entre las métricas guardadas y un recálculo: [(dia, metrica, guardado, real)]."""
+    with get_db() as db:
+        stored = {(d, m): v for d, m, v in db.execute("SELECT dia, metrica, valor FROM metricas_diarias")}
+        stored.update({("*", m): v for m, v in db.execute("SELECT metrica, valor FROM metricas")})
+        real = {(d, m): v for d, m, v in db.execute(_METRICAS_DIARIAS_SQL)}
+        real.update({("*", m): v for m, v in db.execute(_METRICAS_TOTALES_SQL)})
+    return [(k[0], k[1], stored.get(k, 0), real.get(k, 0))
+            for k in sorted(set(stored) | set(real), key=str) if (stored.get(k) or 0) != (real.get(k) or 0)]
+
+# ── CUBO DE BIENESTAR ──
+# Acumulan los check-ins por semana ISO y dimensiones organizacionales:
+# conteo, suma y suma de cuadrados del estrés, alertas y la distribución de
+# estado_general. cubo_bienestar es (semana, unidad, rol) y responde las
+# vistas por unidad/semana/rol; cubo_bienestar_lider agrega además el líder
+# directo, solo para bajar al detalle de una unidad en una semana.
+# save_checkin los actualiza en su misma transacción con la unidad/rol/líder
+# que la persona tiene en ese momento; rebuild_wellbeing_cube() re-atribuye
+# toda la historia con los actuales. Las dimensiones vacías se guardan como
+# '' (el PK no admite NULL).
+_CUBOS = {
+    "cubo_bienestar": ("semana", "unidad", "rol"),
+    "cubo_bienestar_lider": ("semana", "unidad", "lider", "rol"),
+}
+_CUBO_DIM_SQL = {"unidad": "COALESCE(i.unidad, '')", "rol": "COALESCE(i.rol, '')",
+                 "lider": "COALESCE(i.email_lider, '')"}
+_CUBO_MEDIDAS = ("checkins", "estres_sum", "estres_sq", "alertas", "genial", "normal", "dificil")
+
+def _crear_cubo_bienestar(db):
+    for tabla, dims in _CUBOS.items():
+        db.execute(f"""CREATE TABLE IF NOT EXISTS {tabla} (
+            {", ".join(f"{d} TEXT NOT NULL" for d in dims)},
+            {", ".join(f"{m} INTEGER DEFAULT 0" for m in _CUBO_MEDIDAS)},
+            PRIMARY KEY ({", ".join(dims)})) WITHOUT ROWID""")
+    rebuild_wellbeing_cube(db)
+
+def _bump_cubo(db, email, semana, estado, estres):
+    medidas = (1, estres, estres * estres, 1 if estres >= 4 else 0,
+               int(estado == "GENIAL"), int(estado == "NORMAL"), int(estado == "DIFICIL"))
+    for tabla, dims in _CUBOS.items():
+        db.execute(f"""INSERT INTO {tabla} ({", ".join(dims + _CUBO_MEDIDAS)})
+            SELECT ?, {", ".join(_CUBO_DIM_SQL[d] for d in dims[1:])}, {", ".join("?" * len(medidas))}
+            FROM identidad i WHERE i.email=?
+            ON CONFLICT({", ".join(dims)}) DO UPDATE SET
+            {", ".join(f"{m} = {m} + excluded.{m}" for m in _CUBO_MEDIDAS)}""",
+            (semana, *medidas, email))
+
+def rebuild_wellbeing_cube(db=None):
+    """Recalcular los cubos completos desde checkins e identidad."""
+    def run(conn):
+        for tabla, dims in _CUBOS.items():
+            conn.execute(f"DELETE FROM {tabla}")
+            conn.execute(f"""INSERT INTO {tabla} ({", ".join(dims + _CUBO_MEDIDAS)})
+                SELECT c.semana, {", ".join(_CUBO_DIM_SQL[d] for d in dims[1:])},
+                       COUNT(*), SUM(c.nivel_estres), SUM(c.nivel_estres * c.nivel_estres),
+                       SUM(c.nivel_estres >= 4), SUM(c.estado_general = 'GENIAL'),
+                       SUM(c.estado_general = 'NORMAL'), SUM(c.estado_general = 'DIFICIL')
+                FROM checkins c JOIN identidad i ON i.email = c.email
+                WHERE c.semana IS NOT NULL
+                GROUP BY {", ".join(str(n) for n in range(1, len(dims) + 1))}""")
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+    invalidate("checkins")
+
+@cached("checkins", "usuarios")
+def get_bienestar(por="unidad", semanas=8, unidad=None, rol=None, semana=None):
+    """Agregados de bienestar leídos del cubo, agrupados por una dimensión.
+
+    por: "unidad", "semana", "rol" o "lider". Filtra por las últimas
+    `semanas` semanas (o una `semana` concreta) y opcionalmente por unidad
+    y rol. Cada fila trae checkins, avg_estres, desv_estres, alertas y la
+    distribución genial/normal/dificil; con por="lider" también el nombre.
+    """
+    tabla = "cubo_bienestar_lider" if por == "lider" else "cubo_bienestar"
+    if por not in _CUBOS[tabla]:
+        raise ValueError(f"Dimensión desconocida: {por}")
+    where, params = [], []
+    if semana:
+        where.append("semana = ?"); params.append(semana)
+    else:
+        where.append("semana >= ?"); params.append(semana_key(datetime.now() - timedelta(weeks=semanas - 1)))
+    if unidad is not None:
+        where.append("unidad = ?"); params.append(unidad)
+    if rol is not None:
+        where.append("rol = ?"); params.append(rol)
+    nombre = (", (SELECT nombre FROM identidad WHERE email = lider) AS nombre" if por == "lider" else "")
+    with get_db() as db:
+        rows = dict_rows(db.execute(f"""
+            SELECT {por}, SUM(checkins) AS checkins, SUM(estres_sum) AS estres_sum,
+                   SUM(estres_sq) AS estres_sq, SUM(alertas) AS alertas, SUM(genial) AS genial,
+                   SUM(normal) AS normal, SUM(dificil) AS dificil{nombre}
+            FROM {tabla} WHERE {" AND ".join(where)}
+            GROUP BY {por} ORDER BY {por}""", params).fetchall())
+    for r in rows:
+        n = r["checkins"] or 1
+        media = r["estres_sum"] / n
+        r["avg_estres"] = round(media, 2)
+        r["desv_estres"] = round(max(r["estres_sq"] / n - media * media, 0) ** 0.5, 2)
+    return rows
+
+# ═══════════════════════════════════════════
+# AUTENTICACIÓN
+# ═══════════════════════════════════════════
+# usuarios.password guarda "pbkdf2_sha256$<iteraciones>$<sal>$<hash>" con sal
+# de 16 bytes por fila, también en las cuentas nuevas o reseteadas. Su clave
+# inicial es pública (PASSWORD_INICIAL): lo que las protege es
+# must_change_password, que la app exige cambiar, no el costo del hash, así
+# que se hashea con PASSWORD_INICIAL_ITERACIONES y un lote (importación,
+# reseteo masivo) cuesta milisegundos y no minutos.
+#
+# iniciar_sesion() verifica la clave una vez y entrega un token firmado con
+# HMAC (email, vencimiento y huella del hash vigente). sesion_activa() lo
+# resuelve en cada rerun desde _sesiones, en memoria, sin tocar la BD; cada
+# SESION_REVALIDAR segundos (o si el token viene de otro proceso) relee estado
+# y hash por PK, así que una baja o un cambio de clave hecho en otro proceso
+# corta la sesión. La clave de firma es ITACA_SESSION_SECRET o una aleatoria
+# por proceso.
+PASSWORD_INICIAL = "Itaca2026!"
+PASSWORD_ITERACIONES = 600_000
+PASSWORD_INICIAL_ITERACIONES = 1_000
+SESION_TTL = 12 * 3600
+SESION_REVALIDAR = 300
+_CLAVE_SESION = os.environ.get("ITACA_SESSION_SECRET", "").encode() or os.urandom(32)
+_sesiones = {}  # token -> {email, rol, must_change, expira, huella, validada} o {expira, cerrada}
+_sesiones_lock = threading.Lock()
+
+def hash_password(password, iteraciones=None):
+    """Hash PBKDF2-SHA256 con sal aleatoria, en el formato de usuarios.password."""
+    iteraciones = iteraciones or PASSWORD_ITERACIONES
+    sal = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode(), sal, iteraciones)
+    return f"pbkdf2_sha256${iteraciones}${sal.hex()}${dk.hex()}"
+
+def verificar_password(password, guardado):
+    """True si password corresponde al hash guardado (comparación en tiempo constante)."""
+    try:
+        algoritmo, iteraciones, sal, dk = (guardado or "").split("$")
+        calculado = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(sal), int(iteraciones))
+    except ValueError:
+        return False
+    return algoritmo == "pbkdf2_sha256" and hmac.compare_digest(calculado.hex(), dk)
+
+def _hash_inicial():
+    """Hash de PASSWORD_INICIAL con sal propia, para una cuenta nueva o reseteada."""
+    return hash_password(PASSWORD_INICIAL, PASSWORD_INICIAL_ITERACIONES)
+
+@functools.lru_cache(maxsize=1)
+def _hash_relleno():
+    # Solo para igualar el costo del login de un email inexistente; no se guarda
+    return hash_password(PASSWORD_INICIAL)
+
+def _hashear_passwords(db):
+    db.execute("ALTER TABLE usuarios ADD COLUMN must_change_password INTEGER NOT NULL DEFAULT 0")
+    db.execute("UPDATE usuarios SET must_change_password=1 WHERE password IS NULL OR password=?",
+               (PASSWORD_INICIAL,))
+    filas = db.execute("SELECT email, COALESCE(password, ?) FROM usuarios "
+                       "WHERE password IS NULL OR substr(password, 1, 14) != 'pbkdf2_sha256$'",
+                       (PASSWORD_INICIAL,)).fetchall()
+    # pbkdf2_hmac suelta el GIL: el lote se reparte entre los núcleos
+    with ThreadPoolExecutor() as ex:
+        hashes = list(ex.map(lambda p: _hash_inicial() if p == PASSWORD_INICIAL else hash_password(p),
+                             [p for _, p in filas]))
+    db.executemany("UPDATE usuarios SET password=? WHERE email=?",
+                   [(h, e) for h, (e, _) in zip(hashes, filas)])
+
+def _quitar_password_default(db):
+    """Sacar el DEFAULT 'Itaca2026!' de usuarios.password: un INSERT sin la
+    columna guardaría la clave en texto plano. SQLite no cambia el DEFAULT
+    de una columna, así que la tabla se reconstruye con sus índices."""
+    sql = db.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='usuarios'").fetchone()[0]
+    nuevo = re.sub(r"password TEXT DEFAULT '[^']*'", "password TEXT", sql)
+    if nuevo == sql:
+        return
+    indices = [r[0] for r in db.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name='usuarios' AND sql IS NOT NULL")]
+    db.execute(re.sub(r"CREATE TABLE \w+", "CREATE TABLE _usuarios_nueva", nuevo, count=1))
+    db.execute("INSERT INTO _usuarios_nueva SELECT * FROM usuarios")
+    db.execute("DROP TABLE usuarios")
+    db.execute("ALTER TABLE _usuarios_nueva RENAME TO usuarios")
+    for stmt in indices:
+        db.execute(stmt)
+
+def _huella(guardado):
+    return hashlib.sha256((guardado or "").encode()).hexdigest()[:16]
+
+def _firmar(datos):
+    return hmac.new(_CLAVE_SESION, datos.encode(), hashlib.sha256).hexdigest()
+
+def _leer_token(token):
+    """(email, expira, huella) de un token con firma válida, o None."""
+    try:
+        datos, firma = token.rsplit(".", 1)
+        if not hmac.compare_digest(_firmar(datos), firma):
+            return None
+        email, expira, huella, _ = base64.urlsafe_b64decode(datos).decode().split("\n")
+        return email, float(expira), huella
+    except (AttributeError, ValueError):
+        return None
+
+def _abrir_sesion(token, email, expira, huella, fila, ahora):
+    sesion = {"email": email, "rol": fila["rol"], "must_change": bool(fila["must_change_password"]),
+              "expira": expira}
+    with _sesiones_lock:
+        for t in [t for t, s in _sesiones.items() if s["expira"] <= ahora]:
+            del _sesiones[t]
+        _sesiones[token] = {**sesion, "huella": huella, "validada": ahora}
+    return sesion
+
+_SESION_SQL = "SELECT rol, estado, password, must_change_password FROM usuarios WHERE email=?"
+
+def iniciar_sesion(email, password):
+    """Verificar credenciales y abrir sesión: (token, sesion) o (None, None).
+    sesion es {email, rol, must_change, expira}. Los inactivos no entran."""
+    with get_db() as db:
+        fila = db.execute(_SESION_SQL, (email,)).fetchone()
+    if fila is None or fila["estado"] != "Activo":
+        verificar_password(password, _hash_relleno())  # mismo costo: no delata si el email existe
+        return None, None
+    if not verificar_password(password, fila["password"]):
+        return None, None
+    return _nueva_sesion(email, fila)
+
+def _nueva_sesion(email, fila):
+    ahora = time.time()
+    expira, huella = int(ahora + SESION_TTL), _huella(fila["password"])
+    datos = base64.urlsafe_b64encode(f"{email}\n{expira}\n{huella}\n{secrets.token_hex(8)}".encode()).decode()
+    token = f"{datos}.{_firmar(datos)}"
+    return token, _abrir_sesion(token, email, expira, huella, fila, ahora)
+
+def sesion_activa(token):
+    """Sesión de un token ({email, rol, must_change, expira}) o None si no es
+    válido, venció, se cerró, el usuario está inactivo o cambió la clave."""
+    if not token:
+        return None
+    ahora = time.time()
+    with _sesiones_lock:
+        s = _sesiones.get(token)
+    if s and s.get("cerrada"):
+        return None
+    if s and s["expira"] > ahora and ahora - s["validada"] < SESION_REVALIDAR:
+        return {k: s[k] for k in ("email", "rol", "must_change", "expira")}
+    leido = _leer_token(token)
+    if leido is None or leido[1] <= ahora:
+        return None
+    email, expira, huella = leido
+    with get_db() as db:
+        fila = db.execute(_SESION_SQL, (email,)).fetchone()
+    if fila is None or fila["estado"] != "Activo" or _huella(fila["password"]) != huella:
+        return None
+    return _abrir_sesion(token, email, expira, huella, fila, ahora)
+
+def cerrar_sesion(token):
+    """Cerrar la sesión: el token deja de valer en este proceso hasta que venza."""
+    leido = _leer_token(token)
+    if leido:
+        with _sesiones_lock:
+            _sesiones[token] = {"expira": leido[1], "cerrada": True}
+
+def _revalidar_sesiones(email=None):
+    # La próxima sesion_activa() de esas sesiones relee la BD en vez de esperar SESION_REVALIDAR
+    with _sesiones_lock:
+        for s in _sesiones.values():
+            if "validada" in s and email in (None, s["email"]):
+                s["validada"] = 0
 
 # ═══════════════════════════════════════════
 # ADMIN: GESTIÓN DE COLABORADORES
 # ═══════════════════════════════════════════
 
+@invalidates("usuarios")
 def update_password(email, new_password):
-    """Actualizar contraseña de un usuario"""
+    """Actualizar contraseña de un usuario (y quitar el cambio obligatorio).
+    Sus sesiones abiertas dejan de valer; devuelve (token, sesion) de una
+    sesión nueva, sin volver a verificar la clave recién hasheada."""
     with get_db() as db:
-        db.execute("UPDATE usuarios SET password=? WHERE email=?", (new_password, email))
+        db.execute("UPDATE usuarios SET password=?, must_change_password=0 WHERE email=?",
+                   (hash_password(new_password), email))
+        _emitir(db, "password.cambio", email)
+        fila = db.execute(_SESION_SQL, (email,)).fetchone()
+    _revalidar_sesiones(email)
+    return _nueva_sesion(email, fila) if fila else (None, None)
 
+@invalidates("usuarios")
 def add_colaborador(email, nombre, rol, unidad, email_lider, cargo, telefono, fecha_ingreso):
     """Agregar un nuevo colaborador (desde panel admin)"""
     now = datetime.now().isoformat()
@@ -501,31 +2745,52 @@ def add_colaborador(email, nombre, rol, unidad, email_lider, cargo, telefono, fe
         existing = conn.execute("SELECT 1 FROM usuarios WHERE email=?", (email,)).fetchone()
         if existing:
             return False, "Ya existe un usuario con ese email."
-        conn.execute("INSERT INTO usuarios VALUES (?,?,?,?,?,?,?,?,?)",
-            (email, nombre, rol, "Activo", unidad, email_lider, now, now, "Itaca2026!"))
+        conn.execute("""INSERT INTO usuarios (email,nombre,rol,estado,unidad,email_lider,
+            fecha_registro,ultimo_acceso,password,must_change_password) VALUES (?,?,?,?,?,?,?,?,?,1)""",
+            (email, nombre, rol, "Activo", unidad, email_lider, now, now, _hash_inicial()))
         conn.execute("""INSERT INTO identidad
             (email,nombre,puesto,rol,unidad,estado,email_lider,telefono,fecha_ingreso,fecha_actualizacion)
             VALUES (?,?,?,?,?,?,?,?,?,?)""",
             (email, nombre, cargo, rol, unidad, "Activo", email_lider, telefono, fecha_ingreso, now))
+        _set_lider(conn, email, email_lider)
+        _bump_total(conn, usuarios_activos=1)
+        _emitir(conn, "colaborador.alta", email, rol=rol, unidad=unidad, email_lider=email_lider)
     return True, f"✅ {nombre} agregado exitosamente."
 
+@invalidates("usuarios")
 def deactivate_colaborador(email):
     """Desactivar un colaborador (no se borra, se marca inactivo)"""
     with get_db() as conn:
-        conn.execute("UPDATE usuarios SET estado='Inactivo' WHERE email=?", (email,))
+        changed = conn.execute("UPDATE usuarios SET estado='Inactivo' WHERE email=? AND estado='Activo'",
+            (email,)).rowcount
         conn.execute("UPDATE identidad SET estado='Inactivo' WHERE email=?", (email,))
+        _refill_team_feed(conn, _ancestros(conn, email))
+        _bump_total(conn, usuarios_activos=-changed)
+        if changed:
+            _emitir(conn, "colaborador.baja", email)
+    _revalidar_sesiones(email)
     return True, "Colaborador desactivado."
 
+@invalidates("usuarios")
 def reactivate_colaborador(email):
     """Reactivar un colaborador"""
     with get_db() as conn:
-        conn.execute("UPDATE usuarios SET estado='Activo' WHERE email=?", (email,))
+        changed = conn.execute("UPDATE usuarios SET estado='Activo' WHERE email=? AND estado!='Activo'",
+            (email,)).rowcount
         conn.execute("UPDATE identidad SET estado='Activo' WHERE email=?", (email,))
+        _refill_team_feed(conn, _ancestros(conn, email))
+        _bump_total(conn, usuarios_activos=changed)
+        if changed:
+            _emitir(conn, "colaborador.reactivado", email)
     return True, "Colaborador reactivado."
 
+@invalidates("usuarios")
 def update_colaborador(email, **kwargs):
     """Actualizar datos de un colaborador (nombre, rol, unidad, etc.)"""
     with get_db() as conn:
+        nuevo_lider = kwargs.get("email_lider")
+        if nuevo_lider and _reporta_a(conn, nuevo_lider, email):
+            return False, "El nuevo líder reporta a este colaborador: se formaría un ciclo."
         # Update usuarios
         user_fields = {k: v for k, v in kwargs.items() if k in ("nombre","rol","unidad","email_lider")}
         if user_fields:
@@ -537,13 +2802,23 @@ def update_colaborador(email, **kwargs):
             sets = ", ".join(f"{k}=?" for k in ident_fields)
             conn.execute(f"UPDATE identidad SET {sets}, fecha_actualizacion=? WHERE email=?",
                 (*ident_fields.values(), datetime.now().isoformat(), email))
+        if "email_lider" in kwargs:
+            _set_lider(conn, email, nuevo_lider)
+        _emitir(conn, "colaborador.cambio", email, **kwargs)
+    _revalidar_sesiones(email)
+    return True, "Colaborador actualizado."
 
+@invalidates("usuarios")
 def reset_password(email):
     """Resetear contraseña a la default"""
     with get_db() as conn:
-        conn.execute("UPDATE usuarios SET password='Itaca2026!' WHERE email=?", (email,))
-    return True, "Contraseña reseteada a Itaca2026!"
+        conn.execute("UPDATE usuarios SET password=?, must_change_password=1 WHERE email=?",
+                     (_hash_inicial(), email))
+        _emitir(conn, "password.reset", email)
+    _revalidar_sesiones(email)
+    return True, f"Contraseña reseteada a {PASSWORD_INICIAL}"
 
+@cached("usuarios")
 def get_all_users_admin():
     """Obtener TODOS los usuarios (activos e inactivos) para el panel admin"""
     with get_db() as conn:
@@ -553,11 +2828,623 @@ def get_all_users_admin():
             LEFT JOIN identidad i ON u.email = i.email
             ORDER BY u.estado DESC, u.unidad, u.nombre""").fetchall())
 
+@cached("usuarios")
 def get_units():
     """Obtener lista de unidades únicas"""
     with get_db() as conn:
         rows = conn.execute("SELECT DISTINCT unidad FROM usuarios WHERE unidad IS NOT NULL AND unidad != '' ORDER BY unidad").fetchall()
         return [r[0] for r in rows]
 
+# ── RESÚMENES DEL PANEL ADMIN ──
+@cached("faros")
+def get_faros_por_tipo():
+    """Cantidad de faros por tipo (gráfico de distribución)"""
+    with get_db() as conn:
+        return dict_rows(conn.execute(
+            "SELECT tipo_faro, COUNT(*) as total FROM faros "
+            "GROUP BY tipo_faro").fetchall())
+
+@cached("usuarios")
+def get_resumen_por_unidad():
+    """Total, activos y líderes por unidad"""
+    with get_db() as conn:
+        return dict_rows(conn.execute("""
+            SELECT unidad, COUNT(*) as total,
+                   SUM(CASE WHEN estado='Activo' THEN 1 ELSE 0 END) as activos,
+                   SUM(CASE WHEN rol='Líder' THEN 1 ELSE 0 END) as lideres
+            FROM usuarios WHERE unidad IS NOT NULL AND unidad != ''
+            GROUP BY unidad ORDER BY unidad""").fetchall())
+
+@cached("usuarios")
+def get_resumen_por_rol():
+    """Total y activos por rol"""
+    with get_db() as conn:
+        return dict_rows(conn.execute("""
+            SELECT rol, COUNT(*) as total,
+                   SUM(CASE WHEN estado='Activo' THEN 1 ELSE 0 END) as activos
+            FROM usuarios GROUP BY rol ORDER BY rol""").fetchall())
+
+@invalidates("usuarios")
+def reset_all_passwords():
+    """Resetear la clave de TODOS los usuarios a la default"""
+    with get_db() as conn:
+        emails = [r[0] for r in conn.execute("SELECT email FROM usuarios")]
+    # Los hashes se calculan antes de tomar el lock de escritura
+    with ThreadPoolExecutor() as ex:
+        hashes = list(ex.map(lambda _: _hash_inicial(), emails))
+    with get_db() as conn:
+        n = conn.executemany("UPDATE usuarios SET password=?, must_change_password=1 WHERE email=?",
+                             zip(hashes, emails)).rowcount
+        _emitir(conn, "password.reset_masivo", None, usuarios=n)
+    _revalidar_sesiones()
+
+# ═══════════════════════════════════════════
+# IMPORTACIÓN MASIVA DE COLABORADORES (BD MAESTRA)
+# ═══════════════════════════════════════════
+# read_roster() lee un CSV o XLSX fila por fila, diff_colaboradores() valida
+# y compara contra usuarios/identidad con una sola lectura de la BD, e
+# import_colaboradores() aplica el diff en una transacción con executemany.
+# Los encabezados se normalizan (minúsculas, sin tildes, "_" por espacios) y
+# se traducen con _ROSTER_ALIAS; las columnas que no vengan en el archivo no
+# se tocan en los colaboradores existentes.
+_ROSTER_ALIAS = {
+    "email": "email", "correo": "email", "correo_electronico": "email",
+    "nombre": "nombre", "nombre_completo": "nombre", "rol": "rol", "estado": "estado",
+    "unidad": "unidad", "email_lider": "email_lider", "lider": "email_lider", "correo_lider": "email_lider",
+    "cargo": "puesto", "puesto": "puesto", "celular": "telefono", "telefono": "telefono",
+    "ingreso": "fecha_ingreso", "fecha_ingreso": "fecha_ingreso",
+}
+_ROSTER_USUARIOS = ("nombre", "rol", "estado", "unidad", "email_lider")
+_ROSTER_IDENTIDAD = _ROSTER_USUARIOS + ("puesto", "telefono", "fecha_ingreso")
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode()
+    return "_".join(texto.lower().split())
+
+def read_roster(archivo, nombre_archivo):
+    """Iterar las filas de un CSV o XLSX como dicts {campo: valor} según _ROSTER_ALIAS.
+
+    `archivo` es binario (p.ej. el de st.file_uploader). El CSV puede venir
+    separado por coma o punto y coma; el XLSX se lee en modo read_only y
+    requiere openpyxl (dependencia opcional).
+    """
+    if nombre_archivo.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("Para importar .xlsx instala openpyxl o exporta la hoja a CSV.")
+        wb = load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            filas = wb.active.iter_rows(values_only=True)
+            campos = [_ROSTER_ALIAS.get(_normalizar(h)) for h in next(filas, ())]
+            for valores in filas:
+                if any(v not in (None, "") for v in valores):
+                    yield {c: v for c, v in zip(campos, valores) if c}
+        finally:
+            wb.close()
+        return
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    try:
+        primera = texto.readline()
+        sep = ";" if primera.count(";") > primera.count(",") else ","
+        lector = csv.reader(itertools.chain([primera], texto), delimiter=sep)
+        campos = [_ROSTER_ALIAS.get(_normalizar(h)) for h in next(lector, [])]
+        for valores in lector:
+            if any(v.strip() for v in valores):
+                yield {c: v for c, v in zip(campos, valores) if c}
+    finally:
+        texto.detach()  # no cerrar el archivo de quien llama
+
+def _limpiar_fila(fila, roles):
+    """Normalizar una fila leída. Devuelve (fila, error)."""
+    out = {}
+    for campo, valor in fila.items():
+        if isinstance(valor, datetime):
+            valor = valor.date()
+        if isinstance(valor, date):
+            valor = valor.isoformat()
+        elif isinstance(valor, float) and valor.is_integer():
+            valor = str(int(valor))
+        out[campo] = "" if valor is None else str(valor).strip()
+    for campo in ("rol", "estado"):  # vacíos = no vienen (se usa el default o el valor actual)
+        if not out.get(campo, True):
+            del out[campo]
+    email = out.get("email", "").lower()
+    out["email"] = email
+    if "@" not in email:
+        return out, "email inválido"
+    if "email_lider" in out:
+        out["email_lider"] = out["email_lider"].lower() or None
+        if out["email_lider"] == email:
+            return out, "no puede ser su propio líder"
+    if "rol" in out:
+        rol = {_normalizar(r): r for r in roles}.get(_normalizar(out["rol"]))
+        if not rol:
+            return out, f"rol desconocido: {out['rol']}"
+        out["rol"] = rol
+    if "estado" in out:
+        estado = {"activo": "Activo", "inactivo": "Inactivo"}.get(_normalizar(out["estado"]))
+        if not estado:
+            return out, f"estado desconocido: {out['estado']}"
+        out["estado"] = estado
+    if out.get("fecha_ingreso"):
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+            try:
+                out["fecha_ingreso"] = datetime.strptime(out["fecha_ingreso"][:10], fmt).date().isoformat()
+                break
+            except ValueError:
+                continue
+        else:
+            return out, f"fecha de ingreso inválida: {out['fecha_ingreso']}"
+    return out, None
+
+_ROSTER_SQL = """SELECT u.email, u.nombre, u.rol, u.estado, u.unidad, u.email_lider,
+                   i.puesto, i.telefono, i.fecha_ingreso
+            FROM usuarios u LEFT JOIN identidad i ON i.email = u.email"""
+
+def diff_colaboradores(filas, desactivar_ausentes=False, db=None):
+    """Validar filas del roster y compararlas contra la BD.
+
+    Devuelve {"nuevos": [fila], "cambios": [{"email", "fila", "campos": {campo: (antes, después)}}],
+    "desactivar": [email], "sin_cambios": n, "errores": [(línea, email, detalle)]}.
+    Con desactivar_ausentes, los activos que no vienen en el archivo se
+    desactivan (salvo los Admin, para que un archivo parcial no deje el panel sin dueño).
+    """
+    from config import ROLES
+    def run(conn):
+        actuales = {r["email"]: dict(r) for r in conn.execute(_ROSTER_SQL)}
+        res = {"nuevos": [], "cambios": [], "desactivar": [], "sin_cambios": 0, "errores": []}
+        vistos = {}
+        for linea, fila in enumerate(filas, start=2):
+            fila, error = _limpiar_fila(fila, ROLES)
+            email = fila["email"]
+            if not error and email in vistos:
+                error = f"email repetido (línea {vistos[email]})"
+            previo = actuales.get(email)
+            if not error and previo is None and not fila.get("nombre"):
+                error = "falta el nombre"
+            if error:
+                res["errores"].append((linea, email, error))
+                continue
+            vistos[email] = linea
+            if previo is None:
+                res["nuevos"].append(fila)
+                continue
+            campos = {c: (previo[c], fila[c]) for c in _ROSTER_IDENTIDAD
+                      if c in fila and (previo[c] or "") != (fila[c] or "")}
+            if campos:
+                res["cambios"].append({"email": email, "fila": fila, "campos": campos})
+            else:
+                res["sin_cambios"] += 1
+        # Líderes: deben existir y no formar ciclos con el organigrama resultante
+        lider_de = {e: r["email_lider"] for e, r in actuales.items()}
+        for f in res["nuevos"] + [c["fila"] for c in res["cambios"]]:
+            if "email_lider" in f:
+                lider_de[f["email"]] = f["email_lider"]
+        for f in res["nuevos"] + [c["fila"] for c in res["cambios"]]:
+            jefe = f.get("email_lider")
+            if not jefe:
+                continue
+            if jefe not in actuales and jefe not in vistos:
+                res["errores"].append((vistos[f["email"]], f["email"], f"líder inexistente: {jefe}"))
+                continue
+            paso, visto = jefe, set()
+            while paso and paso not in visto:
+                if paso == f["email"]:
+                    res["errores"].append((vistos[f["email"]], f["email"], "la jerarquía formaría un ciclo"))
+                    break
+                visto.add(paso)
+                paso = lider_de.get(paso)
+        if desactivar_ausentes:
+            res["desactivar"] = sorted(e for e, r in actuales.items()
+                                       if e not in vistos and r["estado"] == "Activo" and r["rol"] != "Admin")
+        res["errores"].sort()
+        return res
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        return run(conn)
+
+def _aplicar_roster(conn, diff):
+    now = datetime.now().isoformat()
+    nuevos = diff["nuevos"]
+    conn.executemany("""INSERT INTO usuarios
+        (email,nombre,rol,estado,unidad,email_lider,fecha_registro,ultimo_acceso,password,must_change_password)
+        VALUES (?,?,?,?,?,?,?,?,?,1)""",
+        [(f["email"], f["nombre"], f.get("rol") or "Colaborador", f.get("estado") or "Activo",
+          f.get("unidad", ""), f.get("email_lider"), now, now, _hash_inicial()) for f in nuevos])
+    conn.executemany("""INSERT INTO identidad
+        (email,nombre,puesto,rol,unidad,estado,email_lider,telefono,fecha_ingreso,fecha_actualizacion)
+        VALUES (?,?,?,?,?,?,?,?,?,?)""",
+        [(f["email"], f["nombre"], f.get("puesto", ""), f.get("rol") or "Colaborador", f.get("unidad", ""),
+          f.get("estado") or "Activo", f.get("email_lider"), f.get("telefono", ""),
+          f.get("fecha_ingreso", ""), now) for f in nuevos])
+    # Un executemany por combinación de campos cambiados (suelen ser pocas)
+    grupos = {}
+    for c in diff["cambios"]:
+        grupos.setdefault(tuple(c["campos"]), []).append(c)
+    for campos, cambios in grupos.items():
+        en_usuarios = [k for k in campos if k in _ROSTER_USUARIOS]
+        if en_usuarios:
+            conn.executemany(f"UPDATE usuarios SET {', '.join(f'{k}=?' for k in en_usuarios)} WHERE email=?",
+                [(*(c["fila"][k] for k in en_usuarios), c["email"]) for c in cambios])
+        conn.executemany(f"""UPDATE identidad SET {', '.join(f'{k}=?' for k in campos)},
+            fecha_actualizacion=? WHERE email=?""",
+            [(*(c["fila"][k] for k in campos), now, c["email"]) for c in cambios])
+    conn.executemany("UPDATE usuarios SET estado='Inactivo' WHERE email=?", [(e,) for e in diff["desactivar"]])
+    conn.executemany("UPDATE identidad SET estado='Inactivo', fecha_actualizacion=? WHERE email=?",
+        [(now, e) for e in diff["desactivar"]])
+    activos = sum((f.get("estado") or "Activo") == "Activo" for f in nuevos) - len(diff["desactivar"])
+    for c in diff["cambios"]:
+        if "estado" in c["campos"]:
+            antes, despues = c["campos"]["estado"]
+            activos += (despues == "Activo") - (antes == "Activo")
+    _bump_total(conn, usuarios_activos=activos)
+    if nuevos or any("email_lider" in c["campos"] for c in diff["cambios"]):
+        rebuild_hierarchy(conn)
+        rebuild_team_feed(conn)
+    elif diff["desactivar"] or any("estado" in c["campos"] for c in diff["cambios"]):
+        rebuild_team_feed(conn)  # el feed solo lleva check-ins de activos
+    _emitir_varios(conn, "colaborador.alta",
+        [(f["email"], None, {k: f.get(k) for k in ("rol", "unidad", "email_lider")}) for f in nuevos])
+    _emitir_varios(conn, "colaborador.cambio",
+        [(c["email"], None, {k: despues for k, (_, despues) in c["campos"].items()}) for c in diff["cambios"]])
+    _emitir_varios(conn, "colaborador.baja", [(e, None, {}) for e in diff["desactivar"]])
+
+def import_colaboradores(filas, desactivar_ausentes=False, aplicar=False):
+    """Calcular el diff del roster y, con aplicar=True y sin errores, aplicarlo
+    en una sola transacción. Devuelve el diff con "aplicado": bool."""
+    with transaction(immediate=aplicar) as conn:
+        diff = diff_colaboradores(filas, desactivar_ausentes, conn)
+        diff["aplicado"] = bool(aplicar and not diff["errores"])
+        if diff["aplicado"]:
+            _aplicar_roster(conn, diff)
+    if diff["aplicado"]:
+        invalidate("usuarios")
+        _revalidar_sesiones()
+    return diff
+
+# ═══════════════════════════════════════════
+# EXPORTACIÓN (CSV / JSONL / PARQUET)
+# ═══════════════════════════════════════════
+# iter_export() recorre una vista con un cursor y fetchmany(): en memoria
+# solo hay un bloque de EXPORT_CHUNK filas a la vez, sin importar el tamaño
+# de la tabla. El orden es el de inserción (rowid), que no necesita ordenar
+# la tabla completa. write_export() escribe los bloques en un archivo binario.
+EXPORT_CHUNK = 2000
+EXPORT_FORMATOS = ("csv", "jsonl", "parquet")
+EXPORT_VISTAS = {
+    "checkins": {
+        "sql": """SELECT c.checkin_id, c.email, i.nombre, i.unidad, i.rol, c.estado_general,
+                         c.nivel_estres, c.area_preocupacion, c.etiquetas, c.comentario, c.fecha,
+                         c.semana, c.alerta_enviada
+                  FROM checkins c LEFT JOIN identidad i ON i.email = c.email""",
+        "alias": "c", "email": ("c.email",),
+    },
+    "faros": {
+        "sql": """SELECT f.faro_id, f.email_emisor, f.nombre_emisor, f.email_receptor, f.nombre_receptor,
+                         i.unidad AS unidad_receptor, f.tipo_faro, f.pilar, f.animal, f.mensaje,
+                         f.fecha_envio, f.estado, f.celebraciones, f.visible
+                  FROM faros f LEFT JOIN identidad i ON i.email = f.email_receptor""",
+        "alias": "f", "email": ("f.email_emisor", "f.email_receptor"),
+    },
+    "journal": {
+        "sql": """SELECT j.journal_id, j.email, i.nombre, i.unidad, j.fecha, j.emociones, j.intensidad,
+                         j.trigger_text, j.pensamiento, j.reflexion, j.estrategia, j.efectividad,
+                         j.contexto, j.dia_semana, j.hora_dia
+                  FROM journal j LEFT JOIN identidad i ON i.email = j.email""",
+        "alias": "j", "email": ("j.email",),
+    },
+}
+_EXPORT_ENTEROS = {"nivel_estres", "alerta_enviada", "celebraciones", "visible", "intensidad", "efectividad"}
+
+def iter_export(vista, unidad=None, desde=None, hasta=None, email=None, chunk_size=EXPORT_CHUNK):
+    """Generador: primero la lista de columnas y luego bloques de filas (tuplas).
+
+    Filtros opcionales: unidad (de la persona; en faros, del receptor),
+    rango de fechas desde/hasta (date, inclusivo) sobre la columna `dia` y
+    email (en faros, como emisor o receptor).
+    """
+    if vista not in EXPORT_VISTAS:
+        raise ValueError(f"Vista desconocida: {vista}")
+    v = EXPORT_VISTAS[vista]
+    where, params = [], []
+    if unidad:
+        where.append("i.unidad = ?"); params.append(unidad)
+    if desde:
+        where.append(f"{v['alias']}.dia >= ?"); params.append(dia_key(desde))
+    if hasta:
+        where.append(f"{v['alias']}.dia <= ?"); params.append(dia_key(hasta))
+    if email:
+        where.append("(" + " OR ".join(f"{col} = ?" for col in v["email"]) + ")")
+        params += [email] * len(v["email"])
+    sql = v["sql"] + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {v['alias']}.rowid"
+    with get_db() as db:
+        cur = db.cursor()
+        cur.execute(sql, params)
+        yield [d[0] for d in cur.description]
+        while True:
+            filas = cur.fetchmany(chunk_size)
+            if not filas:
+                break
+            yield [tuple(f) for f in filas]
+
+def write_export(out, vista, formato="csv", **filtros):
+    """Escribir la vista en `out` (archivo binario) como csv, jsonl o parquet.
+    Devuelve el número de filas. Parquet requiere pyarrow (opcional)."""
+    if formato not in EXPORT_FORMATOS:
+        raise ValueError(f"Formato desconocido: {formato}")
+    if formato == "parquet":
+        try:
+            import pyarrow as pa, pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Para exportar a Parquet instala pyarrow o usa CSV/JSONL.")
+    bloques = iter_export(vista, **filtros)
+    columnas = next(bloques)
+    total = 0
+    if formato == "parquet":
+        schema = pa.schema([(c, pa.int64() if c in _EXPORT_ENTEROS else pa.string()) for c in columnas])
+        with pq.ParquetWriter(out, schema) as writer:
+            for filas in bloques:
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array([str(x) if x is not None and t == pa.string() else x for x in col], type=t)
+                     for col, t in zip(zip(*filas), schema.types)], schema=schema))
+                total += len(filas)
+        return total
+    texto = io.TextIOWrapper(out, encoding="utf-8-sig" if formato == "csv" else "utf-8", newline="")
+    try:
+        if formato == "csv":
+            w = csv.writer(texto)
+            w.writerow(columnas)
+            for filas in bloques:
+                w.writerows(filas)
+                total += len(filas)
+        else:
+            for filas in bloques:
+                texto.writelines(json.dumps(dict(zip(columnas, f)), ensure_ascii=False) + "\n" for f in filas)
+                total += len(filas)
+        texto.flush()
+    finally:
+        texto.detach()  # no cerrar el archivo de quien llama
+    return total
+
+# ═══════════════════════════════════════════
+# BÚSQUEDA (FTS5)
+# ═══════════════════════════════════════════
+# Un índice FTS5 por fuente, de contenido externo: el texto sigue en su
+# tabla y el índice solo guarda tokens. Cada índice lee de una vista
+# <índice>_src y lo mantienen al día triggers de INSERT/UPDATE/DELETE sobre
+# la tabla. Sin mayúsculas ni acentos (remove_diacritics 2) y con índices de
+# prefijo para buscar mientras se escribe.
+#   busqueda_faros    → mensaje y nombres de emisor y receptor
+#   busqueda_journal  → trigger_text, pensamiento, reflexion y `autor`
+#                       (hex del email, un solo token): el filtro por dueño
+#                       va dentro del MATCH y solo recorre las entradas propias
+#   busqueda_personas → nombre, puesto y unidad de identidad
+# Ranking: bm25 de FTS5 sobre todas las coincidencias (ORDER BY rank LIMIT,
+# con los pesos por columna de _FTS_INDICES vía `rank MATCH 'bm25(…)'`), así
+# que un resultado viejo pero más relevante le gana a uno reciente. bm25 lee
+# el doclist completo de cada término para su IDF: con una palabra muy común
+# sobre 1M de filas son decenas de ms.
+BUSQUEDA_TIPOS = ("personas", "faros", "journal")
+_FTS_OPCIONES = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+_FTS_INDICES = {
+    # índice: (tabla, {columna: (columnas de la tabla, expresión)}, peso por columna)
+    "busqueda_faros": ("faros", {
+        "mensaje": ("mensaje",), "nombre_emisor": ("nombre_emisor",), "nombre_receptor": ("nombre_receptor",),
+    }, (1.0, 0.5, 0.5)),
+    "busqueda_journal": ("journal", {
+        "autor": ("email", "hex({r}.email)"), "trigger_text": ("trigger_text",),
+        "pensamiento": ("pensamiento",), "reflexion": ("reflexion",),
+    }, (0.0, 1.0, 1.0, 1.0)),
+    "busqueda_personas": ("identidad", {
+        "nombre": ("nombre",), "puesto": ("puesto",), "unidad": ("unidad",),
+    }, (2.0, 1.0, 0.5)),
+}
+_BUSQUEDA_CONSULTAS = {
+    "personas": ("busqueda_personas", """
+        SELECT i.email, i.nombre, i.puesto, i.unidad, i.rol, {marcas}
+        FROM busqueda_personas s JOIN identidad i ON i.rowid = s.rowid
+        WHERE busqueda_personas MATCH :q AND i.estado = 'Activo'"""),
+    "faros": ("busqueda_faros", """
+        SELECT f.faro_id, f.email_emisor, f.nombre_emisor, f.email_receptor, f.nombre_receptor,
+               f.tipo_faro, f.animal, f.fecha_envio, f.celebraciones, {marcas}
+        FROM busqueda_faros s JOIN faros f ON f.rowid = s.rowid
+        WHERE busqueda_faros MATCH :q AND (f.visible = 1 OR f.email_emisor = :email OR f.email_receptor = :email)"""),
+    "journal": ("busqueda_journal", """
+        SELECT j.journal_id, j.fecha, j.emociones, j.intensidad, j.contexto, {marcas}
+        FROM busqueda_journal s JOIN journal j ON j.rowid = s.rowid
+        WHERE busqueda_journal MATCH :q AND j.email = :email"""),
+}
+_MARCA_INI, _MARCA_FIN = "\x02", "\x03"
+
+def _fts_ddl(indice):
+    tabla, columnas, _ = _FTS_INDICES[indice]
+    expr = lambda r: [(c[1] if len(c) > 1 else "{r}." + c[0]).format(r=r) for c in columnas.values()]
+    cols = ", ".join(columnas)
+    origen = sorted({c for fuente in columnas.values() for c in fuente[:1]})
+    insertar = f"INSERT INTO {indice} (rowid, {cols}) VALUES (new.rowid, {', '.join(expr('new'))});"
+    borrar = (f"INSERT INTO {indice} ({indice}, rowid, {cols}) "
+              f"VALUES ('delete', old.rowid, {', '.join(expr('old'))});")
+    return f"""
+        CREATE VIEW IF NOT EXISTS {indice}_src AS
+            SELECT rowid AS rid, {', '.join(f'{e} AS {c}' for c, e in zip(columnas, expr(tabla)))} FROM {tabla};
+        CREATE VIRTUAL TABLE IF NOT EXISTS {indice} USING fts5({cols},
+            content='{indice}_src', content_rowid='rid', {_FTS_OPCIONES});
+        CREATE TRIGGER IF NOT EXISTS {indice}_ai AFTER INSERT ON {tabla} BEGIN
+            {insertar}
+        END;
+        CREATE TRIGGER IF NOT EXISTS {indice}_ad AFTER DELETE ON {tabla} BEGIN
+            {borrar}
+        END;
+        CREATE TRIGGER IF NOT EXISTS {indice}_au AFTER UPDATE OF {', '.join(origen)} ON {tabla} BEGIN
+            {borrar}
+            {insertar}
+        END;"""
+
+def _crear_busqueda(db):
+    for indice in _FTS_INDICES:
+        for stmt in _split_sql(_fts_ddl(indice)):
+            db.execute(stmt)
+    rebuild_search_index(db)
+
+def rebuild_search_index(db=None):
+    """Reconstruir los índices FTS5 desde sus tablas."""
+    def run(conn):
+        for indice in _FTS_INDICES:
+            conn.execute(f"INSERT INTO {indice} ({indice}) VALUES ('rebuild')")
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        run(conn)
+
+def verify_search_index():
+    """integrity-check de FTS5 contra el contenido: [(índice, error)] de los que no cuadran."""
+    problemas = []
+    with get_db() as db:
+        for indice in _FTS_INDICES:
+            try:
+                db.execute(f"INSERT INTO {indice} ({indice}, rank) VALUES ('integrity-check', 1)")
+            except sqlite3.DatabaseError as e:
+                problemas.append((indice, str(e)))
+    return problemas
+
+def _fts_query(texto, prefijo=False):
+    """Texto libre → consulta FTS5 con todas las palabras requeridas. Con
+    prefijo=True cada palabra es un prefijo ("carl" encuentra Carlos): solo
+    para personas, porque en faros y journal un prefijo largo obliga a unir
+    los doclists de todos los términos que empiezan igual."""
+    sufijo = "*" if prefijo else ""
+    return " ".join(f'"{p}"{sufijo}' for p in re.findall(r"\w+", texto or "") if len(p) > 1)
+
+def _fragmento(texto, ancho=160):
+    """Recortar alrededor del primer acierto y pasar los marcadores a **negrita**."""
+    ini = max(texto.find(_MARCA_INI) - ancho // 3, 0)
+    frag = texto[ini:ini + ancho]
+    if frag.count(_MARCA_INI) > frag.count(_MARCA_FIN):
+        frag += _MARCA_FIN
+    frag = frag.replace(_MARCA_INI, "**").replace(_MARCA_FIN, "**")
+    return ("…" if ini else "") + frag + ("…" if ini + ancho < len(texto) else "")
+
+def _con_fragmento(filas, columnas, pesos):
+    """Pasar rank a `relevancia` (mayor es mejor) y armar `fragmento` desde la
+    columna con más aciertos ponderados."""
+    salida = []
+    for fila in filas:
+        fila = dict(fila)
+        marcas = [fila.pop(f"_m{k}") or "" for k in range(len(columnas))]
+        fila["relevancia"] = round(-fila.pop("_rank"), 3)
+        mejor = max((k for k in range(len(columnas)) if pesos[k]),
+                    key=lambda k: pesos[k] * marcas[k].count(_MARCA_INI))
+        fila["fragmento"] = _fragmento(marcas[mejor].replace("\n", " "))
+        salida.append(fila)
+    return salida
+
+def buscar(email, texto, tipos=BUSQUEDA_TIPOS, limit=10):
+    """Búsqueda full-text con la visibilidad de la app: personas activas,
+    faros públicos (más los propios enviados o recibidos) y solo el journal
+    de `email`. Devuelve {tipo: [filas]} por relevancia; cada fila trae
+    `relevancia` y `fragmento` con los aciertos en **negrita**."""
+    resultados = {tipo: [] for tipo in tipos}
+    if not _fts_query(texto):
+        return resultados
+    with get_db() as db:
+        for tipo in tipos:
+            indice, sql = _BUSQUEDA_CONSULTAS[tipo]
+            _, columnas, pesos = _FTS_INDICES[indice]
+            marcas = ", ".join([f"highlight({indice}, {k}, char(2), char(3)) AS _m{k}" for k in range(len(columnas))]
+                               + ["s.rank AS _rank"])
+            q = _fts_query(texto, prefijo=tipo == "personas")
+            if tipo == "journal":
+                q = f'autor:"{email.encode().hex()}" AND ({q})'
+            filas = db.execute(sql.format(marcas=marcas) + " AND s.rank MATCH :rank ORDER BY s.rank LIMIT :n",
+                               {"q": q, "email": email, "n": limit,
+                                "rank": f"bm25({', '.join(map(str, pesos))})"}).fetchall()
+            resultados[tipo] = _con_fragmento(filas, columnas, pesos)
+    return resultados
+
+# ═══════════════════════════════════════════
+# PLANES DE CONSULTA (verificación de índices)
+# ═══════════════════════════════════════════
+# tools/check_indexes.py (y tests/test_indices.py) corren cada función
+# pública bajo trace_sql(), así que lo que se explica es el SQL que de verdad
+# se ejecuta, no una copia. Un "SCAN <tabla>" —con o sin índice cubriente—
+# cuenta como full scan salvo que el par (sentencia, paso del plan) esté en
+# ESCANEO_PERMITIDO: la sentencia completa (se compara con los literales
+# como ?) y el paso exacto que recorre la tabla a propósito. Otra sentencia
+# en la misma función, o la misma con otro plan, vuelve a fallar.
+ESCANEO_PERMITIDO = {
+    ("""SELECT u.*, i.puesto, i.telefono, i.fecha_ingreso FROM usuarios u
+        LEFT JOIN identidad i ON u.email = i.email ORDER BY u.estado DESC, u.unidad, u.nombre""",
+     "SCAN u USING INDEX idx_usuarios_estado_rol"): "el panel admin lista a todos los usuarios",
+    (_ROSTER_SQL, "SCAN u"): "el import compara el roster completo contra usuarios",
+    (_JERARQUIA_INSERT_SQL, "SCAN usuarios USING COVERING INDEX sqlite_autoindex_usuarios_1"):
+        "rebuild_hierarchy: raíces del árbol",
+    (_JERARQUIA_INSERT_SQL, "SCAN usuarios"): "rebuild_hierarchy: líderes",
+    (_JERARQUIA_INSERT_SQL, "SCAN a"): "rebuild_hierarchy: paso recursivo del CTE",
+    (_JERARQUIA_INSERT_SQL, "SCAN arbol"): "rebuild_hierarchy: resultado del CTE",
+    ("SELECT email FROM usuarios", "SCAN usuarios USING COVERING INDEX sqlite_autoindex_usuarios_1"):
+        "reset_all_passwords actualiza a todos",
+    ("SELECT tipo_faro, COUNT(*) as total FROM faros GROUP BY tipo_faro",
+     "SCAN faros USING COVERING INDEX idx_faros_tipo"): "agregado global por tipo",
+    ("""SELECT rol, COUNT(*) as total, SUM(CASE WHEN estado='Activo' THEN 1 ELSE 0 END) as activos
+        FROM usuarios GROUP BY rol ORDER BY rol""",
+     "SCAN usuarios USING COVERING INDEX idx_usuarios_rol"): "agregado global por rol",
+    ("""SELECT c.*, i.nombre FROM checkins c JOIN identidad i ON c.email = i.email
+        WHERE 1=1 ORDER BY c.checkin_id DESC LIMIT ?""",
+     "SCAN c USING INDEX sqlite_autoindex_checkins_1"): "primera página: recorre la PK en orden y corta en LIMIT",
+    ("SELECT * FROM outbox_offsets", "SCAN outbox_offsets"): "una fila por consumidor",
+    ("SELECT consumidor, ultimo_evento FROM outbox_offsets", "SCAN outbox_offsets"): "una fila por consumidor",
+    ("SELECT nombre, proxima FROM tareas", "SCAN tareas"): "una fila por tarea",
+    ("""SELECT nombre AS tarea, proxima, ultima, duracion_ms, filas, ejecuciones, errores, ultimo_error
+        FROM tareas""", "SCAN tareas"): "una fila por tarea",
+}
+
+def explain_sql(sql, db=None):
+    """EXPLAIN QUERY PLAN de una sentencia: ([detalle...], full_scans), donde
+    full_scans son los pasos "SCAN <tabla>" (usen o no un índice). Los
+    recorridos de subconsultas, filas constantes y tablas virtuales FTS no cuentan."""
+    def run(conn):
+        plan = [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+        scans = [p for p in plan if p.startswith("SCAN ") and not p.startswith(("SCAN CONSTANT ROW", "SCAN ("))
+                 and "VIRTUAL TABLE" not in p]
+        return plan, scans
+    if db is not None:
+        return run(db)
+    with get_db() as conn:
+        return run(conn)
+
+# ═══════════════════════════════════════════
+# BOOTSTRAP (una vez por proceso)
+# ═══════════════════════════════════════════
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+def _stored_schema_version():
+    with get_db() as db:
+        try:
+            return db.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+        except sqlite3.OperationalError:  # BD nueva: aún no existe schema_version
+            return 0
+
+def bootstrap():
+    """Dejar la BD lista para usarse, con un camino rápido para reruns.
+
+    La primera llamada del proceso lee la versión guardada en schema_version;
+    si ya es SCHEMA_VERSION no se ejecuta ningún DDL ni el chequeo de seed.
+    Si falta, corre init_db() (tablas + migraciones + seed). Las llamadas
+    siguientes para la misma BD solo consultan un set en memoria.
+    """
+    path = DB_PATH
+    if path in _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if path in _bootstrapped:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if _stored_schema_version() < SCHEMA_VERSION:
+            init_db()
+        _bootstrapped.add(path)
+
 # Inicializar al importar
-init_db()
+bootstrap()
@@ -3,8 +3,13 @@ import streamlit as st
 import database as db
 from config import TURQ, GREEN, RED, YELLOW, GOLD, GRAY, ROLES
 from components.cards import metric_card
+from components import paging
 import plotly.graph_objects as go
 
+# st.download_button sirve el archivo desde memoria: por encima de esto se
+# pide usar tools.export, que escribe a disco sin pasar por la app
+DESCARGA_MAX_MB = 50
+
 
 def render():
     if st.session_state.get("user_rol") != "Admin":
@@ -41,13 +46,14 @@ def render():
         if analytics["alertas"] > 0:
             st.error(f"🚨 **{analytics['alertas']} alertas de bienestar** "
                      f"esta semana (estrés ≥ 4).")
+        alertas = db.get_alertas(st.session_state.current_user, 5)
+        if alertas:
+            with st.expander(f"🚨 Últimas alertas recibidas ({len(alertas)})"):
+                for a in alertas:
+                    st.markdown(f"**{a['fecha'][:16]}** · {a['mensaje']}")
 
         st.markdown("### 💙 Check-ins Recientes")
-        with db.get_db() as conn:
-            all_ci = db.dict_rows(conn.execute("""
-                SELECT c.*, i.nombre FROM checkins c
-                JOIN identidad i ON c.email = i.email
-                ORDER BY c.fecha DESC LIMIT 20""").fetchall())
+        all_ci = paging.paged_rows("admin_checkins", db.page_checkins_recientes, 20)
         if all_ci:
             import pandas as pd
             df = pd.DataFrame(all_ci)
@@ -58,12 +64,10 @@ def render():
                     "nombre": "Nombre", "estado_general": "Estado",
                     "nivel_estres": "Estrés", "area_preocupacion": "Área",
                     "fecha": "Fecha"}), use_container_width=True)
+            paging.load_more_button("admin_checkins", db.page_checkins_recientes, 20)
 
         st.markdown("### 🔦 Distribución de Faros")
-        with db.get_db() as conn:
-            faros_by_type = db.dict_rows(conn.execute(
-                "SELECT tipo_faro, COUNT(*) as total FROM faros "
-                "GROUP BY tipo_faro").fetchall())
+        faros_by_type = db.get_faros_por_tipo()
         if faros_by_type:
             fig = go.Figure(data=[go.Pie(
                 labels=[f["tipo_faro"] for f in faros_by_type],
@@ -72,18 +76,20 @@ def render():
             fig.update_layout(height=300, margin=dict(l=20, r=20, t=20, b=20))
             st.plotly_chart(fig, use_container_width=True)
 
-        st.markdown("### 😰 Estrés Promedio por Unidad")
-        with db.get_db() as conn:
-            by_unit = db.dict_rows(conn.execute("""
-                SELECT i.unidad, AVG(c.nivel_estres) as avg_estres,
-                       COUNT(DISTINCT c.email) as personas
-                FROM checkins c JOIN identidad i ON c.email = i.email
-                WHERE c.fecha > datetime('now', '-30 days')
-                GROUP BY i.unidad""").fetchall())
+        st.markdown("### 😰 Bienestar por Unidad")
+        f1, f2 = st.columns(2)
+        semanas = f1.selectbox("Ventana", [4, 8, 12, 26, 52], index=1,
+                               format_func=lambda n: f"Últimas {n} semanas", key="cubo_semanas")
+        rol_sel = f2.selectbox("Rol", ["Todos"] + ROLES, key="cubo_rol")
+        rol = None if rol_sel == "Todos" else rol_sel
+        by_unit = db.get_bienestar("unidad", semanas, rol=rol)
         if by_unit:
             fig = go.Figure(data=[go.Bar(
-                x=[u["unidad"] for u in by_unit],
+                x=[u["unidad"] or "(sin unidad)" for u in by_unit],
                 y=[round(u["avg_estres"], 1) for u in by_unit],
+                error_y=dict(type="data", array=[u["desv_estres"] for u in by_unit], visible=True),
+                customdata=[u["checkins"] for u in by_unit],
+                hovertemplate="%{x}<br>Estrés %{y} · %{customdata} check-ins<extra></extra>",
                 marker_color=[GREEN if u["avg_estres"] < 3
                               else YELLOW if u["avg_estres"] < 4
                               else RED for u in by_unit])])
@@ -91,6 +97,35 @@ def render():
                               yaxis_title="Estrés Promedio")
             st.plotly_chart(fig, use_container_width=True)
 
+            # Drill-down: unidad → tendencia semanal → líderes
+            unidad = st.selectbox("🔎 Ver detalle de la unidad", [u["unidad"] for u in by_unit],
+                                  format_func=lambda u: u or "(sin unidad)", key="cubo_unidad")
+            trend = db.get_bienestar("semana", semanas, unidad=unidad, rol=rol)
+            if trend:
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(x=[t["semana"] for t in trend], y=[t["avg_estres"] for t in trend],
+                    name="Estrés promedio", mode="lines+markers", line=dict(color=TURQ, width=2)))
+                fig.add_trace(go.Bar(x=[t["semana"] for t in trend], y=[t["checkins"] for t in trend],
+                    name="Check-ins", yaxis="y2", marker_color=GRAY, opacity=0.3))
+                fig.update_layout(height=300, yaxis=dict(range=[0, 5.5], title="Estrés"),
+                                  yaxis2=dict(overlaying="y", side="right", title="Check-ins"),
+                                  legend=dict(orientation="h"))
+                st.plotly_chart(fig, use_container_width=True)
+
+                semana = st.selectbox("📅 Semana", [t["semana"] for t in reversed(trend)], key="cubo_semana")
+                lideres = db.get_bienestar("lider", unidad=unidad, rol=rol, semana=semana)
+                if lideres:
+                    import pandas as pd
+                    df = pd.DataFrame(lideres)
+                    df["nombre"] = df["nombre"].fillna(df["lider"]).replace("", "(sin líder)")
+                    st.dataframe(df[["nombre", "checkins", "avg_estres", "desv_estres", "alertas",
+                                     "genial", "normal", "dificil"]].rename(columns={
+                        "nombre": "Líder", "checkins": "Check-ins", "avg_estres": "Estrés",
+                        "desv_estres": "Desv.", "alertas": "Alertas", "genial": "😊",
+                        "normal": "😐", "dificil": "😔"}), use_container_width=True, hide_index=True)
+        else:
+            st.info("Sin check-ins en la ventana seleccionada.")
+
     # ══════════════════════════════════════
     # TAB 2: GESTIONAR COLABORADORES
     # ══════════════════════════════════════
@@ -173,14 +208,14 @@ def render():
                 with bc3:
                     if st.button("🔑 Resetear clave", key=f"reset_{u['email']}"):
                         db.reset_password(u["email"])
-                        st.info("Contraseña reseteada a Itaca2026!")
+                        st.info(f"Contraseña reseteada a {db.PASSWORD_INICIAL}")
 
     # ══════════════════════════════════════
     # TAB 3: AGREGAR NUEVO COLABORADOR
     # ══════════════════════════════════════
     with tab3:
         st.markdown("### ➕ Agregar Nuevo Colaborador")
-        st.caption("El nuevo colaborador recibirá la contraseña temporal `Itaca2026!` "
+        st.caption(f"El nuevo colaborador recibirá la contraseña temporal `{db.PASSWORD_INICIAL}` "
                    "y deberá cambiarla en su primer login.")
 
         with st.form("add_user_form"):
@@ -200,7 +235,7 @@ def render():
                 if new_unidad == "(Otra)":
                     new_unidad = st.text_input("Nueva unidad:")
 
-                leaders = [u for u in db.get_all_users()
+                leaders = [u for u in st.session_state.ctx["usuarios"]
                            if u["rol"] in ("Líder", "Admin", "Coordinador")]
                 leader_opts = ["(Sin líder)"] + [f"{l['nombre']} ({l['email']})"
                                                  for l in leaders]
@@ -241,13 +276,7 @@ def render():
         st.markdown("### 🔧 Herramientas de Administración")
 
         st.markdown("#### 📊 Resumen por Unidad")
-        with db.get_db() as conn:
-            by_unit_summary = db.dict_rows(conn.execute("""
-                SELECT unidad, COUNT(*) as total,
-                       SUM(CASE WHEN estado='Activo' THEN 1 ELSE 0 END) as activos,
-                       SUM(CASE WHEN rol='Líder' THEN 1 ELSE 0 END) as lideres
-                FROM usuarios WHERE unidad IS NOT NULL AND unidad != ''
-                GROUP BY unidad ORDER BY unidad""").fetchall())
+        by_unit_summary = db.get_resumen_por_unidad()
         if by_unit_summary:
             import pandas as pd
             df = pd.DataFrame(by_unit_summary)
@@ -258,11 +287,7 @@ def render():
         st.divider()
 
         st.markdown("#### 📋 Resumen por Rol")
-        with db.get_db() as conn:
-            by_rol = db.dict_rows(conn.execute("""
-                SELECT rol, COUNT(*) as total,
-                       SUM(CASE WHEN estado='Activo' THEN 1 ELSE 0 END) as activos
-                FROM usuarios GROUP BY rol ORDER BY rol""").fetchall())
+        by_rol = db.get_resumen_por_rol()
         if by_rol:
             import pandas as pd
             df = pd.DataFrame(by_rol)
@@ -272,9 +297,157 @@ def render():
 
         st.divider()
 
+        st.markdown("#### 📥 Importar BD Maestra")
+        st.caption("CSV (coma o punto y coma) o XLSX con columnas Email, Nombre, Rol, Estado, Unidad, "
+                   "Email_lider, Cargo, Celular, Ingreso. Las columnas que no vengan no se modifican.")
+        archivo = st.file_uploader("Archivo de colaboradores", type=["csv", "xlsx"], key="roster_file")
+        ausentes = st.checkbox("Desactivar a los activos que no estén en el archivo (excepto Admin)",
+                               key="roster_ausentes")
+        if archivo:
+            diff = None
+            try:
+                archivo.seek(0)
+                diff = db.import_colaboradores(db.read_roster(archivo, archivo.name), ausentes)
+            except ValueError as e:
+                st.error(str(e))
+            if diff:
+                import pandas as pd
+                c1, c2, c3, c4 = st.columns(4)
+                with c1:
+                    metric_card("➕ Nuevos", len(diff["nuevos"]), color=GREEN)
+                with c2:
+                    metric_card("✏️ Con cambios", len(diff["cambios"]), f"{diff['sin_cambios']} sin cambios", TURQ)
+                with c3:
+                    metric_card("❌ A desactivar", len(diff["desactivar"]), color=YELLOW)
+                with c4:
+                    metric_card("⚠️ Errores", len(diff["errores"]), color=RED)
+                if diff["errores"]:
+                    st.error("Corrige estas filas antes de aplicar la importación.")
+                    st.dataframe(pd.DataFrame(diff["errores"], columns=["Línea", "Email", "Detalle"]),
+                                 use_container_width=True, hide_index=True)
+                if diff["nuevos"]:
+                    with st.expander(f"➕ Nuevos ({len(diff['nuevos'])})"):
+                        st.dataframe(pd.DataFrame(diff["nuevos"]), use_container_width=True, hide_index=True)
+                if diff["cambios"]:
+                    with st.expander(f"✏️ Cambios ({len(diff['cambios'])})"):
+                        st.dataframe(pd.DataFrame([
+                            {"Email": c["email"], "Campo": k, "Antes": a, "Después": d}
+                            for c in diff["cambios"] for k, (a, d) in c["campos"].items()]),
+                            use_container_width=True, hide_index=True)
+                if diff["desactivar"]:
+                    with st.expander(f"❌ A desactivar ({len(diff['desactivar'])})"):
+                        st.write(", ".join(diff["desactivar"]))
+                pendiente = diff["nuevos"] or diff["cambios"] or diff["desactivar"]
+                if st.button("✅ Aplicar importación", type="primary",
+                             disabled=bool(diff["errores"]) or not pendiente):
+                    archivo.seek(0)
+                    res = db.import_colaboradores(db.read_roster(archivo, archivo.name), ausentes, aplicar=True)
+                    if res["aplicado"]:
+                        st.success(f"Importación aplicada: {len(res['nuevos'])} nuevos, "
+                                   f"{len(res['cambios'])} actualizados, {len(res['desactivar'])} desactivados.")
+                    else:
+                        st.error("La importación no se aplicó: el archivo tiene errores.")
+
+        st.divider()
+
+        st.markdown("#### 📤 Exportar datos")
+        st.caption(f"Descargas de hasta {DESCARGA_MAX_MB} MB. Para dumps programados o archivos "
+                   "más grandes usa `python -m tools.export`.")
+        e1, e2, e3 = st.columns(3)
+        vista = e1.selectbox("Datos", list(db.EXPORT_VISTAS), key="exp_vista")
+        formato = e2.selectbox("Formato", db.EXPORT_FORMATOS, key="exp_formato")
+        exp_unidad = e3.selectbox("Unidad", ["Todas"] + db.get_units(), key="exp_unidad")
+        e1, e2, e3 = st.columns(3)
+        exp_desde = e1.date_input("Desde", value=None, key="exp_desde")
+        exp_hasta = e2.date_input("Hasta", value=None, key="exp_hasta")
+        exp_email = e3.text_input("Email (opcional)", key="exp_email").strip().lower()
+        if st.button("📦 Preparar archivo", key="exp_preparar"):
+            import tempfile
+            st.session_state.pop("export_file", None)
+            # Se escribe por bloques a un temporal anónimo: se borra al cerrarse, pase lo que pase
+            with tempfile.TemporaryFile() as tmp:
+                try:
+                    n = db.write_export(tmp, vista, formato,
+                                        unidad=None if exp_unidad == "Todas" else exp_unidad,
+                                        desde=exp_desde, hasta=exp_hasta, email=exp_email or None)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    mb = tmp.tell() / 2**20
+                    if mb > DESCARGA_MAX_MB:
+                        st.error(f"El archivo pesa {mb:.0f} MB (máximo {DESCARGA_MAX_MB} MB para descargar "
+                                 "desde aquí). Acota el filtro o usa `python -m tools.export`.")
+                    else:
+                        tmp.seek(0)
+                        st.session_state.export_file = (tmp.read(), f"itaca_{vista}.{formato}", n)
+        if st.session_state.get("export_file"):
+            datos, nombre, n = st.session_state.export_file
+            st.download_button(f"⬇️ Descargar {nombre} ({n} filas)", datos, file_name=nombre,
+                               mime={"csv": "text/csv", "jsonl": "application/jsonl"}.get(
+                                   nombre.rsplit(".", 1)[-1], "application/octet-stream"))
+
+        st.divider()
+
         st.markdown("#### 🔑 Resetear contraseña masivo")
-        st.caption("Resetea la clave de TODOS los usuarios a `Itaca2026!`")
+        st.caption(f"Resetea la clave de TODOS los usuarios a `{db.PASSWORD_INICIAL}`")
         if st.button("🔑 Resetear TODAS las contraseñas", type="secondary"):
-            with db.get_db() as conn:
-                conn.execute("UPDATE usuarios SET password='Itaca2026!'")
+            db.reset_all_passwords()
             st.warning("Todas las contraseñas han sido reseteadas.")
+
+        st.divider()
+
+        st.markdown("#### ⚡ Caché de consultas")
+        stats = db.cache_stats()
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            metric_card("🎯 Hit rate", f"{stats['hit_rate']}%", color=GREEN)
+        with c2:
+            metric_card("✅ Hits", stats["hits"], color=TURQ)
+        with c3:
+            metric_card("❌ Misses", stats["misses"], color=YELLOW)
+        with c4:
+            metric_card("📦 Entradas", f"{stats['entries']}/{stats['max_entries']}",
+                        f"TTL {stats['ttl']:.0f}s · {stats['evictions']} expulsadas", GOLD)
+        if stats["por_funcion"]:
+            import pandas as pd
+            df = pd.DataFrame([{"Función": k, "Hits": v["hits"], "Misses": v["misses"]}
+                               for k, v in stats["por_funcion"].items()])
+            st.dataframe(df, use_container_width=True)
+        if st.button("🧹 Vaciar caché"):
+            db.cache_clear()
+            st.rerun()
+
+        st.divider()
+
+        st.markdown("#### 📨 Eventos (outbox)")
+        st.caption("Consumidores registrados, su offset y cuántos eventos les faltan por procesar.")
+        estado = db.outbox_status()
+        if estado:
+            import pandas as pd
+            st.dataframe(pd.DataFrame(estado), use_container_width=True)
+        if st.button("📨 Despachar ahora"):
+            entregados = db.dispatch()
+            st.success(f"Eventos entregados: {sum(entregados.values())}")
+
+        st.divider()
+
+        st.markdown("#### ⏰ Tareas programadas")
+        st.caption("Recordatorios y mantenimiento: próxima corrida, duración y filas de la última.")
+        tareas = db.scheduler_status()
+        if tareas:
+            import pandas as pd
+            st.dataframe(pd.DataFrame(tareas).drop(columns=["dueno", "lock_expira"]), use_container_width=True)
+            st.caption(f"Planificador activo: {tareas[0]['dueno'] or '—'}")
+            c1, c2 = st.columns([3, 1])
+            with c1:
+                nombre = st.selectbox("Tarea", [t["tarea"] for t in tareas], label_visibility="collapsed")
+            with c2:
+                if st.button("▶️ Ejecutar ahora"):
+                    r = db.run_job(nombre)
+                    if r["error"]:
+                        st.error(f"{nombre}: {r['error']}")
+                    else:
+                        st.success(f"{nombre}: {r['filas']} filas en {r['duracion_ms']} ms")
+            corridas = db.get_job_runs(nombre, 10)
+            if corridas:
+                st.dataframe(pd.DataFrame(corridas), use_container_width=True)
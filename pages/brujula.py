@@ -1,10 +1,10 @@
 """Módulo 5: Brújula Emocional - IE + Journal + Ejercicios"""
 import streamlit as st
 import json, os
-from datetime import datetime
 import database as db
 from config import *
 from components.cards import radar_chart, progress_bar_custom, metric_card, info_card
+from components import paging
 
 def load_ejercicios():
     # Robust path: go from pages/ up to root, then into data/
@@ -44,7 +44,7 @@ def render():
             info_card("Sin evaluación IE", "Completa tu primera autoevaluación en la pestaña 'Evaluar IE'.", "🧠")
 
         # Sugerencia personalizada
-        checkins = db.get_my_checkins(email, 4)
+        checkins = st.session_state.ctx["checkins"]
         if checkins:
             avg_estres = sum(c["nivel_estres"] for c in checkins) / len(checkins)
             if avg_estres >= 3.5:
@@ -74,12 +74,15 @@ def render():
                     ok, msg = db.save_journal(email, emociones, intensidad, trigger,
                         pensamiento, reflexion, estrategia if estrategia else None,
                         efectividad if estrategia else None, contexto)
-                    if ok: st.success(f"✅ {msg}")
+                    if ok:
+                        st.success(f"✅ {msg}")
+                        paging.reset("journal")
                     st.rerun()
 
         st.divider()
         st.markdown("#### 📖 Mis Entradas Recientes")
-        entries = db.get_my_journal(email, 10)
+        fetch_journal = lambda limit, cursor: db.page_my_journal(email, limit, cursor)
+        entries = paging.paged_rows("journal", fetch_journal, 10)
         for e in entries:
             fecha = e["fecha"][:10] if e.get("fecha") else ""
             emociones = e.get("emociones", "")
@@ -93,6 +96,7 @@ def render():
                 <div style="color:{GRAY};font-size:0.85rem;">Intensidad: {e.get('intensidad','')}/10 · {e.get('contexto','')}</div>
                 {f'<div style="margin-top:6px;font-style:italic;color:{BLACK};">"{e["reflexion"]}"</div>' if e.get("reflexion") else ''}
             </div>""", unsafe_allow_html=True)
+        paging.load_more_button("journal", fetch_journal, 10)
 
     # ── TAB 3: EJERCICIOS ──
     with tab3:
@@ -111,11 +115,7 @@ def render():
                 st.markdown(f"⏰ **Mejor momento:** {ej['momento']}")
                 
                 if st.button(f"✅ Completar ejercicio", key=f"ej_{ej['id']}"):
-                    with db.get_db() as conn:
-                        lid = f"LOG_{email.split('@')[0]}_{int(datetime.now().timestamp())}"
-                        conn.execute("INSERT INTO ejercicios_log VALUES (?,?,?,?,?,?,?,?,?,?)",
-                            (lid, email, ej["id"], datetime.now().isoformat(), ej["duracion"],
-                             0, "", "", "", ej["competencia"]))
+                    db.save_ejercicio(email, ej["id"], ej["duracion"], ej["competencia"])
                     st.success(f"✅ ¡Ejercicio '{ej['nombre']}' completado!")
                     st.rerun()
 
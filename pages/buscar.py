@@ -0,0 +1,48 @@
+"""Búsqueda de personas, faros y journal"""
+import streamlit as st
+import database as db
+from config import TURQ, GRAY, BLACK, TIPOS_FARO
+
+def render():
+    email = st.session_state.current_user
+    st.markdown("## 🔎 Buscar")
+    # El cuadro de búsqueda vive en el sidebar (misma clave de sesión)
+    texto = st.session_state.get("busqueda_q", "")
+    if not texto.strip():
+        st.info("Escribe en 🔎 Buscar del menú lateral: nombre, puesto, unidad o palabras de un faro o de tu journal.")
+        return
+    res = db.buscar(email, texto, limit=15)
+    st.caption(f"Resultados para «{texto}». Solo ves tus propias entradas de journal y los faros públicos.")
+    tab1, tab2, tab3 = st.tabs([f"👥 Personas ({len(res['personas'])})", f"🔦 Faros ({len(res['faros'])})",
+                                f"📝 Mi Journal ({len(res['journal'])})"])
+
+    with tab1:
+        for p in res["personas"]:
+            st.markdown(f"""
+            <div style="background:white;border-radius:12px;padding:12px 14px;border-left:4px solid {TURQ};
+            box-shadow:0 1px 4px rgba(0,0,0,0.05);margin-bottom:8px;">
+                <span style="font-weight:600;color:{BLACK};">{p['nombre']}</span>
+                <span style="color:{GRAY};font-size:0.85rem;"> · {p.get('puesto') or ''} · {p.get('unidad') or ''} · {p.get('rol') or ''}</span>
+                <div style="color:{GRAY};font-size:0.8rem;">{p['email']}</div>
+            </div>""", unsafe_allow_html=True)
+        if not res["personas"]:
+            st.info("Sin personas que coincidan.")
+
+    with tab2:
+        for f in res["faros"]:
+            info = TIPOS_FARO.get(f["tipo_faro"], {})
+            fecha = f["fecha_envio"][:10] if f.get("fecha_envio") else ""
+            st.markdown(f"**{info.get('emoji', '🔦')} {f['nombre_emisor']} → {f['nombre_receptor']}** · "
+                        f"{f['tipo_faro']} · {fecha}")
+            st.markdown(f"> {f['fragmento']}")
+        if not res["faros"]:
+            st.info("Sin faros que coincidan.")
+
+    with tab3:
+        for j in res["journal"]:
+            fecha = j["fecha"][:10] if j.get("fecha") else ""
+            st.markdown(f"**{j.get('emociones', '')}** · {fecha} · Intensidad {j.get('intensidad', '')}/10 · "
+                        f"{j.get('contexto', '')}")
+            st.markdown(f"> {j['fragmento']}")
+        if not res["journal"]:
+            st.info("Sin entradas de tu journal que coincidan.")
@@ -4,6 +4,7 @@ from datetime import datetime
 import database as db
 from config import *
 from components.cards import faro_card, checkin_card, info_card, metric_card
+from components import paging
 
 def render():
     email = st.session_state.current_user
@@ -18,7 +19,7 @@ def render():
 
     # ── TAB 1: CHECK-IN ──
     with tab1:
-        done = db.checkin_done_this_week(email)
+        done = st.session_state.ctx["checkin_semana"]
         if not done:
             st.markdown("### 💙 ¿Cómo te sientes esta semana?")
             with st.form("checkin_form"):
@@ -62,7 +63,7 @@ def render():
     # ── TAB 2: FAROS ──
     with tab2:
         st.markdown("### 🔦 Enviar un Faro de Reconocimiento")
-        users = db.get_all_users()
+        users = st.session_state.ctx["usuarios"]
         otros = [u for u in users if u["email"] != email]
         
         with st.form("faro_form"):
@@ -90,6 +91,7 @@ def render():
                     if ok:
                         st.success(f"✅ {msg}")
                         st.balloons()
+                        paging.reset("muro")
                     st.rerun()
 
         st.divider()
@@ -128,7 +130,7 @@ def render():
     # ── TAB 4: MURO PÚBLICO ──
     with tab4:
         st.markdown("### 🌍 Muro Público de Faros")
-        faros = db.get_faros_publicos(20)
+        faros = paging.paged_rows("muro", db.page_faros_publicos, 20)
         if faros:
             c1, c2, c3 = st.columns(3)
             total_valor = sum(1 for f in faros if f["tipo_faro"]=="Faro de Valor")
@@ -138,10 +140,15 @@ def render():
             with c2: metric_card("🦫 Guía", total_guia, color=GOLD)
             with c3: metric_card("🪿 Aliento", total_aliento, color=GREEN)
             
+            email = st.session_state.current_user
+            cel = db.get_celebraciones([f["faro_id"] for f in faros], email)
             for f in faros:
-                faro_card(f)
-                if st.button(f"👏 Celebrar", key=f"cel_{f['faro_id']}"):
-                    db.celebrar_faro(f["faro_id"])
+                c = cel.get(f["faro_id"], {"total": f.get("celebraciones") or 0, "mia": False})
+                faro_card({**f, "celebraciones": c["total"]})
+                if st.button("👏 Celebrado" if c["mia"] else "👏 Celebrar", key=f"cel_{f['faro_id']}",
+                             disabled=c["mia"]):
+                    db.celebrar_faro(f["faro_id"], email)
                     st.rerun()
+            paging.load_more_button("muro", db.page_faros_publicos, 20)
         else:
             st.info("Aún no hay faros públicos.")
@@ -63,7 +63,8 @@ def render():
 
     with tab3:
         st.markdown("### ⛵ Mi Tripulación")
-        team = db.get_team_members(email)
+        alcance = st.radio("Mostrar", ["Reportes directos", "Todo mi árbol"], horizontal=True)
+        team = db.get_direct_reports(email) if alcance == "Reportes directos" else db.get_subtree(email)
         if team:
             for m in team:
                 disc = m.get("arquetipo_disc", "")
@@ -74,12 +75,12 @@ def render():
                 <div style="background:white;border-radius:12px;padding:14px;border-left:4px solid {TURQ};
                 box-shadow:0 1px 4px rgba(0,0,0,0.05);margin-bottom:8px;">
                     <div style="font-weight:600;">{emoji} {m['nombre']}</div>
-                    <div style="color:{GRAY};font-size:0.85rem;">{m.get('puesto','')}</div>
+                    <div style="color:{GRAY};font-size:0.85rem;">{m.get('puesto','')}{f" · nivel {m['profundidad']}" if m.get('profundidad', 1) > 1 else ''}</div>
                 </div>""", unsafe_allow_html=True)
             
             st.markdown("#### 📊 Check-ins del Equipo")
-            team_ci = db.get_team_checkins(email)
-            for ci in team_ci[:10]:
+            team_ci = db.get_team_checkins(email, limit=10)
+            for ci in team_ci:
                 checkin_card(ci)
         else:
             st.info("No tienes miembros de equipo asignados.")
@@ -10,6 +10,7 @@ def render():
     email = st.session_state.current_user
     nombre = user.get("nombre", "Marinero") if user else "Marinero"
     rol = st.session_state.get("user_rol", "Colaborador")
+    ctx = st.session_state.ctx
 
     # Saludo
     hora = datetime.now().hour
@@ -31,7 +32,7 @@ def render():
 
     # CTAs
     col1, col2 = st.columns(2)
-    done = db.checkin_done_this_week(email)
+    done = ctx["checkin_semana"]
     with col1:
         if done:
             st.success("✅ Check-in hecho esta semana")
@@ -60,9 +61,9 @@ def render():
 
     # Métricas rápidas
     col1, col2, col3 = st.columns(3)
-    puntos = db.get_total_puntos(email)
-    logros = db.get_my_logros(email)
-    checkins = db.get_my_checkins(email, 4)
+    puntos = ctx["puntos"]
+    logros = ctx["logros"]
+    checkins = ctx["checkins"]
     with col1:
         metric_card("⭐ Puntos", puntos)
     with col2:
@@ -74,24 +75,28 @@ def render():
     # Widgets de líder
     if rol in ["Admin", "Líder", "Coordinador"]:
         st.markdown("#### ⛵ Tu Tripulación")
-        team_checkins = db.get_team_checkins(email)
-        if team_checkins:
-            avg = sum(c["nivel_estres"] for c in team_checkins[:10]) / min(len(team_checkins), 10)
-            pulso = round(10 - avg * 2, 1)
-            estado = "🟢 Alta moral" if pulso >= 7 else "🟡 Moderada" if pulso >= 5 else "🔴 Necesita atención"
+        pulse = db.get_team_pulse(email)
+        if pulse["miembros"]:
             col1, col2 = st.columns(2)
             with col1:
-                metric_card("Pulso del Equipo", f"{pulso}/10", estado, GREEN if pulso >= 7 else YELLOW if pulso >= 5 else RED)
+                if pulse["estres_semana"] is not None:
+                    pulso = round(10 - pulse["estres_semana"] * 2, 1)
+                    estado = "🟢 Alta moral" if pulso >= 7 else "🟡 Moderada" if pulso >= 5 else "🔴 Necesita atención"
+                    metric_card("Pulso del Equipo", f"{pulso}/10", estado, GREEN if pulso >= 7 else YELLOW if pulso >= 5 else RED)
+                else:
+                    metric_card("Pulso del Equipo", "—", "Sin check-ins esta semana")
             with col2:
-                metric_card("Check-ins Equipo", f"{len(set(c['email'] for c in team_checkins if c['fecha'][:10] >= (datetime.now().strftime('%Y-%m-%d'))))} esta semana")
+                metric_card("Check-ins Equipo", f"{pulse['checkins_semana']}/{pulse['miembros']}",
+                            f"esta semana · {pulse['directos']} directos")
         st.divider()
 
     # Muro de faros
     st.markdown("#### 🔦 Faros Recientes")
     faros = db.get_faros_publicos(5)
     if faros:
+        cel = db.get_celebraciones([f["faro_id"] for f in faros[:3]])
         for f in faros[:3]:
-            faro_card(f)
+            faro_card({**f, "celebraciones": cel.get(f["faro_id"], {}).get("total", f.get("celebraciones"))})
         if len(faros) > 3:
             if st.button("Ver todos los faros →"):
                 st.session_state.current_page = "Cultura Ítaca"
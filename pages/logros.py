@@ -1,15 +1,16 @@
 """Logros y Gamificación"""
 import streamlit as st
 import database as db
-from config import TURQ, GOLD, GREEN, GRAY, BLACK
+from config import TURQ, GOLD, GREEN, GRAY, BLACK, BADGES
 from components.cards import metric_card
 
 def render():
     email = st.session_state.current_user
     st.markdown("## 🏆 Mis Logros")
     
-    puntos = db.get_total_puntos(email)
-    logros = db.get_my_logros(email)
+    ctx = st.session_state.ctx
+    puntos = ctx["puntos"]
+    logros = ctx["logros"]
     
     c1, c2, c3 = st.columns(3)
     with c1: metric_card("⭐ Puntos Totales", puntos, color=GOLD)
@@ -37,30 +38,21 @@ def render():
     else:
         st.info("Aún no tienes badges. ¡Haz tu primer check-in o envía un faro para desbloquear tu primer logro!")
 
-    # Badges disponibles
+    # Badges disponibles (reglas en config.BADGES, avance desde los contadores)
     st.markdown("### 🔒 Badges por Desbloquear")
-    all_badges = [
-        ("🔦","Primer Faro","Envía tu primer faro",10,"Cultura"),
-        ("🔦","Iluminador","5 faros en un mes",25,"Cultura"),
-        ("💙","Bienestar Constante","4 check-ins consecutivos",15,"Cultura"),
-        ("📝","Primer Journal","1 entrada de journal",10,"IE"),
-        ("📝","Escritor Emocional","10 entradas de journal",25,"IE"),
-        ("🎯","Primera Respiración","1 ejercicio completado",10,"IE"),
-        ("🧠","Brújula Calibrada","Primera autoevaluación IE",15,"IE"),
-        ("🧭","Hexágono Activo","Primera evaluación de liderazgo",15,"Liderazgo"),
-        ("⭐","Estrella Reconocida","5 faros recibidos en un mes",30,"Cultura"),
-    ]
-    obtained_ids = [l["nombre_badge"] for l in logros]
-    locked = [b for b in all_badges if b[1] not in obtained_ids]
+    obtained_ids = {l["badge_id"] for l in logros}
+    progreso = db.get_badge_progress(email)
+    locked = [b for b in BADGES if b["id"] not in obtained_ids]
     if locked:
         cols = st.columns(3)
         for i, b in enumerate(locked):
+            valor, umbral = progreso.get(b["id"], (0, b["umbral"]))
             with cols[i % 3]:
                 st.markdown(f"""
                 <div style="background:#F5F5F5;border-radius:16px;padding:20px;text-align:center;
                 opacity:0.5;margin-bottom:12px;">
                     <div style="font-size:2.5rem;">🔒</div>
-                    <div style="font-weight:600;color:{GRAY};">{b[1]}</div>
-                    <div style="color:{GRAY};font-size:0.8rem;">{b[2]}</div>
-                    <div style="color:{GRAY};font-size:0.75rem;">+{b[3]} pts</div>
+                    <div style="font-weight:600;color:{GRAY};">{b['nombre']}</div>
+                    <div style="color:{GRAY};font-size:0.8rem;">{b['desc']}</div>
+                    <div style="color:{GRAY};font-size:0.75rem;">{min(valor, umbral)}/{umbral} · +{b['puntos']} pts</div>
                 </div>""", unsafe_allow_html=True)
@@ -1,6 +1,5 @@
 """Módulo 2: Mi Estrategia - OKR + Metas"""
 import streamlit as st
-from datetime import datetime
 import database as db
 from config import TURQ, GREEN, YELLOW, RED, GRAY
 from components.cards import metric_card, progress_bar_custom
@@ -11,9 +10,7 @@ def render():
     tab1, tab2 = st.tabs(["📋 Mis Metas", "➕ Nueva Meta"])
 
     with tab1:
-        with db.get_db() as conn:
-            metas = db.dict_rows(conn.execute(
-                "SELECT * FROM metas WHERE email=? ORDER BY fecha_creacion DESC", (email,)).fetchall())
+        metas = db.get_my_metas(email)
         if metas:
             for m in metas:
                 prog = m["progreso"] or 0
@@ -42,9 +39,7 @@ def render():
                     index=["Pendiente","En Progreso","Completado","Cancelado"].index(m["estado"]),
                     key=f"est_{m['meta_id']}")
                 if c3.button("💾", key=f"save_{m['meta_id']}"):
-                    with db.get_db() as conn:
-                        conn.execute("UPDATE metas SET progreso=?, estado=? WHERE meta_id=?",
-                            (new_prog, new_estado, m["meta_id"]))
+                    db.update_meta(m["meta_id"], new_prog, new_estado)
                     st.success("Actualizado")
                     st.rerun()
                 st.divider()
@@ -66,10 +61,6 @@ def render():
                 if not objetivo:
                     st.error("El objetivo es obligatorio.")
                 else:
-                    mid = f"{email}_{periodo}_{int(datetime.now().timestamp())}"
-                    with db.get_db() as conn:
-                        conn.execute("INSERT INTO metas VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-                            (mid, email, tipo, periodo, objetivo, kr1, kr2, kr3,
-                             0, "Pendiente", datetime.now().isoformat(), fecha_limite.isoformat()))
+                    db.save_meta(email, tipo, periodo, objetivo, kr1, kr2, kr3, fecha_limite.isoformat())
                     st.success("🎯 Meta creada exitosamente!")
                     st.rerun()
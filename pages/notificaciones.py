@@ -2,11 +2,13 @@
 import streamlit as st
 import database as db
 from config import TURQ, GRAY, RED, GREEN, GOLD
+from components import paging
 
 def render():
     email = st.session_state.current_user
     st.markdown("## 🔔 Notificaciones")
-    notifs = db.get_notificaciones(email, 30)
+    fetch = lambda limit, cursor: db.page_notificaciones(email, limit, cursor)
+    notifs = paging.paged_rows("notificaciones", fetch, 30)
     if notifs:
         for n in notifs:
             tipo_colors = {"Alerta":RED,"Recordatorio":GOLD,"Faro":TURQ,"Badge":GREEN,"Sistema":GRAY}
@@ -21,5 +23,6 @@ def render():
                 </div>
                 <div style="color:{GRAY};font-size:0.85rem;margin-top:4px;">{n['mensaje']}</div>
             </div>""", unsafe_allow_html=True)
+        paging.load_more_button("notificaciones", fetch, 30)
     else:
         st.info("No tienes notificaciones.")
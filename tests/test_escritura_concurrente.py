@@ -0,0 +1,32 @@
+"""
+Varios procesos escribiendo a la vez sobre la misma BD no pierden
+escrituras ni reciben "database is locked", directo y vía tools.writer.
+
+    python -m pytest tests
+"""
+import os
+import socket
+import tempfile
+
+import pytest
+
+os.environ.setdefault("ITACA_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="itaca_test_"), "boot.db"))
+
+import database as db
+from tools import stress
+
+
+@pytest.mark.parametrize("writer", [False, True], ids=["directo", "escritor"])
+def test_escritores_concurrentes(writer, tmp_path, monkeypatch):
+    if writer and not hasattr(socket, "AF_UNIX"):
+        pytest.skip("el escritor único necesita sockets Unix")
+    # run() apunta este proceso a la BD de la prueba: restaurar al terminar
+    monkeypatch.setenv("ITACA_DB_PATH", os.environ["ITACA_DB_PATH"])
+    monkeypatch.setattr(db, "DB_PATH", db.DB_PATH)
+    r = stress.run(writers=6, ops=10, writer=writer, tmp=str(tmp_path))
+    bloqueos = [e for e in r["errores"] if "locked" in e or "busy" in e]
+    assert not bloqueos, "\n".join(bloqueos)
+    assert r["errores"] == []
+    assert r["checkins"] == r["esperadas"] == 60
+    assert r["journal"] == r["esperadas"]
+    assert r["celebraciones"] == r["esperadas"]
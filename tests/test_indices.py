@@ -0,0 +1,39 @@
+"""
+Las consultas reales de database.py no recorren tablas enteras.
+
+    python -m pytest tests
+"""
+import functools
+import os
+import tempfile
+
+os.environ.setdefault("ITACA_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="itaca_test_"), "boot.db"))
+
+import database as db
+from tools import check_indexes
+
+
+def test_sin_full_scans():
+    filas, fallas = check_indexes.revisar()
+    escaneos = [f"{fn}: {sql[:120]} -> {scans}" for fn, sql, _, scans in filas if scans]
+    assert fallas == 0, "\n".join(escaneos)
+    assert filas
+
+
+def test_consulta_sin_indice_falla(monkeypatch):
+    # get_faros_por_tipo ya tiene un escaneo permitido: el permiso es de esa
+    # sentencia, no de la función, así que una consulta nueva en ella falla
+    original = db.get_faros_por_tipo
+    sin_indice = "SELECT COUNT(*) FROM faros WHERE mensaje LIKE '%faro%'"
+
+    @functools.wraps(original)
+    def con_consulta_nueva():
+        with db.get_db() as conn:
+            conn.execute(sin_indice).fetchone()
+        return original()
+
+    monkeypatch.setattr(db, "get_faros_por_tipo", con_consulta_nueva)
+    filas, fallas = check_indexes.revisar(users=50, weeks=2)
+    fallidas = [(fn, sql, scans) for fn, sql, _, scans in filas if scans]
+    assert fallas == len(fallidas) == 1
+    assert fallidas[0] == ("get_faros_por_tipo", sin_indice, ["SCAN faros"])
@@ -0,0 +1,250 @@
+"""
+Micro-benchmarks de las funciones públicas de database.py a varias escalas.
+
+Para cada escala genera (o reutiliza) una BD sintética con tools.synth, la
+copia a un archivo de trabajo y mide cada función registrada en CASES.
+El reporte es JSON para poder comparar corridas:
+
+    python -m tools.bench --scales 100,1000,10000 --out bench.json
+    python -m tools.bench --compare antes.json despues.json
+"""
+import argparse, json, os, platform, shutil, sqlite3, statistics, subprocess, sys, tempfile, time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Funciones de infraestructura: no son operaciones de negocio que medir
+INFRA = {"get_db", "transaction", "close_pool", "retry_on_busy", "semana_key", "dia_key", "dict_row",
+         "dict_rows", "init_db", "migrate", "seed_data", "get_schema_version", "bootstrap",
+         "explain_sql", "trace_sql", "cached", "invalidate", "invalidates", "cache_clear", "cache_stats",
+         "rebuild_metrics", "verify_metrics", "registrar_puntos", "sync_points_from_logros",
+         "rebuild_points", "verify_points", "rebuild_hierarchy", "verify_hierarchy",
+         "rebuild_team_feed", "verify_team_feed", "rebuild_wellbeing_cube",
+         "read_roster", "iter_export", "rebuild_search_index", "verify_search_index",
+         "rebuild_badges", "verify_badges", "consumer", "start_dispatcher",
+         "tarea", "cada", "diario", "semanal", "fin_de_mes", "start_scheduler",
+         "via_writer", "serve_writer", "writer_stats", "cerrar_sesion"}
+
+# nombre -> fn(ctx, i) que devuelve (args, kwargs). ctx trae emails de ejemplo.
+CASES = {
+    "nuevo_id": lambda c, i: ((), {}),
+    "get_user": lambda c, i: ((c["colab"],), {}),
+    "get_all_users": lambda c, i: ((), {}),
+    "get_identidad": lambda c, i: ((c["colab"],), {}),
+    "update_identidad": lambda c, i: ((c["colab"],), {"frase_personal": f"bench {i}"}),
+    "get_team_members": lambda c, i: ((c["lider"],), {}),
+    "save_checkin": lambda c, i: ((f"bench.ci{i}@{c['domain']}", "NORMAL", 3, "Trabajo", ["Concentrado"], ""), {}),
+    "get_my_checkins": lambda c, i: ((c["colab"],), {}),
+    "get_my_metas": lambda c, i: ((c["colab"],), {}),
+    "save_meta": lambda c, i: ((c["colab"], "OKR", "2026-Q1", f"Meta {i}", "kr1", "", "", "2026-03-31"), {}),
+    "update_meta": lambda c, i: ((c["meta_id"], 50, "En Progreso"), {}),
+    "get_team_checkins": lambda c, i: ((c["lider"],), {}),
+    "get_team_pulse": lambda c, i: ((c["lider"],), {}),
+    "get_direct_reports": lambda c, i: ((c["lider"],), {}),
+    "get_subtree": lambda c, i: ((c["lider"],), {}),
+    "get_chain_of_command": lambda c, i: ((c["colab"],), {}),
+    "checkin_done_this_week": lambda c, i: ((c["colab"],), {}),
+    "save_faro": lambda c, i: ((c["colab"], c["lider"], "Faro de Valor", "Mensaje de benchmark"), {}),
+    "get_faros_recibidos": lambda c, i: ((c["colab"],), {}),
+    "get_faros_enviados": lambda c, i: ((c["colab"],), {}),
+    "get_faros_publicos": lambda c, i: ((), {}),
+    "celebrar_faro": lambda c, i: ((c["faro_id"], f"bench.cel{i}@{c['domain']}"), {}),
+    "flush_celebraciones": lambda c, i: ((), {}),
+    "get_celebraciones": lambda c, i: (([c["faro_id"]], c["colab"]), {}),
+    "save_hexagono": lambda c, i: ((f"bench.hx{i}@{c['domain']}", dict.fromkeys(
+        ["vision", "planificacion", "encaje", "entrenamiento", "evaluacion_mejora", "reconocimiento"], 3), ""), {}),
+    "get_my_hexagono": lambda c, i: ((c["lider"],), {}),
+    "save_journal": lambda c, i: ((f"bench.j{i}@{c['domain']}", ["Tranquilo"], 5, "t", "p", "r", None, None, "Trabajo"), {}),
+    "get_my_journal": lambda c, i: ((c["colab"],), {}),
+    "save_brujula": lambda c, i: ((f"bench.br{i}@{c['domain']}", dict.fromkeys(
+        ["autoconocimiento", "autorregulacion", "motivacion", "empatia", "habilidades_sociales"], 3), ""), {}),
+    "get_my_brujula": lambda c, i: ((c["colab"],), {}),
+    "save_ejercicio": lambda c, i: ((f"bench.ej{i}@{c['domain']}", "EJ01", 5, "Autorregulación"), {}),
+    "get_badge_progress": lambda c, i: ((c["colab"],), {}),
+    "dispatch": lambda c, i: ((), {}),
+    "outbox_status": lambda c, i: ((), {}),
+    "purge_outbox": lambda c, i: ((), {}),
+    "run_job": lambda c, i: ((("recordatorio_checkin", "recordatorio_brujula", "mantenimiento")[i % 3],), {}),
+    "run_due_jobs": lambda c, i: ((), {}),
+    "scheduler_status": lambda c, i: ((), {}),
+    "get_job_runs": lambda c, i: (("recordatorio_checkin",), {}),
+    "get_my_logros": lambda c, i: ((c["colab"],), {}),
+    "get_total_puntos": lambda c, i: ((c["colab"],), {}),
+    "get_points_history": lambda c, i: ((c["colab"],), {}),
+    "otorgar_badge": lambda c, i: ((c["colab"], f"BENCH_{i}", "Bench", "", 1, "Cultura", "⭐"), {}),
+    "get_notificaciones": lambda c, i: ((c["colab"],), {}),
+    "count_unread": lambda c, i: ((c["colab"],), {}),
+    "get_alertas": lambda c, i: ((c["lider"],), {}),
+    "notificar_alertas": lambda c, i: ((), {}),
+    "load_user_context": lambda c, i: ((c["colab"],), {}),
+    "get_analytics": lambda c, i: ((), {}),
+    "update_password": lambda c, i: ((c["colab"], f"clave{i}"), {}),
+    # Camino de login: el hash cuesta lo mismo al entrar, sesion_activa es lo de cada rerun
+    "hash_password": lambda c, i: ((f"clave{i}",), {}),
+    "verificar_password": lambda c, i: ((c["clave"], c["hash"]), {}),
+    "iniciar_sesion": lambda c, i: ((c["lider"], c["clave"]), {}),
+    "sesion_activa": lambda c, i: ((c["token"],), {}),
+    "add_colaborador": lambda c, i: ((f"bench.new{i}@{c['domain']}", f"Nuevo {i}", "Colaborador",
+                                      "UNIDAD 000", c["lider"], "Analista", "", "2026-01-01"), {}),
+    "deactivate_colaborador": lambda c, i: ((c["colab"],), {}),
+    "reactivate_colaborador": lambda c, i: ((c["colab"],), {}),
+    "update_colaborador": lambda c, i: ((c["colab"],), {"puesto": f"Analista {i}"}),
+    "reset_password": lambda c, i: ((c["colab"],), {}),
+    "get_all_users_admin": lambda c, i: ((), {}),
+    "get_units": lambda c, i: ((), {}),
+    "page_faros_publicos": lambda c, i: ((20, c["cursor_faros"]), {}),
+    "page_my_checkins": lambda c, i: ((c["colab"], 10, None), {}),
+    "page_my_journal": lambda c, i: ((c["colab"], 10, None), {}),
+    "page_notificaciones": lambda c, i: ((c["colab"], 20, None), {}),
+    "page_checkins_recientes": lambda c, i: ((20, None), {}),
+    "get_faros_por_tipo": lambda c, i: ((), {}),
+    "get_bienestar": lambda c, i: (("unidad", 8 + i % 2), {}),
+    "get_resumen_por_unidad": lambda c, i: ((), {}),
+    "get_resumen_por_rol": lambda c, i: ((), {}),
+    "reset_all_passwords": lambda c, i: ((), {}),
+    "diff_colaboradores": lambda c, i: ((c["roster"],), {}),
+    "write_export": lambda c, i: ((c["sink"], ("checkins", "faros", "journal")[i % 3], "csv"), {"email": c["colab"]}),
+    "buscar": lambda c, i: ((c["colab"], ("equipo", "proyecto entrega", "persona", "apoyo cliente")[i % 4]), {}),
+    "import_colaboradores": lambda c, i: (([{**r, "puesto": f"Import {i}"} for r in c["roster"]],), {"aplicar": True}),
+}
+
+
+def _context(db, domain):
+    with db.get_db() as conn:
+        lider = conn.execute("SELECT email FROM usuarios WHERE rol='Líder' AND email LIKE ? ORDER BY email LIMIT 1",
+                             (f"%@{domain}",)).fetchone()[0]
+        colab = conn.execute("SELECT email FROM usuarios WHERE rol='Colaborador' AND email LIKE ? "
+                             "ORDER BY email LIMIT 1", (f"%@{domain}",)).fetchone()[0]
+        faro_id = conn.execute("SELECT faro_id FROM faros ORDER BY faro_id DESC LIMIT 1").fetchone()[0]
+        # Cursor a mitad de la historia: mide una página profunda, no la primera
+        mid = conn.execute("SELECT faro_id FROM faros WHERE visible=1 ORDER BY faro_id "
+                           "LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM faros)").fetchone()
+        # 500 filas del roster actual más 100 nuevas, como las leería read_roster
+        roster = [dict(r) for r in conn.execute("""SELECT u.email, u.nombre, u.rol, u.estado, u.unidad,
+            u.email_lider, i.puesto FROM usuarios u JOIN identidad i ON i.email = u.email
+            ORDER BY u.email LIMIT 500""")]
+        roster += [{"email": f"bench.imp{n}@{domain}", "nombre": f"Import {n}", "rol": "Colaborador",
+                    "unidad": "UNIDAD 000", "email_lider": lider} for n in range(100)]
+    meta_id = db.save_meta(colab, "OKR", "2026-Q1", "Meta de benchmark", "kr1", "", "", "2026-03-31")
+    # El líder conserva la clave inicial (los casos de clave actúan sobre colab)
+    token, _ = db.iniciar_sesion(lider, db.PASSWORD_INICIAL)
+    return {"lider": lider, "colab": colab, "faro_id": faro_id, "domain": domain, "roster": roster,
+            "sink": open(os.devnull, "wb"), "clave": db.PASSWORD_INICIAL,
+            "hash": db.hash_password(db.PASSWORD_INICIAL), "token": token, "meta_id": meta_id,
+            "cursor_faros": mid[0] if mid else None}
+
+
+def public_functions(db):
+    import inspect
+    return sorted(n for n, f in inspect.getmembers(db, inspect.isfunction)
+                  if f.__module__ == db.__name__ and not n.startswith("_") and n not in INFRA)
+
+
+def time_function(fn, ctx, iterations, warmup=2):
+    samples, errors = [], 0
+    for i in range(-warmup, iterations):
+        args, kwargs = CASES[fn.__name__](ctx, i + warmup)
+        t0 = time.perf_counter()
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            errors += 1
+        if i >= 0:
+            samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "n": len(samples), "errores": errors,
+        "mediana_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "media_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+def run_scale(users, weeks, data_dir, iterations, seed=42):
+    from tools import synth
+    import database as db
+    units = max(users // 250, 4)
+    base = os.path.join(data_dir, f"bench_{users}u_{weeks}w_s{seed}_v{db.SCHEMA_VERSION}.db")
+    if not os.path.exists(base):
+        synth.generate(base, users=users, units=units, weeks=weeks, seed=seed)
+    work = os.path.join(data_dir, "bench_work.db")
+    db.close_pool()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(base, work)
+
+    prev = db.DB_PATH
+    db.DB_PATH = work
+    try:
+        ctx = _context(db, synth.DOMAIN)
+        with db.get_db() as conn:
+            counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                      for t in ("usuarios", "checkins", "faros", "journal", "notificaciones")}
+        results, missing = {}, []
+        for name in public_functions(db):
+            if name not in CASES:
+                missing.append(name)
+                continue
+            results[name] = time_function(getattr(db, name), ctx, iterations)
+            print(f"  {users:>6}u {name:28} {results[name]['mediana_ms']:9.3f} ms"
+                  f"{'  (' + str(results[name]['errores']) + ' errores)' if results[name]['errores'] else ''}")
+        return {"params": {"users": users, "units": units, "weeks": weeks, "seed": seed},
+                "filas": counts, "funciones": results, "sin_caso": missing}
+    finally:
+        db.close_pool()
+        db.DB_PATH = prev
+
+
+def run(scales, weeks, data_dir, iterations):
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    report = {"fecha": datetime.now().isoformat(timespec="seconds"), "git": rev,
+              "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+              "iteraciones": iterations, "escalas": {}}
+    for users in scales:
+        report["escalas"][str(users)] = run_scale(users, weeks, data_dir, iterations)
+    return report
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'escala':>7} {'función':28} {'antes ms':>10} {'después ms':>11} {'ratio':>7}")
+    for scale, data in new["escalas"].items():
+        before = old["escalas"].get(scale, {}).get("funciones", {})
+        for name, r in data["funciones"].items():
+            if name not in before:
+                continue
+            a, b = before[name]["mediana_ms"], r["mediana_ms"]
+            print(f"{scale:>7} {name:28} {a:10.3f} {b:11.3f} {b / a if a else float('inf'):6.2f}x")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmarks de database.py")
+    ap.add_argument("--scales", default="100,1000,10000", help="usuarios por escala, separados por coma")
+    ap.add_argument("--weeks", type=int, default=26)
+    ap.add_argument("--iterations", type=int, default=30)
+    ap.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "itaca_bench"))
+    ap.add_argument("--out", default="-", help="archivo JSON de salida ('-' = stdout)")
+    ap.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"))
+    a = ap.parse_args()
+    if a.compare:
+        compare(*a.compare)
+        sys.exit(0)
+    os.environ.setdefault("ITACA_DB_PATH", os.path.join(a.data_dir, "bench_boot.db"))
+    os.makedirs(a.data_dir, exist_ok=True)
+    report = run([int(s) for s in a.scales.split(",")], a.weeks, a.data_dir, a.iterations)
+    out = json.dumps(report, indent=2, ensure_ascii=False)
+    if a.out == "-":
+        print(out)
+    else:
+        with open(a.out, "w", encoding="utf-8") as f:
+            f.write(out)
+        print(f"Reporte escrito en {a.out}")
@@ -0,0 +1,44 @@
+"""
+Mide el costo de arranque y el overhead por rerun de la inicialización de BD.
+
+  - cold: importar database en un proceso nuevo (BD ya existente)
+  - rerun init_db(): lo que hacía app.py en cada rerun (DDL + seed check)
+  - rerun bootstrap(): camino rápido actual
+
+    python -m tools.bench_startup [--reruns 200]
+"""
+import argparse, os, subprocess, sys, tempfile, time
+
+
+def run(reruns=200):
+    os.environ.setdefault("ITACA_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="itaca_boot_"), "boot.db"))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    t0 = time.perf_counter()
+    import database as db  # crea, migra y siembra la BD
+    print(f"primer arranque (BD nueva):   {(time.perf_counter() - t0) * 1000:8.2f} ms")
+
+    cold = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import database"], cwd=root, check=True)
+        cold.append(time.perf_counter() - t0)
+    print(f"arranque en frío (BD al día): {min(cold) * 1000:8.2f} ms  (proceso completo, mejor de 5)")
+
+    t0 = time.perf_counter()
+    for _ in range(reruns):
+        db.init_db()
+    legacy = (time.perf_counter() - t0) / reruns
+    print(f"rerun con init_db():          {legacy * 1e3:8.3f} ms/rerun")
+
+    t0 = time.perf_counter()
+    for _ in range(reruns):
+        db.bootstrap()
+    fast = (time.perf_counter() - t0) / reruns
+    print(f"rerun con bootstrap():        {fast * 1e6:8.3f} µs/rerun")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reruns", type=int, default=200)
+    run(ap.parse_args().reruns)
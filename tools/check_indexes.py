@@ -0,0 +1,97 @@
+"""
+Verifica con EXPLAIN QUERY PLAN que las consultas reales de database.py no
+recorran tablas enteras. Genera una BD sintética chica, corre cada función
+pública con los casos de tools.bench bajo db.trace_sql() (más el dispatch
+del outbox y todas las tareas programadas) y explica cada sentencia
+capturada tal como se ejecutó. Falla ante cualquier "SCAN <tabla>", use o
+no un índice, salvo los pares (sentencia, paso del plan) de
+db.ESCANEO_PERMITIDO.
+
+    python -m tools.check_indexes [-v]
+"""
+import os
+import re
+import sys
+import tempfile
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_EXPLICABLES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_INTERNAS = "'main'."   # SQL que FTS5 ejecuta sobre sus propias tablas
+
+
+def normalizar(sql):
+    """Sentencia en una línea y con los literales como ?, para comparar."""
+    return _LITERALES.sub("?", " ".join(sql.split()))
+
+
+def capturar(db, ctx):
+    """{(función, sentencia normalizada): sql tal como se ejecutó} corriendo
+    cada caso de tools.bench y luego dispatch() y cada tarea programada."""
+    from tools.bench import CASES, public_functions
+    vistas, actual = {}, {"fn": None}
+
+    def registrar(sql):
+        sql = " ".join(sql.split())
+        if sql.upper().startswith(_EXPLICABLES) and _INTERNAS not in sql:
+            vistas.setdefault((actual["fn"], normalizar(sql)), sql)
+
+    # run_job se recorre abajo tarea por tarea, para reportar cada una por su nombre
+    llamadas = [(n, getattr(db, n), CASES[n]) for n in public_functions(db) if n in CASES and n != "run_job"]
+    llamadas += [("dispatch", db.dispatch, CASES["dispatch"])]
+    llamadas += [(f"run_job:{t}", db.run_job, lambda c, i, t=t: ((t,), {})) for t in sorted(db._tareas)]
+    with db.trace_sql(registrar):
+        for nombre, fn, caso in llamadas:
+            actual["fn"] = nombre
+            for i in range(2):
+                args, kwargs = caso(ctx, i)
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:  # el caso puede fallar a propósito; lo que importa es el SQL
+                    print(f"aviso     {nombre}: {type(e).__name__}: {e}", file=sys.stderr)
+        actual["fn"] = "flush_celebraciones"
+        db.flush_celebraciones()
+    return vistas
+
+
+def revisar(verbose=False, users=200, weeks=8):
+    """Lista de (función, sql, plan, full_scans) y cuántas fallan."""
+    from tools import synth
+    from tools.bench import _context
+    import database as db
+    path = os.path.join(tempfile.mkdtemp(prefix="itaca_idx_"), "idx.db")
+    synth.generate(path, users=users, units=4, weeks=weeks, verbose=False)
+    prev = db.DB_PATH
+    db.DB_PATH = path
+    try:
+        vistas = capturar(db, _context(db, synth.DOMAIN))
+        permitidos = {(normalizar(sql), paso) for sql, paso in db.ESCANEO_PERMITIDO}
+        filas, fallas = [], 0
+        with db.get_db() as conn:
+            for (fn, normal), sql in sorted(vistas.items(), key=lambda kv: (kv[0][0] or "", kv[0][1])):
+                try:
+                    plan, scans = db.explain_sql(sql, conn)
+                except Exception as e:
+                    plan, scans = [f"no se pudo explicar: {e}"], ["?"]
+                scans = [p for p in scans if (normal, p) not in permitidos]
+                fallas += bool(scans)
+                filas.append((fn, sql, plan, scans))
+        return filas, fallas
+    finally:
+        db.close_pool()
+        db.DB_PATH = prev
+
+
+def run(verbose=False):
+    os.environ.setdefault("ITACA_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="itaca_idx_"), "boot.db"))
+    filas, fallas = revisar(verbose)
+    for fn, sql, plan, scans in filas:
+        if scans or verbose:
+            print(f"{'FULL SCAN' if scans else 'ok':9} {fn}: {sql[:160]}")
+            for step in plan:
+                print(f"          {step}")
+    print(f"{len(filas) - fallas}/{len(filas)} sentencias sin full scan")
+    return fallas == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run("-v" in sys.argv) else 1)
@@ -0,0 +1,40 @@
+"""
+Exportar check-ins, faros o journal para reportes de RR.HH., por bloques
+(memoria constante sin importar el tamaño de la tabla).
+
+    python -m tools.export checkins -o checkins.csv
+    python -m tools.export journal --formato jsonl --desde 2026-01-01 --hasta 2026-03-31 -o t1.jsonl
+    python -m tools.export faros --formato parquet --unidad "ITACA HUB" -o faros.parquet
+
+Con -o - (por defecto) escribe a stdout; pensado para dumps programados con cron.
+"""
+import argparse, sys, time
+from datetime import date
+
+
+def main(vista, formato, salida, **filtros):
+    import database as db
+    t0 = time.perf_counter()
+    if salida == "-":
+        n = db.write_export(sys.stdout.buffer, vista, formato, **filtros)
+    else:
+        with open(salida, "wb") as f:
+            n = db.write_export(f, vista, formato, **filtros)
+    print(f"{n} filas de {vista} exportadas en {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    import database as db
+    ap = argparse.ArgumentParser(description="Exportar datos de Ítaca OS")
+    ap.add_argument("vista", choices=sorted(db.EXPORT_VISTAS))
+    ap.add_argument("--formato", choices=db.EXPORT_FORMATOS, default="csv")
+    ap.add_argument("-o", "--salida", default="-")
+    ap.add_argument("--unidad")
+    ap.add_argument("--email")
+    ap.add_argument("--desde", type=date.fromisoformat, help="AAAA-MM-DD (inclusive)")
+    ap.add_argument("--hasta", type=date.fromisoformat, help="AAAA-MM-DD (inclusive)")
+    a = ap.parse_args()
+    try:
+        main(a.vista, a.formato, a.salida, unidad=a.unidad, email=a.email, desde=a.desde, hasta=a.hasta)
+    except ValueError as e:
+        sys.exit(str(e))
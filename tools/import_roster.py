@@ -0,0 +1,42 @@
+"""
+Importar la BD MAESTRA de colaboradores desde CSV o XLSX.
+
+Sin --aplicar solo muestra el diff (nuevos, cambios, a desactivar, errores):
+
+    python -m tools.import_roster maestra.csv
+    python -m tools.import_roster maestra.xlsx --aplicar --desactivar-ausentes
+"""
+import argparse, os, sys, time
+
+
+def main(path, aplicar=False, desactivar_ausentes=False, verbose=False):
+    import database as db
+    t0 = time.perf_counter()
+    with open(path, "rb") as f:
+        diff = db.import_colaboradores(db.read_roster(f, os.path.basename(path)),
+                                       desactivar_ausentes, aplicar)
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"nuevos={len(diff['nuevos'])} cambios={len(diff['cambios'])} "
+          f"desactivar={len(diff['desactivar'])} sin_cambios={diff['sin_cambios']} "
+          f"errores={len(diff['errores'])}  ({ms:.0f} ms)")
+    for linea, email, detalle in diff["errores"][:50]:
+        print(f"  línea {linea:>6} {email:40} {detalle}")
+    if verbose:
+        for c in diff["cambios"]:
+            print(f"  {c['email']:40} " + ", ".join(f"{k}: {a!r} → {d!r}" for k, (a, d) in c["campos"].items()))
+        for e in diff["desactivar"]:
+            print(f"  {e:40} → Inactivo")
+    if aplicar:
+        print("Aplicado." if diff["aplicado"] else "No se aplicó: corrige los errores.")
+    return not diff["errores"]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Importar colaboradores desde CSV/XLSX")
+    ap.add_argument("archivo")
+    ap.add_argument("--aplicar", action="store_true", help="aplicar el diff (por defecto solo se muestra)")
+    ap.add_argument("--desactivar-ausentes", action="store_true",
+                    help="desactivar a los activos que no están en el archivo (excepto Admin)")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    a = ap.parse_args()
+    sys.exit(0 if main(a.archivo, a.aplicar, a.desactivar_ausentes, a.verbose) else 1)
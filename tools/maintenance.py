@@ -0,0 +1,191 @@
+"""
+Tareas de mantenimiento de datos derivados.
+
+    python -m tools.maintenance rebuild-metrics   # recalcular métricas materializadas
+    python -m tools.maintenance verify-metrics    # comparar contra un recálculo (exit 1 si difieren)
+    python -m tools.maintenance rebuild-points    # rehacer saldos reproduciendo el ledger
+    python -m tools.maintenance verify-points     # ledger vs saldos vs logros (exit 1 si difieren)
+    python -m tools.maintenance rebuild-hierarchy # recalcular la clausura de email_lider
+    python -m tools.maintenance verify-hierarchy  # clausura vs recálculo (exit 1 si difieren)
+    python -m tools.maintenance rebuild-feed      # recalcular los feeds de check-ins por líder
+    python -m tools.maintenance verify-feed       # feeds vs recálculo (exit 1 si difieren)
+    python -m tools.maintenance rebuild-cube      # re-atribuir el cubo de bienestar con la unidad/rol/líder actuales
+    python -m tools.maintenance rebuild-search    # reconstruir los índices FTS5 de búsqueda
+    python -m tools.maintenance rebuild-badges    # recalcular contadores desde la historia y otorgar badges pendientes
+    python -m tools.maintenance verify-badges     # contadores vs recálculo y badges sin otorgar (exit 1 si hay)
+    python -m tools.maintenance dispatch          # entregar los eventos pendientes del outbox a sus consumidores
+    python -m tools.maintenance outbox-status     # offset, pendientes y errores por consumidor (exit 1 si hay errores)
+    python -m tools.maintenance purge-outbox      # borrar eventos ya entregados de más de OUTBOX_RETENCION_DIAS
+    python -m tools.maintenance notify-alerts     # notificar (sin duplicar) las alertas de estrés de la semana actual
+    python -m tools.maintenance run-jobs          # correr ahora las tareas programadas vencidas
+    python -m tools.maintenance jobs-status       # próxima/última corrida, duración y filas por tarea (exit 1 si hay errores)
+    python -m tools.maintenance verify-search     # integrity-check de FTS5 contra las tablas (exit 1 si difieren)
+"""
+import sys
+
+
+def rebuild_metrics(db):
+    db.rebuild_metrics()
+    print("Métricas recalculadas.")
+    return True
+
+
+def verify_metrics(db):
+    diffs = db.verify_metrics()
+    for dia, metrica, guardado, real in diffs[:50]:
+        print(f"{dia:10} {metrica:18} guardado={guardado} real={real}")
+    print(f"{len(diffs)} diferencias")
+    return not diffs
+
+
+def rebuild_points(db):
+    with db.get_db() as conn:
+        db.sync_points_from_logros(conn)
+    print("Saldos de puntos recalculados desde el ledger.")
+    return True
+
+
+def verify_points(db):
+    problems = db.verify_points()
+    for email, detalle in problems[:50]:
+        print(f"{email:40} {detalle}")
+    print(f"{len(problems)} inconsistencias")
+    return not problems
+
+
+def rebuild_hierarchy(db):
+    db.rebuild_hierarchy()
+    print("Jerarquía recalculada desde usuarios.email_lider.")
+    return True
+
+
+def verify_hierarchy(db):
+    diffs = db.verify_hierarchy()
+    for ancestro, descendiente, guardado, real in diffs[:50]:
+        print(f"{ancestro:35} → {descendiente:35} guardado={guardado} real={real}")
+    print(f"{len(diffs)} diferencias")
+    return not diffs
+
+
+def rebuild_feed(db):
+    db.rebuild_team_feed()
+    print(f"Feeds de equipo recalculados (últimos {db.FEED_EQUIPO_N} por líder).")
+    return True
+
+
+def verify_feed(db):
+    diffs = db.verify_team_feed()
+    for lider, checkin_id, tipo in diffs[:50]:
+        print(f"{lider:35} {checkin_id:45} {tipo}")
+    print(f"{len(diffs)} diferencias")
+    return not diffs
+
+
+def rebuild_cube(db):
+    db.rebuild_wellbeing_cube()
+    print("Cubo de bienestar recalculado.")
+    return True
+
+
+def rebuild_search(db):
+    db.rebuild_search_index()
+    print("Índices de búsqueda reconstruidos.")
+    return True
+
+
+def verify_search(db):
+    problems = db.verify_search_index()
+    for indice, error in problems:
+        print(f"{indice:20} {error}")
+    print(f"{len(problems)} índices con diferencias")
+    return not problems
+
+
+def rebuild_badges(db):
+    otorgados = db.rebuild_badges()
+    print(f"Contadores recalculados; {otorgados} badges otorgados.")
+    return True
+
+
+def verify_badges(db):
+    diffs = db.verify_badges()
+    for email, contador, guardado, real in diffs[:50]:
+        print(f"{email:35} {contador:32} guardado={guardado} real={real}")
+    print(f"{len(diffs)} diferencias")
+    return not diffs
+
+
+def dispatch(db):
+    for consumidor, n in db.dispatch().items():
+        print(f"{consumidor:20} {n} eventos entregados")
+    return True
+
+
+def outbox_status(db):
+    estado = db.outbox_status()
+    for c in estado:
+        print(f"{c['consumidor']:20} offset={c['ultimo_evento']} pendientes={c['pendientes']} "
+              f"entregados={c['entregados']} errores={c['errores']}"
+              + (f"  último: {c['ultimo_error']}" if c["ultimo_error"] else ""))
+    return not any(c["errores"] for c in estado)
+
+
+def purge_outbox(db):
+    print(f"{db.purge_outbox()} eventos borrados del outbox.")
+    return True
+
+
+def notify_alerts(db):
+    print(f"{db.notificar_alertas()} notificaciones de alerta creadas.")
+    return True
+
+
+def run_jobs(db):
+    corridas = db.run_due_jobs()
+    for c in corridas:
+        print(f"{c['tarea']:24} {c['duracion_ms']:>9.2f} ms  filas={c['filas']}"
+              + (f"  error: {c['error']}" if c["error"] else ""))
+    print(f"{len(corridas)} tareas ejecutadas")
+    return not any(c["error"] for c in corridas)
+
+
+def jobs_status(db):
+    estado = db.scheduler_status()
+    for t in estado:
+        print(f"{t['tarea']:24} próxima={t['proxima']} última={t['ultima']} duración={t['duracion_ms']} ms "
+              f"filas={t['filas']} ejecuciones={t['ejecuciones']} errores={t['errores']}"
+              + (f"  último: {t['ultimo_error']}" if t["ultimo_error"] else ""))
+    if estado:
+        print(f"arriendo: {estado[0]['dueno']} hasta {estado[0]['lock_expira']}")
+    return not any(t["errores"] for t in estado)
+
+
+COMMANDS = {
+    "rebuild-metrics": rebuild_metrics,
+    "verify-metrics": verify_metrics,
+    "rebuild-points": rebuild_points,
+    "verify-points": verify_points,
+    "rebuild-hierarchy": rebuild_hierarchy,
+    "verify-hierarchy": verify_hierarchy,
+    "rebuild-feed": rebuild_feed,
+    "verify-feed": verify_feed,
+    "rebuild-cube": rebuild_cube,
+    "rebuild-search": rebuild_search,
+    "verify-search": verify_search,
+    "rebuild-badges": rebuild_badges,
+    "verify-badges": verify_badges,
+    "dispatch": dispatch,
+    "outbox-status": outbox_status,
+    "purge-outbox": purge_outbox,
+    "notify-alerts": notify_alerts,
+    "run-jobs": run_jobs,
+    "jobs-status": jobs_status,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        print(__doc__.strip())
+        sys.exit(2)
+    import database as db
+    sys.exit(0 if COMMANDS[sys.argv[1]](db) else 1)
@@ -0,0 +1,156 @@
+"""
+Prueba de estrés de escritura concurrente sobre SQLite.
+
+Lanza N procesos escritores (como N sesiones de Streamlit) que guardan
+check-ins, entradas de journal y celebraciones sobre una BD temporal, y
+verifica que todas las escrituras se aplicaron sin errores de lock.
+Con --writer las escrituras pasan por el proceso escritor único
+(tools.writer); --compare corre ambos modos y compara el throughput.
+--hold MS suma un proceso que toma el lock de escritura MS ms cada 50 ms
+(transacciones largas): es el caso en que el escritor único rinde más
+(ver README).
+
+    python -m tools.stress --writers 16 --ops 25
+    python -m tools.stress --writers 32 --ops 25 --compare
+    python -m tools.stress --writers 32 --ops 25 --compare --hold 50
+"""
+import argparse, os, signal, subprocess, sys, tempfile, time
+import multiprocessing as mp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _writer(db_path, wid, ops, faro_id, ready, start, errors, lat, sock=None):
+    os.environ["ITACA_DB_PATH"] = db_path
+    if sock:
+        os.environ["ITACA_WRITER_SOCKET"] = sock
+    import database as db
+    ready.put(wid)
+    start.wait()
+    tiempos = []
+    for i in range(ops):
+        email = f"stress.w{wid}.{i}@itaca.com"
+        t0 = time.perf_counter()
+        try:
+            db.save_checkin(email, "NORMAL", 1 + (i % 5), "Trabajo", ["Concentrado"], "")
+            db.save_journal(email, ["Tranquilo"], 5, "stress", "", "", None, None, "Trabajo")
+            db.celebrar_faro(faro_id, email)
+            db.celebrar_faro(faro_id, email)  # repetido: no debe contar
+        except Exception as e:  # cualquier error cuenta como fallo
+            errors.put(f"writer {wid} op {i}: {e!r}")
+        tiempos.append(time.perf_counter() - t0)
+    try:
+        db.flush_celebraciones()
+    except Exception as e:
+        errors.put(f"writer {wid} flush: {e!r}")
+    lat.put(tiempos)
+
+
+def _bloqueador(db_path, hold_ms, stop):
+    """Tomar el lock de escritura hold_ms cada 50 ms, como un rebuild o el mantenimiento."""
+    os.environ["ITACA_DB_PATH"] = db_path
+    import database as db
+    while not stop.is_set():
+        with db.transaction(immediate=True) as conn:
+            conn.execute("UPDATE metricas SET valor = valor WHERE metrica = 'faros_total'")
+            time.sleep(hold_ms / 1000)
+        time.sleep(0.05)
+
+
+def _start_writer(db_path, sock):
+    """Lanzar tools.writer sobre db_path y esperar a que su socket exista."""
+    proc = subprocess.Popen([sys.executable, "-m", "tools.writer", "--socket", sock], cwd=ROOT,
+                            env={**os.environ, "ITACA_DB_PATH": db_path},
+                            stdout=subprocess.PIPE, text=True)
+    for _ in range(200):
+        if os.path.exists(sock) or proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    if not os.path.exists(sock):
+        proc.kill()
+        raise RuntimeError("tools.writer no levantó su socket")
+    return proc
+
+
+def run(writers=8, ops=20, writer=False, hold=0, tmp=None):
+    """Correr la prueba sobre una BD nueva en `tmp` (por defecto un directorio
+    temporal). Devuelve un dict con ok, escrituras/s, los errores que
+    llegaron a los escritores y las filas esperadas y encontradas."""
+    tmp = tmp or tempfile.mkdtemp(prefix="itaca_stress_")
+    db_path = os.path.join(tmp, "stress.db")
+    os.environ["ITACA_DB_PATH"] = db_path
+    import database as db
+    db.DB_PATH = db_path
+    db.init_db()
+    with db.get_db() as conn:
+        faro_id = conn.execute("SELECT faro_id FROM faros LIMIT 1").fetchone()[0]
+        base = conn.execute("SELECT celebraciones FROM faros WHERE faro_id=?", (faro_id,)).fetchone()[0]
+    db.close_pool()
+    sock = os.path.join(tmp, "writer.sock") if writer else None
+    proc = _start_writer(db_path, sock) if writer else None
+
+    ctx = mp.get_context("spawn")
+    ready, start, errors, lat = ctx.Queue(), ctx.Event(), ctx.Queue(), ctx.Queue()
+    stop = ctx.Event()
+    bloqueador = ctx.Process(target=_bloqueador, args=(db_path, hold, stop)) if hold else None
+    procs = [ctx.Process(target=_writer, args=(db_path, w, ops, faro_id, ready, start, errors, lat, sock))
+             for w in range(writers)]
+    for p in procs:
+        p.start()
+    for _ in procs:  # medir solo las escrituras, no el arranque de cada proceso
+        ready.get()
+    if bloqueador:
+        bloqueador.start()
+    t0 = time.perf_counter()
+    start.set()
+    # Vaciar la cola antes del join: un hijo no termina con datos sin leer
+    tiempos = sorted(t for _ in procs for t in lat.get())
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - t0
+    if bloqueador:
+        stop.set()
+        bloqueador.join()
+    if proc:
+        proc.send_signal(signal.SIGINT)
+        print(f"escritor: {proc.communicate(timeout=30)[0].strip()}")
+
+    failures = []
+    while not errors.empty():
+        failures.append(errors.get())
+    expected = writers * ops
+    with db.get_db() as conn:
+        n_ci = conn.execute("SELECT COUNT(*) FROM checkins WHERE email LIKE 'stress.%'").fetchone()[0]
+        n_j = conn.execute("SELECT COUNT(*) FROM journal WHERE email LIKE 'stress.%'").fetchone()[0]
+        cel = conn.execute("SELECT celebraciones FROM faros WHERE faro_id=?", (faro_id,)).fetchone()[0] - base
+    db.close_pool()
+
+    rate = 3 * expected / elapsed
+    print(f"{writers} escritores x {ops} ops en {elapsed:.2f}s ({rate:.0f} escrituras/s)"
+          + (" vía tools.writer" if writer else "") + (f", lock tomado {hold} ms cada 50 ms" if hold else ""))
+    pct = lambda q: 1000 * tiempos[min(len(tiempos) - 1, int(q * len(tiempos)))]
+    print(f"latencia por op (3 escrituras): p50={pct(0.5):.1f} ms p99={pct(0.99):.1f} ms max={1000 * tiempos[-1]:.1f} ms")
+    print(f"checkins={n_ci}/{expected} journal={n_j}/{expected} celebraciones={cel}/{expected}")
+    for f in failures[:10]:
+        print("ERROR", f)
+    ok = not failures and n_ci == n_j == cel == expected
+    print("OK" if ok else "FALLÓ")
+    return {"ok": ok, "rate": rate, "errores": failures, "esperadas": expected,
+            "checkins": n_ci, "journal": n_j, "celebraciones": cel}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--writers", type=int, default=8)
+    ap.add_argument("--ops", type=int, default=20)
+    ap.add_argument("--writer", action="store_true", help="escribir a través de tools.writer")
+    ap.add_argument("--compare", action="store_true", help="correr directo y vía tools.writer")
+    ap.add_argument("--hold", type=int, default=0, metavar="MS",
+                    help="otro proceso toma el lock de escritura MS ms cada 50 ms (transacciones largas)")
+    a = ap.parse_args()
+    if a.compare:
+        directo = run(a.writers, a.ops, hold=a.hold)
+        escritor = run(a.writers, a.ops, writer=True, hold=a.hold)
+        print(f"vía tools.writer: {escritor['rate'] / directo['rate']:.2f}x el throughput directo")
+        sys.exit(0 if directo["ok"] and escritor["ok"] else 1)
+    sys.exit(0 if run(a.writers, a.ops, a.writer, a.hold)["ok"] else 1)
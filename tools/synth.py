@@ -0,0 +1,215 @@
+"""
+Generador determinista de BDs sintéticas para pruebas de escala.
+
+Construye una BD con el esquema actual (init_db + migraciones) y la llena con
+usuarios repartidos en unidades, una jerarquía de líderes por email_lider y
+N semanas de historia: check-ins, faros, journal, ejercicios, evaluaciones
+(hexágono y brújula), notificaciones y logros. La misma semilla produce
+siempre la misma BD.
+
+    python -m tools.synth /tmp/itaca_10k.db --users 10000 --units 40 --weeks 52
+"""
+import argparse, os, random, time
+from datetime import datetime, timedelta
+
+DOMAIN = "synth.itaca.com"
+ESTADOS = ["GENIAL", "NORMAL", "DIFICIL"]
+AREAS = ["Trabajo", "Personal", "Ambas"]
+ETIQUETAS = ["Energizado", "Motivado", "Tranquilo", "Concentrado", "Cansado", "Presionado", "Ansioso"]
+TIPOS = [("Faro de Valor", "ITACTIVIDAD", "Ardilla"),
+         ("Faro de Guía", "+1 Sí Importa", "Castor"),
+         ("Faro de Aliento", "Muro de Confianza", "Ganso")]
+CONTEXTOS = ["Trabajo", "Personal", "Social", "Salud"]
+DIAS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+PALABRAS = ("gracias por tu apoyo en el proyecto equipo cliente reunión entrega "
+            "confianza proactividad ayuda semana difícil logro aprendizaje").split()
+
+
+def _frase(rng, n=12):
+    return " ".join(rng.choice(PALABRAS) for _ in range(n)).capitalize() + "."
+
+
+def build_people(rng, users, units, span=8):
+    """Lista de (email, nombre, rol, unidad, email_lider, puesto).
+
+    Por unidad: un Líder que reporta a dirección, coordinadores cada `span`
+    personas que reportan al líder, y colaboradores que reportan al
+    coordinador de su bloque. Así el árbol tiene 3-4 niveles.
+    """
+    root = f"direccion@{DOMAIN}"
+    people = [(root, "Dirección General", "Admin", "DIRECCIÓN", None, "Director")]
+    per_unit = max((users - 1) // units, 1)
+    n = 0
+    for u in range(units):
+        unidad = f"UNIDAD {u:03d}"
+        lider = f"lider.u{u:03d}@{DOMAIN}"
+        people.append((lider, f"Líder Unidad {u:03d}", "Líder", unidad, root, "Gerente"))
+        coord = lider
+        for k in range(per_unit - 1):
+            if len(people) >= users:
+                break
+            n += 1
+            email = f"p{n:06d}@{DOMAIN}"
+            if k % span == 0:
+                coord = email
+                people.append((email, f"Coordinador {n:06d}", "Coordinador", unidad, lider, "Coordinador"))
+            else:
+                people.append((email, f"Persona {n:06d}", "Colaborador", unidad, coord,
+                               rng.choice(["Docente", "Analista", "Asistente", "Diseñador"])))
+    while len(people) < users:  # resto de la división entera
+        n += 1
+        people.append((f"p{n:06d}@{DOMAIN}", f"Persona {n:06d}", "Colaborador", "UNIDAD 000",
+                       f"lider.u000@{DOMAIN}", "Asistente"))
+    return people
+
+
+def generate(path, users=1000, units=20, weeks=26, seed=42, checkin_rate=0.7,
+             faro_rate=0.3, journal_rate=0.4, end=None, verbose=True):
+    """Crear (o reemplazar) la BD en `path`. Devuelve un dict con el conteo por tabla."""
+    import database as db
+    rng = random.Random(seed)
+    ids_rng = random.Random(seed)   # azar de los ids aparte: no altera los datos generados
+    nuevo_id = lambda d: db.nuevo_id(d, ids_rng)
+    end = end or datetime.now().replace(microsecond=0)
+    start = end - timedelta(weeks=weeks)
+    db.close_pool()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    prev_path = db.DB_PATH
+    db.DB_PATH = path
+    try:
+        db.init_db()
+        t0 = time.perf_counter()
+        people = build_people(rng, users, units)
+        claves = [db._hash_inicial() for _ in people]   # sal propia por cuenta
+        now = end.isoformat()
+        counts = {}
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usuarios (email,nombre,rol,estado,unidad,email_lider,fecha_registro,ultimo_acceso,"
+                "password,must_change_password) VALUES (?,?,?,'Activo',?,?,?,?,?,1)",
+                [(e, n, r, u, l, now, now, c) for (e, n, r, u, l, _), c in zip(people, claves)])
+            conn.executemany(
+                "INSERT INTO identidad (email,nombre,puesto,rol,unidad,estado,email_lider,fecha_ingreso,fecha_actualizacion) "
+                "VALUES (?,?,?,?,?,'Activo',?,?,?)",
+                [(e, n, p, r, u, l, start.date().isoformat(), now) for e, n, r, u, l, p in people])
+            counts["usuarios"] = len(people)
+
+            emails = [p[0] for p in people]
+            names = {p[0]: p[1] for p in people}
+            checkins, faros, journal, ejlog, notifs = [], [], [], [], []
+            for w in range(weeks):
+                monday = start + timedelta(weeks=w)
+                for e in emails:
+                    if rng.random() < checkin_rate:
+                        d = monday + timedelta(days=rng.randrange(5), hours=rng.randrange(8, 19),
+                                               minutes=rng.randrange(60))
+                        estres = rng.choices([1, 2, 3, 4, 5], [2, 4, 4, 2, 1])[0]
+                        checkins.append((nuevo_id(d), e, rng.choice(ESTADOS), estres,
+                                         rng.choice(AREAS), ",".join(rng.sample(ETIQUETAS, 2)), "",
+                                         d.isoformat(), db.semana_key(d), 1 if estres >= 4 else 0))
+                    if rng.random() < faro_rate:
+                        r = rng.choice(emails)
+                        tipo, pilar, animal = rng.choice(TIPOS)
+                        d = monday + timedelta(days=rng.randrange(7), seconds=rng.randrange(86400))
+                        faros.append((nuevo_id(d), e, names[e], r, names[r], tipo, pilar,
+                                      animal, _frase(rng), "", d.isoformat(), "Aprobado", "",
+                                      d.isoformat(), rng.randrange(6), 1))
+                    if rng.random() < journal_rate:
+                        d = monday + timedelta(days=rng.randrange(7), seconds=rng.randrange(86400))
+                        journal.append((nuevo_id(d), e, d.isoformat(),
+                                        ",".join(rng.sample(ETIQUETAS, 2)), rng.randint(1, 10),
+                                        _frase(rng, 6), _frase(rng, 8), _frase(rng, 8), "", 0,
+                                        rng.choice(CONTEXTOS), DIAS[d.weekday()],
+                                        "Mañana" if d.hour < 12 else "Tarde" if d.hour < 18 else "Noche"))
+                    if rng.random() < 0.15:
+                        d = monday + timedelta(days=rng.randrange(7), seconds=rng.randrange(86400))
+                        ejlog.append((nuevo_id(d), e, f"EJ{rng.randint(1, 22):02d}", d.isoformat(),
+                                      rng.randint(3, 15), rng.randint(1, 5), "", "", "", "Autorregulación"))
+                    if rng.random() < 0.2:
+                        d = monday + timedelta(days=rng.randrange(7), seconds=rng.randrange(86400))
+                        notifs.append((f"SYN_N_{len(notifs)}", e, rng.choice(["Recordatorio", "Faro", "Sistema"]),
+                                       "Aviso", _frase(rng, 6), d.isoformat(), int(w < weeks - 2), "Media"))
+
+            conn.executemany("INSERT INTO checkins (checkin_id,email,estado_general,nivel_estres,area_preocupacion,"
+                             "etiquetas,comentario,fecha,semana,alerta_enviada) VALUES (?,?,?,?,?,?,?,?,?,?)", checkins)
+            conn.executemany("INSERT INTO faros (faro_id,email_emisor,nombre_emisor,email_receptor,nombre_receptor,"
+                             "tipo_faro,pilar,animal,mensaje,foto_url,fecha_envio,estado,email_aprobador,"
+                             "fecha_aprobacion,celebraciones,visible) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", faros)
+            conn.executemany("INSERT INTO journal (journal_id,email,fecha,emociones,intensidad,trigger_text,"
+                             "pensamiento,reflexion,estrategia,efectividad,contexto,dia_semana,hora_dia) "
+                             "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", journal)
+            conn.executemany("INSERT INTO ejercicios_log (log_id,email,ejercicio_id,fecha,duracion_real,efectividad,"
+                             "estado_antes,estado_despues,notas,competencia) VALUES (?,?,?,?,?,?,?,?,?,?)", ejlog)
+            conn.executemany("INSERT INTO notificaciones (notif_id,email_dest,tipo,titulo,mensaje,fecha,leida,prioridad) "
+                             "VALUES (?,?,?,?,?,?,?,?)", notifs)
+            counts.update(checkins=len(checkins), faros=len(faros), journal=len(journal),
+                          ejercicios_log=len(ejlog), notificaciones=len(notifs))
+
+            # Evaluaciones mensuales: hexágono para quien lidera, brújula para ~la mitad
+            hexa, bruj, logros = [], [], []
+            months = sorted({(start + timedelta(days=d)).strftime("%Y-%m") for d in range(0, weeks * 7, 7)})
+            lideres = [p[0] for p in people if p[2] in ("Admin", "Líder", "Coordinador")]
+            for periodo in months:
+                fecha = f"{periodo}-15T10:00:00"
+                d = datetime.fromisoformat(fecha)
+                for e in lideres:
+                    v = [rng.randint(1, 5) for _ in range(6)]
+                    hexa.append((nuevo_id(d), e, periodo, fecha, *v, round(sum(v) / 6, 2), "",
+                                 "Visión Corporativa", "Reconocimiento"))
+                for e in emails:
+                    if rng.random() < 0.5:
+                        v = [rng.randint(1, 5) for _ in range(5)]
+                        bruj.append((nuevo_id(d), e, periodo, fecha, *v, round(sum(v) / 5, 2),
+                                     "Empatía", "Motivación", "", rng.randrange(5), rng.randrange(8)))
+            for e in emails:
+                if rng.random() < 0.3:
+                    logros.append((nuevo_id(start), e, "FIRST_FARO", "🔦 Primer Faro", "Encendiste tu primer faro",
+                                   10, "Cultura", start.isoformat(), "🔦"))
+            conn.executemany("INSERT INTO hexagono (eval_id,email,periodo,fecha,vision,planificacion,encaje,"
+                             "entrenamiento,evaluacion_mejora,reconocimiento,promedio,reflexion,dim_baja,dim_alta) "
+                             "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", hexa)
+            conn.executemany("INSERT INTO brujula_eval (brujula_id,email,periodo,fecha,autoconocimiento,"
+                             "autorregulacion,motivacion,empatia,habilidades_sociales,promedio,comp_baja,comp_alta,"
+                             "reflexion,ejercicios_mes,journal_mes) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", bruj)
+            conn.executemany("INSERT INTO logros (logro_id,email,badge_id,nombre_badge,descripcion,puntos,"
+                             "categoria,fecha,icono) VALUES (?,?,?,?,?,?,?,?,?)", logros)
+            counts.update(hexagono=len(hexa), brujula_eval=len(bruj), logros=len(logros))
+
+            # Historial del planificador: una corrida diaria de cada tarea
+            corridas = [(t, (start + timedelta(days=d, hours=3)).isoformat(), rng.uniform(1, 50), rng.randrange(100), None)
+                        for d in range(weeks * 7) for t in sorted(db._tareas)]
+            conn.executemany("INSERT INTO tareas_log (tarea, inicio, duracion_ms, filas, error) VALUES (?,?,?,?,?)",
+                             corridas)
+            counts["tareas_log"] = len(corridas)
+            db.rebuild_metrics(conn)
+            db.sync_points_from_logros(conn)
+            db.rebuild_hierarchy(conn)
+            db.rebuild_team_feed(conn)
+            db.rebuild_wellbeing_cube(conn)
+            db.rebuild_badges(conn)
+        with db.get_db() as conn:
+            conn.execute("ANALYZE")
+        if verbose:
+            print(f"BD sintética {path}: {counts} en {time.perf_counter() - t0:.1f}s")
+        return counts
+    finally:
+        db.close_pool()
+        db.DB_PATH = prev_path
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Generar una BD sintética de Ítaca OS")
+    ap.add_argument("path")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--units", type=int, default=20)
+    ap.add_argument("--weeks", type=int, default=26)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--end", type=datetime.fromisoformat, default=None,
+                    help="fecha final de la historia (ISO); por defecto ahora")
+    a = ap.parse_args()
+    os.environ.setdefault("ITACA_DB_PATH", os.path.abspath(a.path))
+    generate(a.path, a.users, a.units, a.weeks, a.seed, end=a.end)
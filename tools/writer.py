@@ -0,0 +1,34 @@
+"""
+Proceso escritor único: aplica las escrituras de todos los procesos de
+Streamlit del host en transacciones agrupadas (ver database.serve_writer).
+
+    python -m tools.writer --socket /tmp/itaca-writer.sock
+    ITACA_WRITER_SOCKET=/tmp/itaca-writer.sock streamlit run app.py
+
+La BD es la de ITACA_DB_PATH, igual que la de la app.
+"""
+import argparse, signal, sys
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--socket", default=None, help="ruta del socket Unix (por defecto ITACA_WRITER_SOCKET)")
+    ap.add_argument("--batch", type=int, default=None, help="máximo de escrituras por transacción")
+    a = ap.parse_args()
+    import database as db
+    # SIGTERM (systemd, supervisores) termina igual que Ctrl+C: borra el socket e imprime el resumen
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        db.serve_writer(a.socket, a.batch or db.WRITER_BATCH)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        s = db.writer_stats()
+        print(f"{s['escrituras']} escrituras en {s['lotes']} lotes "
+              f"({s['escrituras'] / max(s['lotes'], 1):.1f} por commit), {s['errores']} con error")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())